@@ -0,0 +1,248 @@
+"""core 的 asyncio 介面：單一事件迴圈即可驅動大量下載工作
+
+yt-dlp 本身是阻塞的，擷取與下載在有上限的執行緒池中執行（settings.json 的
+async_extract_workers），超過上限的工作在池中排隊而不佔用執行緒；ffmpeg 與
+ffprobe 以 asyncio 子行程執行。取消呼叫端的 task 會中斷 yt-dlp 並終止子行程。
+
+用法：
+    async for event in async_core.download(url, format_planner.make_request(height=1080)):
+        print(event)
+
+事件與 YouTubeDownloader 的 progress_hook 相同（不含 info_dict），
+最後一個事件為 {'status': 'done', 'title', 'file', 'job_id'}。
+"""
+import os
+import asyncio
+import logging
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import core
+import atomic_files
+import metrics
+import media_probe
+import segment_encode
+import format_planner
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+_DONE = object()
+
+
+def get_executor():
+    """yt-dlp 擷取與下載共用的執行緒池（延遲建立，大小依設定）"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = core.load_settings()['async_extract_workers']
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ytdlp')
+        return _executor
+
+
+async def _run_blocking(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), functools.partial(func, *args, **kwargs))
+
+
+async def _terminate(process, timeout=5):
+    """終止子行程：先 terminate，逾時後 kill"""
+    if process.returncode is not None:
+        return
+    try:
+        process.terminate()
+        await asyncio.wait_for(process.wait(), timeout)
+    except ProcessLookupError:
+        pass
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+
+
+class _HookQueue:
+    """把其他執行緒呼叫的 progress hook 事件轉送到事件迴圈"""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.queue = asyncio.Queue()
+
+    def hook(self, d):
+        event = {k: v for k, v in d.items() if k != 'info_dict'}
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, event)
+
+    async def drain(self, future):
+        """逐一產生事件直到 future 完成（完成前送出的事件都會先產生）"""
+        future.add_done_callback(lambda f: self.queue.put_nowait(_DONE))
+        while True:
+            event = await self.queue.get()
+            if event is _DONE:
+                return
+            yield event
+
+
+async def fetch_info(url):
+    """core.fetch_info 的非同步版本（在執行緒池中擷取）"""
+    return await _run_blocking(core.fetch_info, url)
+
+
+async def probe(file_path, job_id=None):
+    """media_probe.probe 的非同步版本，與同步版本共用快取"""
+    key, info = media_probe.lookup(file_path)
+    if key is None or info is not None:
+        return info
+
+    try:
+        with metrics.span(job_id, 'ffprobe', bytes=key[1]) as span:
+            process = await asyncio.create_subprocess_exec(
+                *media_probe.probe_command(file_path),
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL)
+            try:
+                stdout, _ = await asyncio.wait_for(process.communicate(), 30)
+            finally:
+                await _terminate(process)
+            span['exit_code'] = process.returncode
+        if process.returncode != 0:
+            return None
+        return media_probe.store(key, file_path, stdout.decode('utf-8', 'replace'))
+    except (OSError, asyncio.TimeoutError, ValueError):
+        return None
+
+
+async def run_ffmpeg(command, total_frames=None):
+    """執行帶 -progress pipe:1 的 ffmpeg 命令並逐一產生進度事件
+
+    迭代中止（task 取消或 aclose）時終止 ffmpeg；非零結束碼拋出 RuntimeError。
+    """
+    process = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE)
+    try:
+        state = {}
+        async for raw in process.stdout:
+            key, _, value = raw.decode('utf-8', 'replace').strip().partition('=')
+            state[key] = value
+            if key == 'progress':
+                yield core.ffmpeg_progress_event(state, total_frames)
+        await process.wait()
+    finally:
+        await _terminate(process)
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg返回錯誤碼 {process.returncode}")
+
+
+def _encode_parallel(job_id, args, progress_hook):
+    """在執行緒池中分段平行編碼；片段行程登記在 job_id 下"""
+    with metrics.activate(job_id):
+        return segment_encode.encode_parallel(*args, run_ffmpeg=core.run_ffmpeg, progress_hook=progress_hook)
+
+
+async def add_watermark(input_file, output_file, job_id=None):
+    """非同步添加浮水印並逐一產生進度事件；FFmpeg 或浮水印不可用、編碼失敗或輸出檢查
+    未通過時拋出 RuntimeError
+
+    分段平行編碼（settings.json 的 parallel_watermark）的片段行程登記在 job_id 下，
+    取消 task 時一併終止；沒有 job_id 時無法區分行程，一律使用單一 ffmpeg 行程。
+    """
+    # 先以非同步 ffprobe 填好快取，prepare_watermark 內的探測就不會阻塞
+    await probe(input_file, job_id)
+    temp_file = atomic_files.part_path(output_file)
+    job = await _run_blocking(core.prepare_watermark, input_file, temp_file,
+                              parallel=None if job_id is not None else False)
+    if job is None:
+        raise RuntimeError("FFmpeg 或浮水印圖片不可用")
+    try:
+        encoded = False
+        if job['parallel']:
+            loop = asyncio.get_running_loop()
+            hooks = _HookQueue(loop)
+            with metrics.span(job_id, 'watermark', encoder=job['encoder'], mode='parallel') as span:
+                future = loop.run_in_executor(get_executor(), _encode_parallel, job_id, job['parallel'],
+                                              hooks.hook)
+                try:
+                    async for event in hooks.drain(future):
+                        yield event
+                finally:
+                    if not future.done():
+                        # 取消：終止片段行程（會等待行程結束，不在事件迴圈中執行）
+                        await loop.run_in_executor(None, core.terminate_processes, job_id)
+                encoded = future.result()
+                span['exit_code'] = 0 if encoded else 1
+            if not encoded:
+                logger.warning("⚠️ 分段編碼失敗，改用單一行程編碼")
+        if not encoded:
+            with metrics.span(job_id, 'watermark', encoder=job['encoder'], mode='async') as span:
+                async for event in run_ffmpeg(job['command'], job['total_frames']):
+                    yield event
+                span['exit_code'] = 0
+                span['bytes'] = os.path.getsize(temp_file)
+    except BaseException:
+        # 失敗或取消：不留下未完成的暫存檔
+        atomic_files.discard(temp_file)
+        raise
+    if not await _run_blocking(core.finalize_watermark, input_file, temp_file, output_file, job):
+        raise RuntimeError("浮水印檢查未通過")
+
+
+class _DownloadStep(core.YouTubeDownloader):
+    """只在執行緒中下載；浮水印由事件迴圈以子行程處理，預留的磁碟空間保留到處理完成"""
+
+    def download(self, url, format_request):
+        self.last_job_id = metrics.start_job(url)
+        self.last_plan = None
+        with metrics.activate(self.last_job_id):
+            return self._download_with_retry(url, format_request, self.last_job_id)
+
+    def _finish(self, info, video_title, file_path, is_audio_only):
+        if is_audio_only:
+            # 音訊處理多半只是串流複製，在下載執行緒中完成（行程已登記，可被取消）
+            return super()._finish(info, video_title, file_path, is_audio_only)
+        return info, video_title, file_path
+
+
+async def download(url, format_request=None):
+    """下載影片並逐一產生進度事件；取消 task 時中斷下載並終止 ffmpeg
+
+    Raises:
+        core.DownloadCancelled: 下載被取消
+        Exception: 重試後仍失敗的下載錯誤（同 YouTubeDownloader.download）
+    """
+    if format_request is None:
+        format_request = format_planner.make_request()
+    hooks = _HookQueue(asyncio.get_running_loop())
+    # 建構時會檢查 ffmpeg（阻塞），同樣在執行緒池中進行
+    downloader = await _run_blocking(_DownloadStep, hooks.hook)
+    future = asyncio.get_running_loop().run_in_executor(
+        get_executor(), downloader.download, url, format_request)
+    try:
+        async for event in hooks.drain(future):
+            yield event
+        info, title, file_path = future.result()
+        job_id = downloader.last_job_id
+
+        if not format_request['audio_only'] and core.watermark_function:
+            yield {'status': 'processing', 'message': '正在添加浮水印...'}
+            watermarked_path = os.path.splitext(file_path)[0] + '_watermarked.mp4'
+            try:
+                async for event in add_watermark(file_path, watermarked_path, job_id):
+                    yield event
+            except (OSError, RuntimeError) as e:
+                logger.error("❌ 添加浮水印失敗：%s", e)
+                yield {'status': 'processing', 'message': '浮水印添加失敗，使用原始文件'}
+            else:
+                os.remove(file_path)
+                file_path = watermarked_path
+        # 直接使用下載檔時補上校驗值（浮水印與音訊階段換名時已記錄）
+        await _run_blocking(atomic_files.record_existing, file_path, 'download', downloader.stream_hasher)
+        yield {'status': 'done', 'title': title, 'file': file_path, 'job_id': job_id}
+    finally:
+        if not future.done():
+            downloader.cancel()
+
+        def release(f):
+            # 下載執行緒結束後才釋放預留空間；取消時的例外在這裡取出，避免未處理警告
+            downloader.budget.release(downloader.last_job_id)
+            if not f.cancelled():
+                f.exception()
+
+        future.add_done_callback(release)
@@ -0,0 +1,273 @@
+"""輸出檔的原子完成與校驗清單（manifest）
+
+每個處理階段先寫入同資料夾的暫存檔 <名稱>.part.<副檔名>（ffmpeg 仍可由副檔名判斷
+格式，library_index 也會略過），完成後以 finalize 計算 SHA-256 並 fsync，再以
+os.replace 原子換名。中斷時只會留下 .part 檔，不會出現看似完成的截斷檔案。
+
+校驗值連同大小與修改時間記錄在 manifest.db，之後的去重與驗證只要檔案未變動
+就不必重新雜湊。
+
+ffmpeg 在結束前會回頭改寫容器檔頭（mp4 的 mdat 大小、mkv 的 Segment 大小等），
+檔案在產生過程中不是依序寫入，無法邊寫邊雜湊；因此在 ffmpeg 結束後、資料仍在
+頁面快取時以單次循序讀取同時完成雜湊與 fsync，之後不再讀取。
+
+yt-dlp 的 HTTP/分段下載是依序附加寫入，單一格式的下載由 StreamHasher 在下載途中
+讀取剛寫入（仍在頁面快取）的部分累加雜湊，完成後 record_existing 不必再讀一次
+整個檔案。需要合併的下載（影像+音訊）最後由 ffmpeg 產生，仍需在完成後讀取一次。
+"""
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'manifest.db')
+PART_SUFFIX = '.part'
+CHUNK_SIZE = 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    stage TEXT,
+    recorded REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_sha256 ON files (sha256);
+"""
+
+
+def part_path(final_path):
+    """final_path 對應的暫存路徑（同資料夾，保留副檔名）"""
+    base, ext = os.path.splitext(final_path)
+    return base + PART_SUFFIX + ext
+
+
+def discard(temp_path):
+    """刪除失敗階段留下的暫存檔"""
+    try:
+        os.remove(temp_path)
+    except FileNotFoundError:
+        pass
+
+
+def _fsync_dir(folder):
+    # Windows 無法開啟資料夾做 fsync，os.replace 本身已是原子操作
+    if os.name == 'nt':
+        return
+    fd = os.open(folder or '.', os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def hash_and_sync(path):
+    """單次循序讀取計算 SHA-256，並將檔案內容寫入磁碟；返回 (sha256, 大小)"""
+    digest = hashlib.sha256()
+    buffer = bytearray(CHUNK_SIZE)
+    view = memoryview(buffer)
+    size = 0
+    # 以可寫模式開啟：Windows 的 fsync 需要寫入權限
+    with open(path, 'r+b', buffering=0) as f:
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            digest.update(view[:n])
+            size += n
+        os.fsync(f.fileno())
+    return digest.hexdigest(), size
+
+
+class Manifest:
+    """校驗值清單；每個執行緒使用自己的連線（WAL，可被多個行程共用）"""
+
+    def __init__(self, path=DEFAULT_DB):
+        self.path = path
+        self._local = threading.local()
+        self._connect().executescript(SCHEMA)
+
+    def _connect(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return db
+
+    def record(self, path, sha256, stage=None):
+        """記錄檔案目前版本的校驗值"""
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        self._connect().execute(
+            'INSERT OR REPLACE INTO files (path, size, mtime_ns, sha256, stage, recorded) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (path, st.st_size, st.st_mtime_ns, sha256, stage, time.time()))
+
+    def lookup(self, path):
+        """檔案未變動時返回記錄的 SHA-256，否則返回 None"""
+        path = os.path.abspath(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        row = self._connect().execute('SELECT size, mtime_ns, sha256 FROM files WHERE path = ?',
+                                      (path,)).fetchone()
+        if row is None or (row['size'], row['mtime_ns']) != (st.st_size, st.st_mtime_ns):
+            return None
+        return row['sha256']
+
+    def find_digest(self, sha256):
+        """內容相同的已記錄檔案（去重用），只返回仍存在且未變動的路徑"""
+        rows = self._connect().execute('SELECT path FROM files WHERE sha256 = ?', (sha256,)).fetchall()
+        return [row['path'] for row in rows if self.lookup(row['path']) == sha256]
+
+    def verify(self, path):
+        """重新雜湊並與記錄比對；返回 True/False，沒有記錄時返回 None"""
+        path = os.path.abspath(path)
+        row = self._connect().execute('SELECT sha256 FROM files WHERE path = ?', (path,)).fetchone()
+        if row is None:
+            return None
+        return hash_and_sync(path)[0] == row['sha256']
+
+    def forget(self, path):
+        self._connect().execute('DELETE FROM files WHERE path = ?', (os.path.abspath(path),))
+
+
+_manifest = None
+_manifest_lock = threading.Lock()
+
+
+def get_manifest():
+    """程式共用的 manifest（延遲建立）"""
+    global _manifest
+    with _manifest_lock:
+        if _manifest is None:
+            _manifest = Manifest()
+        return _manifest
+
+
+def _sync(path):
+    with open(path, 'r+b', buffering=0) as f:
+        os.fsync(f.fileno())
+
+
+class StreamHasher:
+    """以 yt-dlp 的 progress hook 在下載途中累加 SHA-256
+
+    每累積 HASH_STEP 位元組讀取一次 .part 檔新寫入的部分（每次重新開啟，不妨礙
+    yt-dlp 換名）。下載從頭重來時重新計算；完成時記錄最終檔案的大小、修改時間與
+    雜湊值，record_existing 比對一致才採用。enabled 為 False 時不做任何事
+    （例如需要合併的下載，最終檔案由 ffmpeg 產生）。
+    """
+
+    HASH_STEP = 8 * CHUNK_SIZE
+
+    def __init__(self):
+        self.enabled = True
+        self.results = {}  # {最終檔案絕對路徑: (大小, mtime_ns, sha256)}
+        self._reset(None)
+
+    def _reset(self, path):
+        self._path = path
+        self._digest = hashlib.sha256()
+        self._offset = 0
+
+    def _feed(self, path):
+        """讀取 path 從目前位移到檔案結尾的內容；yt-dlp 可能還有資料在緩衝區，讀到的是已寫入的部分"""
+        with open(path, 'rb', buffering=0) as f:
+            f.seek(self._offset)
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                self._digest.update(chunk)
+                self._offset += len(chunk)
+
+    def progress_hook(self, d):
+        if not self.enabled:
+            return
+        try:
+            if d.get('status') == 'downloading':
+                path = d.get('tmpfilename') or d.get('filename')
+                done = d.get('downloaded_bytes')
+                if not path or done is None:
+                    return
+                if path != self._path or done < self._offset:
+                    self._reset(path)
+                if done - self._offset >= self.HASH_STEP:
+                    self._feed(path)
+            elif d.get('status') == 'finished' and self._path is not None:
+                # .part 已換名為最終檔案，讀完剩下的部分
+                path = d.get('filename')
+                self._feed(path)
+                st = os.stat(path)
+                if st.st_size == self._offset:
+                    self.results[os.path.abspath(path)] = (st.st_size, st.st_mtime_ns,
+                                                           self._digest.hexdigest())
+                self._reset(None)
+        except OSError as e:
+            # 無法邊下載邊讀取時改由 record_existing 完整讀取
+            logger.debug("Incremental hash failed: %s", e)
+            self._reset(None)
+
+    def lookup(self, path):
+        """下載途中算好且檔案之後未變動時返回 SHA-256，否則返回 None"""
+        entry = self.results.get(os.path.abspath(path))
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if entry is None or entry[:2] != (st.st_size, st.st_mtime_ns):
+            return None
+        return entry[2]
+
+
+def _record(path, digest, stage):
+    try:
+        get_manifest().record(path, digest, stage)
+    except (OSError, sqlite3.Error) as e:
+        # 記錄失敗不影響輸出檔本身
+        logger.warning("無法寫入校驗清單：%s", e)
+
+
+def finalize(temp_path, final_path, stage=None):
+    """雜湊並 fsync 暫存檔，原子換名為 final_path 並記錄校驗值；返回 SHA-256"""
+    with metrics.span(metrics.current_job(), 'finalize', stage=stage) as span:
+        digest, size = hash_and_sync(temp_path)
+        os.replace(temp_path, final_path)
+        _fsync_dir(os.path.dirname(os.path.abspath(final_path)))
+        span['bytes'] = size
+    _record(final_path, digest, stage)
+    logger.debug("Finalized %s (%d bytes, sha256 %s)", final_path, size, digest)
+    return digest
+
+
+def record_existing(path, stage=None, hasher=None):
+    """記錄已由其他程式換名完成的檔案（例如 yt-dlp 從 .part 換名的下載）並 fsync；
+    已經由 finalize 記錄、或 hasher（StreamHasher）在下載途中已算好且檔案未變動時
+    不再讀取。返回 SHA-256
+    """
+    try:
+        digest = get_manifest().lookup(path)
+    except sqlite3.Error:
+        digest = None
+    if digest is not None:
+        return digest
+    digest = hasher.lookup(path) if hasher is not None else None
+    with metrics.span(metrics.current_job(), 'finalize', stage=stage, streamed=digest is not None) as span:
+        if digest is not None:
+            _sync(path)
+        else:
+            digest, span['bytes'] = hash_and_sync(path)
+    _record(path, digest, stage)
+    return digest
@@ -0,0 +1,176 @@
+"""純音訊輸出：依實際檔案的音訊編碼決定保留、換容器或轉碼
+
+yt-dlp 下載的純音訊串流通常已是可直接使用的檔案（m4a/AAC）；Opus 串流放在
+webm 裡，只需無損換成 .opus。只有編碼沒有對應的音訊容器、或開啟響度正規化
+時才需要重新編碼。響度分析（loudnorm 第一輪）結果依檔案快取，重複處理同一
+檔案時不必再分析。
+"""
+import os
+import json
+import logging
+import threading
+import subprocess
+
+import media_probe
+
+logger = logging.getLogger(__name__)
+
+# 音訊編碼 → 輸出副檔名（可無損放入的容器）
+OUTPUT_EXTENSIONS = {
+    'aac': '.m4a',
+    'alac': '.m4a',
+    'opus': '.opus',
+    'mp3': '.mp3',
+    'vorbis': '.ogg',
+    'flac': '.flac',
+}
+
+# 需要重新編碼時（響度正規化或無對應容器）使用的參數
+ENCODE_ARGS = {
+    'aac': ['-c:a', 'aac', '-b:a', '192k'],
+    'alac': ['-c:a', 'alac'],
+    'opus': ['-c:a', 'libopus', '-b:a', '160k'],
+    'mp3': ['-c:a', 'libmp3lame', '-b:a', '192k'],
+    'vorbis': ['-c:a', 'libvorbis', '-q:a', '5'],
+    'flac': ['-c:a', 'flac'],
+}
+
+# 響度正規化的真峰值與響度範圍（目標整合響度由設定 audio_loudnorm 指定）
+LOUDNORM_TP = -1.5
+LOUDNORM_LRA = 11
+
+LOUDNORM_CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                   'loudnorm_cache.json')
+_loudnorm_lock = threading.Lock()
+
+
+def plan_output(input_file, loudnorm=False, output_dir=None):
+    """決定音訊輸出方式
+
+    Args:
+        output_dir: 輸出資料夾，None 時輸出在來源旁邊（來源本身可能直接可用）
+
+    Returns:
+        dict：action 為 'none'（直接使用）、'remux'（串流複製）或 'transcode'，
+        codec 為輸出音訊編碼，output 為 ffmpeg 的輸出路徑，
+        replace 為 True 時 output 是暫存檔，完成後應取代來源；
+        沒有音訊或無法探測時返回 None
+    """
+    info = media_probe.probe(input_file)
+    streams = [s for s in info['streams'] if s['codec_type'] == 'audio'] if info else []
+    if not streams:
+        return None
+    codec = streams[0]['codec_name']
+    base, ext = os.path.splitext(input_file)
+    if output_dir is not None:
+        base = os.path.join(output_dir, os.path.basename(base))
+
+    if codec not in OUTPUT_EXTENSIONS:
+        action, codec = 'transcode', 'aac'
+    elif loudnorm:
+        action = 'transcode'
+    elif output_dir is None and ext.lower() == OUTPUT_EXTENSIONS[codec] \
+            and not media_probe.has_video(info) and len(streams) == 1:
+        action = 'none'
+    else:
+        action = 'remux'
+    output = base + OUTPUT_EXTENSIONS[codec] if action != 'none' else input_file
+    replace = output == input_file and action != 'none'
+    if replace:
+        # 與來源同名（例如同為 m4a 但需要正規化）：先寫入暫存名稱
+        output = base + '.norm' + OUTPUT_EXTENSIONS[codec]
+    return {'action': action, 'codec': codec, 'output': output, 'replace': replace,
+            'duration': info['duration'], 'sample_rate': streams[0].get('sample_rate')}
+
+
+def _cache_key(input_file, target):
+    st = os.stat(input_file)
+    return f'{os.path.abspath(input_file)}|{st.st_size}|{st.st_mtime_ns}|{target}'
+
+
+def _load_cache(cache_file):
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_cache(cache_file, data):
+    tmp_file = cache_file + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_file, cache_file)
+
+
+def measure_loudness(ffmpeg_path, input_file, target, cache_file=None):
+    """loudnorm 第一輪分析；結果依 (路徑, 大小, 修改時間, 目標) 快取
+
+    Returns:
+        loudnorm 輸出的量測值 dict（input_i、input_tp 等），分析失敗時返回 None
+    """
+    cache_file = cache_file or LOUDNORM_CACHE_FILE
+    try:
+        key = _cache_key(input_file, target)
+    except OSError:
+        return None
+    with _loudnorm_lock:
+        cached = _load_cache(cache_file).get(key)
+    if cached is not None:
+        return cached
+
+    result = subprocess.run([ffmpeg_path, '-hide_banner', '-nostats', '-i', input_file,
+                             '-map', '0:a:0', '-af',
+                             f'loudnorm=I={target}:TP={LOUDNORM_TP}:LRA={LOUDNORM_LRA}:print_format=json',
+                             '-f', 'null', '-'],
+                            capture_output=True, text=True, errors='replace')
+    # 量測結果是 stderr 最後一個 JSON 區塊
+    start = result.stderr.rfind('{')
+    if result.returncode != 0 or start < 0:
+        logger.warning("響度分析失敗：%s", input_file)
+        return None
+    try:
+        measured = json.loads(result.stderr[start:result.stderr.rindex('}') + 1])
+    except ValueError:
+        return None
+
+    with _loudnorm_lock:
+        cache = _load_cache(cache_file)
+        cache[key] = measured
+        try:
+            _save_cache(cache_file, cache)
+        except OSError:
+            pass
+    return measured
+
+
+def loudnorm_filter(target, measured):
+    """loudnorm 第二輪濾鏡（使用量測值做線性正規化）"""
+    return (f"loudnorm=I={target}:TP={LOUDNORM_TP}:LRA={LOUDNORM_LRA}"
+            f":measured_I={measured['input_i']}:measured_TP={measured['input_tp']}"
+            f":measured_LRA={measured['input_lra']}:measured_thresh={measured['input_thresh']}"
+            f":offset={measured['target_offset']}:linear=true")
+
+
+def build_command(ffmpeg_path, input_file, plan, audio_filter=None):
+    """輸出音訊的 ffmpeg 命令（含 -progress pipe:1）"""
+    command = [ffmpeg_path, '-hide_banner', '-nostats', '-progress', 'pipe:1', '-y',
+               '-i', input_file, '-map', '0:a:0', '-vn', '-map_metadata', '0']
+    if plan['action'] == 'remux':
+        command.extend(['-c:a', 'copy'])
+    else:
+        if audio_filter:
+            # loudnorm 內部升頻到 192 kHz，輸出時還原來源取樣率
+            command.extend(['-af', audio_filter, '-ar', str(plan['sample_rate'] or 48000)])
+        command.extend(ENCODE_ARGS[plan['codec']])
+    if plan['output'].endswith('.m4a'):
+        command.extend(['-movflags', '+faststart'])
+    command.append(plan['output'])
+    return command
+
+
+def run(ffmpeg_path, input_file, plan, audio_filter=None):
+    """以 subprocess.run 執行輸出命令（批次處理用，不回報進度）"""
+    return subprocess.run(build_command(ffmpeg_path, input_file, plan, audio_filter),
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                          text=True, errors='replace')
@@ -0,0 +1,124 @@
+"""url_canon 的隨機檢查與效能測試
+
+以隨機影片 ID 產生各種連結形式，確認每一個都解析回同一個 ID、
+干擾輸入不會被誤認，再測量單筆（未快取/已快取）與批次去重的速度。
+
+用法：python benchmarks/bench_canonicalize.py [--count 20000] [--seed 1]
+"""
+import os
+import sys
+import time
+import random
+import string
+import argparse
+from urllib.parse import quote
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import url_canon
+
+ID_CHARS = string.ascii_letters + string.digits + '-_'
+
+SHAPES = [
+    'https://www.youtube.com/watch?v={id}',
+    'http://youtube.com/watch?v={id}&t={t}s',
+    'www.youtube.com/watch?feature=share&v={id}&list=PL{id}',
+    'https://m.youtube.com/watch?v={id}#t={t}',
+    'https://music.youtube.com/watch?v={id}&si=abc',
+    'https://youtu.be/{id}',
+    'youtu.be/{id}?t={t}',
+    'https://www.youtube.com/shorts/{id}?feature=share',
+    'https://youtube.com/live/{id}',
+    'https://www.youtube.com/embed/{id}?start={t}',
+    'https://www.youtube-nocookie.com/embed/{id}',
+    'https://www.youtube.com/v/{id}',
+    'HTTPS://WWW.YOUTUBE.COM/watch?v={id}',
+    '  https://www.youtube.com/watch?v={id}  ',
+    '{id}',
+]
+
+NOISE = [
+    'https://example.com/watch?v={id}',
+    'https://www.youtube.com/watch?v={short}',
+    'https://www.youtube.com/playlist?list=PL{id}',
+    'https://www.youtube.com/@channel',
+    'not a url',
+    '',
+]
+
+
+def random_id(rng):
+    return ''.join(rng.choice(ID_CHARS) for _ in range(11))
+
+
+def make_links(rng, count):
+    links = []
+    for _ in range(count):
+        video_id = random_id(rng)
+        shape = rng.choice(SHAPES)
+        links.append((shape.format(id=video_id, t=rng.randrange(1, 10000)), video_id))
+    for shape in SHAPES:
+        video_id = random_id(rng)
+        links.append(('https://www.youtube.com/attribution_link?u=' +
+                      quote('/watch?v=' + video_id), video_id))
+    return links
+
+
+def check(links, rng):
+    failures = 0
+    for link, expected in links:
+        result = url_canon.canonicalize(link)
+        if result.video_id != expected or result.url != f'https://www.youtube.com/watch?v={expected}':
+            failures += 1
+            print(f"FAIL {link!r}: {result}")
+    for shape in NOISE:
+        link = shape.format(id=random_id(rng), short=random_id(rng)[:8])
+        result = url_canon.canonicalize(link)
+        if result.video_id is not None or result.error is None:
+            failures += 1
+            print(f"FAIL noise {link!r}: {result}")
+    return failures
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    links = make_links(rng, args.count)
+    failures = check(links, rng)
+
+    raw = [link for link, _ in links]
+    # 重複貼上的情境：每個連結出現兩次並打亂
+    pasted = raw + raw
+    rng.shuffle(pasted)
+
+    url_canon.canonicalize.cache_clear()
+    cold = timed(lambda: [url_canon.canonicalize(link) for link in raw])
+    # 快取上限 4096 筆，只以前 2000 筆測量命中的情況
+    hot = raw[:2000]
+    for link in hot:
+        url_canon.canonicalize(link)
+    warm = timed(lambda: [url_canon.canonicalize(link) for link in hot])
+    url_canon.canonicalize.cache_clear()
+    batch = timed(lambda: url_canon.canonicalize_many(pasted))
+    result = url_canon.canonicalize_many(pasted)
+
+    print(f"links={len(raw)} failures={failures}")
+    print(f"cold   {cold / len(raw) * 1e6:8.2f} us/link")
+    print(f"cached {warm / len(hot) * 1e6:8.2f} us/link")
+    print(f"batch  {batch * 1000:8.1f} ms for {len(pasted)} links "
+          f"({len(result['unique'])} unique, {result['duplicates']} duplicates)")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
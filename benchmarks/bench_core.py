@@ -0,0 +1,208 @@
+"""core 下載與後處理流程的離線基準測試
+
+以本地 HTTP 伺服器與假 yt-dlp 擷取器提供 lavfi 產生的串流，不需要網路。
+每個測試案例在獨立的子行程中執行，以取得準確的峰值記憶體與子行程數。
+
+用法：
+    python benchmarks/bench_core.py                      # 執行並與 baselines.json 比較
+    python benchmarks/bench_core.py --update-baseline    # 以本次結果更新基準
+    python benchmarks/bench_core.py --cases audio_only,watermark_360p --seconds 3
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fixtures
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+
+# 各指標允許的退步幅度（相對於基準值）
+TOLERANCES = {
+    'wall_s': 0.25,
+    'peak_rss_mb': 0.20,
+    'subprocesses': 0.0,
+    'disk_bytes': 0.10,
+}
+
+FORMAT_TEMPLATE = 'bestvideo[height<={h}][vcodec^=avc]+bestaudio[ext=m4a]/best[height<={h}]'
+
+
+def list_cases():
+    cases = [('get_video_info', 'info', 360)]
+    cases += [(f'download_{h}p', 'download', h) for h in fixtures.HEIGHTS]
+    cases += [(f'watermark_{h}p', 'watermark', h) for h in fixtures.HEIGHTS]
+    cases.append(('audio_only', 'audio', 360))
+    return cases
+
+
+def _rusage_peak_mb(usage):
+    # Linux 的 ru_maxrss 單位為 KB，macOS 為 bytes
+    divisor = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return usage.ru_maxrss / divisor
+
+
+def _dir_size(path):
+    total = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def _run_case(kind, height, ctx, queue):
+    """在子行程中執行單一案例並回傳指標"""
+    import resource
+    import subprocess
+
+    case_dir = tempfile.mkdtemp(dir=ctx['workdir'])
+    os.chdir(case_dir)
+
+    # 計算 core 啟動的子行程數（subprocess.run 也經由 Popen）
+    spawned = [0]
+    original_init = subprocess.Popen.__init__
+
+    def counting_init(self, *args, **kwargs):
+        spawned[0] += 1
+        original_init(self, *args, **kwargs)
+
+    fixtures.install_stub_extractor(ctx['base_url'], ctx['media_root'], ctx['catalog'])
+    import core
+    core.watermark_function = False
+    core.LOGO_PATH = ctx['logo']
+    url = f'https://www.youtube.com/watch?v={fixtures.video_id_for(height)}'
+    subprocess.Popen.__init__ = counting_init
+
+    start = time.perf_counter()
+    if kind == 'info':
+        for _ in range(ctx['repeat']):
+            core.get_video_info(url)
+    elif kind == 'download':
+        core.YouTubeDownloader().download(url, FORMAT_TEMPLATE.format(h=height))
+    elif kind == 'audio':
+        core.YouTubeDownloader().download(url, 'bestaudio/best')
+    elif kind == 'watermark':
+        source = os.path.join(ctx['media_root'], ctx['catalog'][fixtures.video_id_for(height)]['muxed'])
+        if not core.add_watermark(source, os.path.join(case_dir, 'out.mp4')):
+            raise RuntimeError('add_watermark failed')
+    wall = time.perf_counter() - start
+
+    subprocess.Popen.__init__ = original_init
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    child_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    output_bytes = _dir_size(case_dir)
+    queue.put({
+        'wall_s': round(wall, 3),
+        'throughput_mb_s': round(output_bytes / wall / 1024 / 1024, 2) if wall > 0 else 0.0,
+        'peak_rss_mb': round(max(_rusage_peak_mb(self_usage), _rusage_peak_mb(child_usage)), 1),
+        'subprocesses': spawned[0],
+        # ru_oublock 以 512 bytes 區塊計算，包含 ffmpeg 等子行程的寫入
+        'disk_bytes': (self_usage.ru_oublock + child_usage.ru_oublock) * 512,
+        'output_bytes': output_bytes,
+    })
+
+
+def run_case(kind, height, ctx):
+    spawn = multiprocessing.get_context('spawn')
+    queue = spawn.Queue()
+    process = spawn.Process(target=_run_case, args=(kind, height, ctx, queue))
+    process.start()
+    process.join()
+    if process.exitcode != 0 or queue.empty():
+        return None
+    return queue.get()
+
+
+def compare(results, baselines):
+    """返回超出容許範圍的退步項目"""
+    regressions = []
+    for name, metrics in results.items():
+        base = baselines.get(name)
+        if not base:
+            continue
+        for key, tolerance in TOLERANCES.items():
+            if key in base and metrics[key] > base[key] * (1 + tolerance):
+                regressions.append(f'{name}.{key}: {metrics[key]} > {base[key]} (+{tolerance:.0%})')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cases', help='逗號分隔的案例名稱，預設全部')
+    parser.add_argument('--seconds', type=int, default=5, help='測試片段長度')
+    parser.add_argument('--repeat', type=int, default=20, help='get_video_info 重複次數')
+    parser.add_argument('--json', help='將結果寫入此檔案')
+    parser.add_argument('--update-baseline', action='store_true')
+    args = parser.parse_args()
+
+    selected = set(args.cases.split(',')) if args.cases else None
+    cases = [c for c in list_cases() if not selected or c[0] in selected]
+    heights = sorted({h for _, _, h in cases})
+
+    workdir = tempfile.mkdtemp(prefix='bench_core_')
+    media_root = os.path.join(workdir, 'media')
+    os.makedirs(media_root)
+    try:
+        catalog = fixtures.build_catalog(media_root, heights, args.seconds)
+        logo = os.path.join(workdir, 'logo.png')
+        fixtures.make_logo(logo)
+
+        # 先完成編碼器測速（結果會寫入快取），避免計入第一個浮水印案例
+        import encoders
+        encoders.select_encoder('ffmpeg', 'h264')
+
+        results = {}
+        with fixtures.MediaServer(media_root) as server:
+            ctx = {'workdir': workdir, 'media_root': media_root, 'catalog': catalog,
+                   'base_url': server.url, 'logo': logo, 'repeat': args.repeat}
+            for name, kind, height in cases:
+                metrics = run_case(kind, height, ctx)
+                if metrics is None:
+                    print(f"{name:20s} FAILED")
+                    continue
+                results[name] = metrics
+                print(f"{name:20s} " + ' '.join(f'{k}={v}' for k, v in metrics.items()))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'machine': {'platform': platform.platform(), 'cpus': os.cpu_count(),
+                    'python': platform.python_version()},
+        'seconds': args.seconds,
+        'results': results,
+    }
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+    if args.update_baseline:
+        with open(BASELINE_FILE, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"基準已更新：{BASELINE_FILE}")
+        return 0
+
+    if len(results) < len(cases):
+        return 1
+    if not os.path.exists(BASELINE_FILE):
+        print("尚無基準，請先以 --update-baseline 建立")
+        return 0
+
+    with open(BASELINE_FILE, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    if baseline.get('seconds') != args.seconds:
+        print(f"⚠️ 基準使用 {baseline.get('seconds')} 秒片段，與本次 {args.seconds} 秒不同，數據不可比較")
+    regressions = compare(results, baseline.get('results', {}))
+    for line in regressions:
+        print(f"❌ REGRESSION {line}")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,86 @@
+"""library_index 的增量掃描與搜尋速度
+
+建立 N 個空的媒體檔（預設 50000，分散在子資料夾），ffprobe 以固定結果代替
+（這裡只量測走訪、比對與寫入索引）。第二次掃描沒有變動的檔案，目標在 1 秒內。
+
+用法：python benchmarks/bench_library_scan.py [--files 50000] [--touch 100]
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import library_index
+
+TARGET_RESCAN_SECONDS = 1.0
+
+
+def fake_probe(path):
+    return {'vcodec': 'h264', 'acodec': 'aac', 'duration': 60.0, 'width': 1920, 'height': 1080}
+
+
+def build_tree(root, count, per_folder=1000):
+    for i in range(count):
+        folder = os.path.join(root, f'batch{i // per_folder:03d}')
+        if i % per_folder == 0:
+            os.makedirs(folder)
+        suffix = '_watermarked' if i % 3 == 0 else ''
+        with open(os.path.join(folder, f'Video {i} [{i:011d}]{suffix}.mp4'), 'wb'):
+            pass
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', type=int, default=50000)
+    parser.add_argument('--touch', type=int, default=100, help='files changed before the third scan')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_library_')
+    try:
+        root = os.path.join(workdir, 'Download')
+        os.makedirs(root)
+        build_tree(root, args.files)
+        index = library_index.LibraryIndex(os.path.join(workdir, 'library.db'), probe=fake_probe)
+
+        first, result = timed(index.scan, root)
+        print(f"first scan   {first:7.3f}s  {result}")
+        rescan, result = timed(index.scan, root)
+        print(f"rescan       {rescan:7.3f}s  {result}")
+
+        touched = 0
+        for folder, _, names in os.walk(root):
+            for name in names[:args.touch - touched]:
+                with open(os.path.join(folder, name), 'ab') as f:
+                    f.write(b'x')
+                touched += 1
+            if touched >= args.touch:
+                break
+        changed, result = timed(index.scan, root)
+        print(f"{touched} changed  {changed:7.3f}s  {result}")
+
+        for text in ('Video 4242', '00000012345', 'nothing matches', ''):
+            seconds, rows = timed(index.search, text, kind='video')
+            print(f"search {text!r:<20} {seconds * 1000:7.2f} ms  {len(rows)} rows")
+        seconds, rows = timed(index.search, '', watermarked=True)
+        print(f"filter watermarked    {seconds * 1000:7.2f} ms  {len(rows)} rows")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    ok = rescan <= TARGET_RESCAN_SECONDS
+    print(f"{'PASS' if ok else 'FAIL'} rescan of {args.files} files in {rescan:.3f}s "
+          f"(target {TARGET_RESCAN_SECONDS:.1f}s)")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""比較分段平行與單一行程加浮水印的耗時
+
+用法：python benchmarks/bench_parallel_watermark.py [--seconds 20] [--sizes 1920x1080,3840x2160]
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fixtures
+import core
+import encoders
+import media_probe
+import segment_encode
+
+
+def timed_watermark(source, output, parallel):
+    start = time.perf_counter()
+    ok = core.add_watermark(source, output, parallel=parallel)
+    return ok, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seconds', type=int, default=20)
+    parser.add_argument('--sizes', default='1920x1080,3840x2160')
+    args = parser.parse_args()
+
+    # 固定使用軟體編碼器，分段模式只對軟體編碼生效
+    encoders.select_encoder = lambda *a, **k: 'libx264'
+
+    workdir = tempfile.mkdtemp(prefix='bench_wm_')
+    try:
+        core.LOGO_PATH = os.path.join(workdir, 'logo.png')
+        fixtures.make_logo(core.LOGO_PATH)
+
+        print(f"workers={segment_encode.default_workers()}")
+        print(f"{'size':>10} {'single(s)':>10} {'parallel(s)':>12} {'speedup':>8} {'frames ok':>10}")
+        for size in args.sizes.split(','):
+            source = os.path.join(workdir, f'{size}.mp4')
+            fixtures.make_clip(source, size, args.seconds)
+
+            single_out = os.path.join(workdir, f'{size}_single.mp4')
+            parallel_out = os.path.join(workdir, f'{size}_parallel.mp4')
+            ok_single, single_time = timed_watermark(source, single_out, parallel=False)
+            ok_parallel, parallel_time = timed_watermark(source, parallel_out, parallel=True)
+            if not (ok_single and ok_parallel):
+                print(f"{size:>10} 編碼失敗 single={ok_single} parallel={ok_parallel}")
+                continue
+
+            frames_ok, _ = segment_encode.verify_output(media_probe.probe(single_out), parallel_out)
+            print(f"{size:>10} {single_time:>10.2f} {parallel_time:>12.2f} "
+                  f"{single_time / parallel_time:>7.2f}x {str(frames_ok):>10}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+"""佇列中 500 個項目時的峰值記憶體：影片資訊與縮圖
+
+每個案例在獨立的子行程中執行，回報工作前後的 RSS 與峰值（ru_maxrss）。
+
+- info_raw：保留 yt-dlp 完整的 info（所有格式、字幕、縮圖清單），即過去 download() 的返回值
+- info_trimmed：只保留 trim_info 的快取與 trim_download_info 的返回值
+- thumb_full：下載最大縮圖，完整解碼後再縮放（需要 PyQt6）
+- thumb_scaled：最小可用縮圖，以 QImageReader.setScaledSize 解碼（需要 PyQt6）
+
+info 與縮圖都是模擬資料，不需要網路。
+
+用法：python benchmarks/bench_queue_memory.py [--items 500] [--threads 32]
+"""
+import os
+import sys
+import argparse
+import resource
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MB = 1024 * 1024
+
+
+def _rss_mb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * resource.getpagesize() / MB
+
+
+def _peak_mb():
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage / MB if sys.platform == 'darwin' else usage / 1024
+
+
+def fake_info(index):
+    """接近 YouTube 擷取結果的 info：約 100 個格式、字幕清單與縮圖清單"""
+    video_id = f'vid{index:08d}'
+    base_url = f'https://rr1---sn-example.googlevideo.com/videoplayback?id={video_id}&' + 'x' * 900
+    formats = []
+    for n in range(100):
+        height = (144, 240, 360, 480, 720, 1080, 1440, 2160)[n % 8]
+        formats.append({
+            'format_id': str(100 + n), 'url': f'{base_url}&itag={n}', 'ext': 'mp4' if n % 2 else 'webm',
+            'vcodec': 'avc1.640028' if n % 3 else 'none', 'acodec': 'mp4a.40.2' if n % 3 == 0 else 'none',
+            'width': height * 16 // 9, 'height': height, 'fps': 30, 'tbr': 1000.0 + n, 'filesize': 10 ** 7 + n,
+            'protocol': 'https', 'format_note': f'{height}p', 'quality': n, 'has_drm': False,
+            'http_headers': {'User-Agent': 'Mozilla/5.0 ' + 'x' * 100, 'Accept': '*/*',
+                             'Accept-Language': 'en-us,en;q=0.5', 'Sec-Fetch-Mode': 'navigate'},
+            'downloader_options': {'http_chunk_size': 10485760}, 'container': 'mp4_dash',
+            'dynamic_range': 'SDR', 'source_preference': -1, 'language': None,
+        })
+    thumbnails = [{'url': f'https://i.ytimg.com/vi/{video_id}/{name}.jpg', 'preference': p, 'id': str(p)}
+                  for p, name in enumerate(['default', 'mqdefault', 'hqdefault', 'sddefault', 'maxresdefault'] * 8)]
+    captions = {f'lang{n}': [{'ext': ext, 'url': f'https://www.youtube.com/api/timedtext?v={video_id}&'
+                                                 + 'y' * 250, 'name': f'Language {n}'}
+                             for ext in ('json3', 'srv1', 'srv2', 'srv3', 'ttml', 'vtt')]
+                for n in range(150)}
+    return {'id': video_id, 'title': f'Video {index}', 'duration': 600, 'formats': formats,
+            'thumbnails': thumbnails, 'automatic_captions': captions, 'description': 'd' * 5000,
+            'format_id': '137+140', 'width': 1920, 'height': 1080, 'ext': 'mp4',
+            'requested_downloads': [{'filepath': f'Download/Video {index}.mp4', 'formats': formats[:2]}]}
+
+
+def run_info(items, trimmed):
+    import core
+    kept = []
+    for i in range(items):
+        info = fake_info(i)
+        if trimmed:
+            kept.append((core.cache_info(info), core.trim_download_info(info)))
+        else:
+            kept.append(info)
+    return len(kept)
+
+
+def _make_jpeg(width, height):
+    from PyQt6.QtCore import QBuffer, QIODevice
+    from PyQt6.QtGui import QImage, QPainter, QLinearGradient, QColor
+    image = QImage(width, height, QImage.Format.Format_RGB32)
+    gradient = QLinearGradient(0, 0, width, height)
+    gradient.setColorAt(0, QColor(200, 30, 30))
+    gradient.setColorAt(1, QColor(30, 30, 200))
+    painter = QPainter(image)
+    painter.fillRect(0, 0, width, height, gradient)
+    painter.end()
+    buffer = QBuffer()
+    buffer.open(QIODevice.OpenModeFlag.WriteOnly)
+    image.save(buffer, 'JPEG', 90)
+    return bytes(buffer.data())
+
+
+def run_thumbnails(items, threads, scaled):
+    from io import BytesIO
+    from PyQt6.QtCore import Qt, QByteArray, QBuffer, QIODevice
+    from PyQt6.QtGui import QImage, QImageReader
+    import core
+
+    width, height = core.THUMBNAIL_PREVIEW_SIZE
+    data = _make_jpeg(320, 180) if scaled else _make_jpeg(1280, 720)
+
+    def full(_):
+        # 過去的做法：response.content -> BytesIO -> getvalue()，完整解碼後再縮放
+        content = bytes(bytearray(data))
+        image = QImage()
+        image.loadFromData(BytesIO(content).getvalue())
+        return image.scaled(width, height, Qt.AspectRatioMode.KeepAspectRatio,
+                            Qt.TransformationMode.SmoothTransformation)
+
+    def reduced(_):
+        array = QByteArray(data)  # QBuffer 不持有參照，需保持存活到讀取完成
+        buffer = QBuffer(array)
+        buffer.open(QIODevice.OpenModeFlag.ReadOnly)
+        reader = QImageReader(buffer)
+        reader.setScaledSize(reader.size().scaled(width, height, Qt.AspectRatioMode.KeepAspectRatio))
+        return reader.read()
+
+    # 介面為每個項目各開一個執行緒，這裡以有上限的執行緒池模擬同時解碼
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        images = list(pool.map(reduced if scaled else full, range(items)))
+    return sum(1 for image in images if not image.isNull())
+
+
+def _case(name, items, threads, queue):
+    # 模組載入不計入
+    import core  # noqa: F401
+    if name.startswith('thumb'):
+        import PyQt6.QtGui  # noqa: F401
+    base = _rss_mb()
+    if name.startswith('info'):
+        count = run_info(items, name == 'info_trimmed')
+    else:
+        count = run_thumbnails(items, threads, name == 'thumb_scaled')
+    queue.put({'case': name, 'count': count, 'base_mb': base, 'end_mb': _rss_mb(), 'peak_mb': _peak_mb()})
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--items', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=32, help='concurrent thumbnail decodes')
+    args = parser.parse_args()
+
+    cases = ['info_raw', 'info_trimmed']
+    try:
+        import PyQt6.QtGui  # noqa: F401
+        cases += ['thumb_full', 'thumb_scaled']
+    except ImportError:
+        print("PyQt6 未安裝，略過縮圖案例")
+
+    ctx = multiprocessing.get_context('spawn')
+    print(f"{'case':<14} {'items':>6} {'start MB':>9} {'end MB':>8} {'peak MB':>8} {'peak - start':>13}")
+    for name in cases:
+        queue = ctx.Queue()
+        process = ctx.Process(target=_case, args=(name, args.items, args.threads, queue))
+        process.start()
+        result = queue.get()
+        process.join()
+        print(f"{name:<14} {result['count']:>6} {result['base_mb']:>9.1f} {result['end_mb']:>8.1f} "
+              f"{result['peak_mb']:>8.1f} {result['peak_mb'] - result['base_mb']:>13.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""浮水印輸出檢查的耗時與正確性
+
+對每個解析度：以 core.add_watermark 加浮水印（內含檢查），再分別量測檢查本身的耗時；
+另外產生 Logo 放錯位置與沒有 Logo 的輸出，確認檢查會拒絕。
+
+用法：python benchmarks/bench_watermark_verify.py [--seconds 30] [--sizes 1920x1080,3840x2160]
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fixtures
+import core
+import media_probe
+import watermark_verify
+
+# 檢查耗時相對於編碼耗時的上限
+TARGET_FRACTION = 0.1
+
+
+def make_bad_output(source, output, logo_path, overlay):
+    command = ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-y', '-i', source]
+    if overlay:
+        command += ['-i', logo_path, '-filter_complex', overlay]
+    command += ['-c:v', 'libx264', '-preset', 'ultrafast', '-c:a', 'copy', output]
+    subprocess.run(command, check=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seconds', type=int, default=30)
+    parser.add_argument('--sizes', default='1920x1080,3840x2160')
+    args = parser.parse_args()
+    if watermark_verify.np is None:
+        print("NumPy 未安裝，只會檢查時長與幀數")
+
+    ok = True
+    workdir = tempfile.mkdtemp(prefix='bench_wm_verify_')
+    try:
+        core.LOGO_PATH = os.path.join(workdir, 'logo.png')
+        fixtures.make_logo(core.LOGO_PATH)
+        ffmpeg_path = core.get_ffmpeg_path()
+
+        print(f"{'size':>10} {'encode(s)':>10} {'verify(s)':>10} {'fraction':>9} {'misplaced':>10} {'missing':>8}")
+        for size in args.sizes.split(','):
+            source = os.path.join(workdir, f'{size}.mp4')
+            fixtures.make_clip(source, size, args.seconds)
+            info = media_probe.probe(source)
+            position = core.get_watermark_position(info['width'], info['height'])
+
+            output = os.path.join(workdir, f'{size}_watermarked.mp4')
+            start = time.perf_counter()
+            watermarked = core.add_watermark(source, output, parallel=False)
+            encode_time = time.perf_counter() - start
+            if not watermarked:
+                print(f"{size:>10} 加浮水印或檢查失敗")
+                ok = False
+                continue
+
+            start = time.perf_counter()
+            passed, reason = watermark_verify.verify(ffmpeg_path, source, output, core.LOGO_PATH, position)
+            verify_time = time.perf_counter() - start
+
+            # Logo 放在左上角、完全沒有 Logo：兩者都應該被拒絕
+            misplaced = os.path.join(workdir, f'{size}_misplaced.mp4')
+            make_bad_output(source, misplaced, core.LOGO_PATH,
+                            '[1:v]scale={scale_width}:{scale_height}[w];[0:v][w]overlay=0:0'.format(**position))
+            missing = os.path.join(workdir, f'{size}_missing.mp4')
+            make_bad_output(source, missing, core.LOGO_PATH, None)
+            rejected_misplaced = not watermark_verify.verify(ffmpeg_path, source, misplaced,
+                                                             core.LOGO_PATH, position)[0]
+            rejected_missing = not watermark_verify.verify(ffmpeg_path, source, missing,
+                                                           core.LOGO_PATH, position)[0]
+
+            # 此時 add_watermark 已經包含一次檢查，扣除後才是編碼耗時
+            fraction = verify_time / max(encode_time - verify_time, 1e-9)
+            print(f"{size:>10} {encode_time - verify_time:>10.2f} {verify_time:>10.2f} {fraction:>8.1%} "
+                  f"{str(rejected_misplaced):>10} {str(rejected_missing):>8}")
+            if not passed:
+                print(f"  正確的輸出未通過檢查：{reason}")
+            checks_pixels = watermark_verify.np is not None
+            ok = ok and passed and fraction <= TARGET_FRACTION and (
+                not checks_pixels or (rejected_misplaced and rejected_missing))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{'PASS' if ok else 'FAIL'} (verify under {TARGET_FRACTION:.0%} of encode time, bad outputs rejected)")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
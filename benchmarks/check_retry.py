@@ -0,0 +1,132 @@
+"""以本地伺服器注入錯誤，檢查 retry_policy 的每條路徑
+
+情境：
+    forbidden  android 用戶端的影像串流回應 403，應更換 player_client 後成功
+    throttle   音訊串流回應 429 一次，應等待後成功
+    reset      影像串流中途斷線，應從 .part 續傳而非重新下載
+    stalled    影像串流後半刻意降速，throughput 監看應中斷並從目前位置重新連線
+    format     快取中的格式 ID 已不存在，應重新取得格式清單並成功
+    fatal      無效連結，不應重試
+
+用法：python benchmarks/check_retry.py [--seconds 3]
+"""
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fixtures
+import core
+import metrics
+import retry_policy
+import throughput
+
+HEIGHT = 360
+
+
+def run_case(name, url, faults, setup=None):
+    fault_start = len(faults.hits)
+    downloader = core.YouTubeDownloader()
+    # 測試時不真的等待
+    downloader._new_retry_policy = lambda: retry_policy.RetryPolicy(base_delay=0.01, max_delay=0.05)
+    downloader._new_watchdog = lambda settings: throughput.Watchdog(window=0.2, fraction=0.25, grace=0.4)
+    if setup:
+        setup()
+    try:
+        _, _, path = downloader.download(url, format_request=core.format_planner.make_request(height=HEIGHT))
+        ok, detail = os.path.exists(path), os.path.basename(path)
+    except Exception as e:
+        ok, detail = False, f'{type(e).__name__}: {e}'
+    job = metrics.get_job(downloader.last_job_id) or {'spans': []}
+    failures = [span['name'] for span in job['spans'] if span['name'].startswith('failure.')]
+    downloads = sum(1 for span in job['spans'] if span['name'] == 'download')
+    return {
+        'case': name,
+        'ok': ok,
+        'failures': failures,
+        'downloads': downloads,
+        'injected': faults.hits[fault_start:],
+        'detail': detail,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seconds', type=int, default=3)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='check_retry_')
+    cwd = os.getcwd()
+    try:
+        media_root = os.path.join(workdir, 'media')
+        os.makedirs(media_root)
+        catalog = fixtures.build_catalog(media_root, [HEIGHT], args.seconds)
+        video_id = fixtures.video_id_for(HEIGHT)
+        entry = catalog[video_id]
+        url = f'https://www.youtube.com/watch?v={video_id}'
+
+        os.chdir(workdir)
+        core.watermark_function = False
+        faults = fixtures.FaultPlan()
+        with fixtures.MediaServer(media_root, faults=faults) as server:
+            fixtures.install_stub_extractor(server.url, media_root, catalog)
+
+            def fresh():
+                core.forget_info(url)
+                shutil.rmtree(os.path.join(workdir, 'Download'), ignore_errors=True)
+
+            def forbidden():
+                fresh()
+                faults.add(f"{entry['video']}?client=android", 403, times=10)
+
+            def throttle():
+                fresh()
+                faults.add(entry['audio'], 429)
+
+            def reset():
+                fresh()
+                faults.add(entry['video'], 'reset')
+
+            def stalled():
+                fresh()
+                faults.add(entry['video'], ('slow', 200 * 1024, 8 * 1024))
+
+            def stale_format():
+                fresh()
+                info = core.trim_info({'id': video_id, 'title': 'stale', 'duration': args.seconds,
+                                       'formats': [{'format_id': 'gone', 'ext': 'mp4', 'vcodec': 'avc1',
+                                                    'acodec': 'mp4a', 'height': HEIGHT}]})
+                with core._info_lock:
+                    core._info_cache[video_id] = (core.time.monotonic(), info)
+
+            results = [
+                (run_case('forbidden', url, faults, forbidden), 'failure.forbidden'),
+                (run_case('throttle', url, faults, throttle), 'failure.throttle'),
+                (run_case('reset', url, faults, reset), None),
+                (run_case('stalled', url, faults, stalled), 'failure.stalled'),
+                (run_case('format', url, faults, stale_format), 'failure.format'),
+            ]
+            fatal = run_case('fatal', 'https://example.com/nothing', faults)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    passed = True
+    for result, expected in results:
+        ok = result['ok'] and (expected is None or expected in result['failures'])
+        passed &= ok
+        print(f"{'PASS' if ok else 'FAIL'} {result['case']:<10} failures={result['failures']} "
+              f"downloads={result['downloads']} injected={len(result['injected'])} {result['detail']}")
+    ok = not fatal['ok'] and fatal['failures'] == ['failure.fatal']
+    passed &= ok
+    print(f"{'PASS' if ok else 'FAIL'} {'fatal':<10} failures={fatal['failures']} {fatal['detail']}")
+    print(f"failure counts: {retry_policy.failure_counts()}")
+    print(f"stream restarts: {throughput.restart_counts()}")
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,263 @@
+"""離線基準測試用的假資料：lavfi 測試片段、本地 HTTP 伺服器與 yt-dlp 假擷取器"""
+import os
+import re
+import sys
+import functools
+import time
+import threading
+import subprocess
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 基準測試使用的解析度
+HEIGHTS = {360: 640, 480: 854, 720: 1280, 1080: 1920, 1440: 2560, 2160: 3840}
+
+
+def make_clip(path, size, seconds, audio=True, video=True):
+    """以 lavfi 產生測試片段，每 2 秒一個關鍵幀"""
+    command = ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-y']
+    if video:
+        command.extend(['-f', 'lavfi', '-i', f'testsrc2=size={size}:rate=30'])
+    if audio:
+        command.extend(['-f', 'lavfi', '-i', 'sine=frequency=440:sample_rate=48000'])
+    command.extend(['-t', str(seconds)])
+    if video:
+        command.extend(['-c:v', 'libx264', '-preset', 'ultrafast', '-g', '60',
+                        '-pix_fmt', 'yuv420p'])
+    if audio:
+        command.extend(['-c:a', 'aac', '-b:a', '128k'])
+    command.append(path)
+    subprocess.run(command, check=True)
+
+
+def make_logo(path):
+    subprocess.run(['ffmpeg', '-hide_banner', '-loglevel', 'error', '-y',
+                    '-f', 'lavfi', '-i', 'color=c=white:s=300x10',
+                    '-frames:v', '1', path],
+                   check=True)
+
+
+def video_id_for(height):
+    """11 字元的假影片 ID，例如 bench002160"""
+    return f'bench{height:06d}'
+
+
+class FaultPlan:
+    """依請求路徑（含查詢字串）前綴注入錯誤
+
+    action 為 HTTP 狀態碼時直接回應該錯誤；'reset' 時只送出一半內容後斷線；
+    ('slow', fast_bps, slow_bps) 時前半以 fast_bps、後半以 slow_bps 的速度送出
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._faults = []
+        self.hits = []
+
+    def add(self, prefix, action, times=1):
+        with self._lock:
+            self._faults.append([prefix, action, times])
+
+    def take(self, path):
+        with self._lock:
+            for fault in self._faults:
+                if path.startswith(fault[0]) and fault[2] > 0:
+                    fault[2] -= 1
+                    self.hits.append((path, fault[1]))
+                    return fault[1]
+        return None
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    """支援 Range 請求的靜態檔案伺服器（yt-dlp 續傳與分段下載需要）"""
+
+    def __init__(self, *args, faults=None, **kwargs):
+        self.faults = faults
+        super().__init__(*args, **kwargs)
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_head(self):
+        action = self.faults.take(self.path.lstrip('/')) if self.faults else None
+        if isinstance(action, int):
+            self.send_error(action)
+            return None
+        reader = self._send_head()
+        if action == 'reset' and reader is not None:
+            # 宣告完整長度但只送出一半，模擬連線中斷
+            remaining = getattr(reader, 'remaining', None)
+            if remaining is None:
+                reader.seek(0, os.SEEK_END)
+                remaining = reader.tell()
+                reader.seek(0)
+            return _LimitedReader(reader, remaining // 2)
+        if isinstance(action, tuple) and action[0] == 'slow' and reader is not None:
+            remaining = getattr(reader, 'remaining', None)
+            if remaining is None:
+                remaining = os.fstat(reader.fileno()).st_size - reader.tell()
+            return _PacedReader(reader, remaining // 2, action[1], action[2])
+        return reader
+
+    def _send_head(self):
+        range_header = self.headers.get('Range')
+        path = self.translate_path(self.path)
+        if not range_header or not os.path.isfile(path):
+            return super().send_head()
+
+        match = re.match(r'bytes=(\d+)-(\d*)', range_header)
+        size = os.path.getsize(path)
+        start = int(match.group(1)) if match else 0
+        end = int(match.group(2)) if match and match.group(2) else size - 1
+        if start >= size:
+            self.send_error(416)
+            return None
+        end = min(end, size - 1)
+
+        f = open(path, 'rb')
+        f.seek(start)
+        self.send_response(206)
+        self.send_header('Content-Type', self.guess_type(path))
+        self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        return _LimitedReader(f, end - start + 1)
+
+
+class _LimitedReader:
+    def __init__(self, f, remaining):
+        self.f = f
+        self.remaining = remaining
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        size = self.remaining if size < 0 else min(size, self.remaining)
+        data = self.f.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.f.close()
+
+
+class _PacedReader:
+    """以固定速度送出資料：前 fast_bytes 以 fast_bps，之後以 slow_bps"""
+
+    CHUNK = 2048
+
+    def __init__(self, f, fast_bytes, fast_bps, slow_bps):
+        self.f = f
+        self.fast_bytes = fast_bytes
+        self.fast_bps = fast_bps
+        self.slow_bps = slow_bps
+        self.sent = 0
+
+    def read(self, size=-1):
+        data = self.f.read(self.CHUNK)
+        if data:
+            time.sleep(len(data) / (self.fast_bps if self.sent < self.fast_bytes else self.slow_bps))
+            self.sent += len(data)
+        return data
+
+    def close(self):
+        self.f.close()
+
+
+class MediaServer:
+    """在背景執行緒中提供 root 目錄的本地 HTTP 伺服器"""
+
+    def __init__(self, root, handler=_QuietHandler, faults=None):
+        self.root = root
+        self.faults = faults
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0),
+                                         functools.partial(handler, directory=root, faults=faults))
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def build_catalog(root, heights, seconds):
+    """為每個解析度產生純視訊、純音訊與預先合併的檔案，返回 {video_id: 檔名資訊}"""
+    catalog = {}
+    subprocess.run(['ffmpeg', '-hide_banner', '-loglevel', 'error', '-y',
+                    '-f', 'lavfi', '-i', 'testsrc2=size=1280x720',
+                    '-frames:v', '1', os.path.join(root, 'thumb.jpg')],
+                   check=True)
+    audio_name = 'audio.m4a'
+    make_clip(os.path.join(root, audio_name), None, seconds, video=False)
+    for height in heights:
+        size = f'{HEIGHTS[height]}x{height}'
+        video_name = f'video_{height}.mp4'
+        muxed_name = f'muxed_{height}.mp4'
+        make_clip(os.path.join(root, video_name), size, seconds, audio=False)
+        make_clip(os.path.join(root, muxed_name), size, seconds)
+        catalog[video_id_for(height)] = {
+            'height': height,
+            'width': HEIGHTS[height],
+            'duration': seconds,
+            'video': video_name,
+            'audio': audio_name,
+            'muxed': muxed_name,
+        }
+    return catalog
+
+
+def install_stub_extractor(base_url, root, catalog):
+    """讓 core 使用的 yt_dlp.YoutubeDL 只認得指向本地伺服器的假 YouTube 擷取器"""
+    import yt_dlp
+    from yt_dlp.extractor.common import InfoExtractor
+    import core
+
+    class StubYoutubeIE(InfoExtractor):
+        IE_NAME = 'youtube'
+        _VALID_URL = r'https?://(?:www\.)?youtube\.com/watch\?v=(?P<id>[0-9A-Za-z_-]{11})'
+
+        def _real_extract(self, url):
+            video_id = self._match_id(url)
+            entry = catalog[video_id]
+            # 格式網址帶上 player_client，讓 FaultPlan 可以只對特定用戶端注入錯誤
+            client = self._configuration_arg('player_client', ['web'])[0]
+
+            def fmt(name, **fields):
+                return dict(url=f'{base_url}/{name}?client={client}', protocol='http',
+                            filesize=os.path.getsize(os.path.join(root, name)),
+                            **fields)
+
+            return {
+                'id': video_id,
+                'title': f'Bench {entry["height"]}p',
+                'duration': entry['duration'],
+                'thumbnail': f'{base_url}/thumb.jpg',
+                'formats': [
+                    fmt(entry['audio'], format_id='140', ext='m4a',
+                        acodec='mp4a.40.2', vcodec='none', abr=128),
+                    fmt(entry['video'], format_id=f'v{entry["height"]}', ext='mp4',
+                        vcodec='avc1.640028', acodec='none',
+                        width=entry['width'], height=entry['height'], fps=30),
+                    fmt(entry['muxed'], format_id=f'm{entry["height"]}', ext='mp4',
+                        vcodec='avc1.640028', acodec='mp4a.40.2',
+                        width=entry['width'], height=entry['height'], fps=30),
+                ],
+            }
+
+    class StubYoutubeDL(yt_dlp.YoutubeDL):
+        def __init__(self, params=None, auto_init=True):
+            super().__init__(params, auto_init=False)
+            self.add_info_extractor(StubYoutubeIE())
+
+    core.yt_dlp.YoutubeDL = StubYoutubeDL
+    return StubYoutubeDL
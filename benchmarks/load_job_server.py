@@ -0,0 +1,174 @@
+"""job_server 的負載測試：多少個同時查詢狀態的用戶端仍能維持低延遲
+
+服務在子行程中執行，下載以固定時間送出進度事件的假下載器代替（不需要網路與 ffmpeg）。
+每個等級同時開啟 N 個用戶端：一半以 keep-alive 輪詢 GET /jobs/<id>，
+一半訂閱 /jobs/<id>/events，記錄輪詢延遲與收到的事件數。
+
+用法：python benchmarks/load_job_server.py [--levels 10,50,100,200,500] [--duration 5]
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import statistics
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeDownloader:
+    """以固定頻率送出下載進度，模擬長時間的下載工作"""
+
+    JOB_SECONDS = 3600
+    RATE = 20
+
+    def __init__(self, progress_hook=None):
+        self.progress_hook = progress_hook
+        self.last_job_id = None
+        self._cancelled = False
+
+    def download(self, url, format_request=None):
+        total = self.JOB_SECONDS * self.RATE
+        for i in range(total):
+            if self._cancelled:
+                import core
+                raise core.DownloadCancelled('cancelled')
+            self.progress_hook({'status': 'downloading', 'downloaded_bytes': i * 1024,
+                                'total_bytes': total * 1024, 'speed': 1024 * self.RATE})
+            # 每次都換狀態，讓伺服器不會節流掉全部事件
+            self.progress_hook({'status': 'processing', 'frame': i, 'total_frames': total})
+            time.sleep(1 / self.RATE)
+        return {}, 'fake', '/dev/null'
+
+    def cancel(self):
+        self._cancelled = True
+
+
+def run_server(port_queue, workers):
+    import job_server
+    asyncio.run(job_server.serve('127.0.0.1', 0, workers=workers, max_queue=10000,
+                                 downloader_factory=FakeDownloader,
+                                 ready=lambda address: port_queue.put(address[1])))
+
+
+async def request(reader, writer, method, path, body=None):
+    payload = json.dumps(body).encode() if body is not None else b''
+    writer.write(f'{method} {path} HTTP/1.1\r\nHost: x\r\nContent-Length: {len(payload)}\r\n\r\n'
+                 .encode() + payload)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        if line.lower().startswith(b'content-length:'):
+            length = int(line.split(b':')[1])
+    return status, json.loads(await reader.readexactly(length)) if length else None
+
+
+async def poller(port, job_id, stop, latencies, errors):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        while not stop.is_set():
+            start = time.perf_counter()
+            status, _ = await request(reader, writer, 'GET', f'/jobs/{job_id}')
+            if status == 200:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors.append(status)
+    except (ConnectionError, asyncio.IncompleteReadError) as e:
+        errors.append(type(e).__name__)
+    finally:
+        writer.close()
+
+
+async def subscriber(port, job_id, stop, counts, errors):
+    try:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    except OSError as e:
+        errors.append(type(e).__name__)
+        return
+    writer.write(f'GET /jobs/{job_id}/events HTTP/1.1\r\nHost: x\r\n\r\n'.encode())
+    await writer.drain()
+    received = 0
+    try:
+        while not stop.is_set():
+            try:
+                line = await asyncio.wait_for(reader.readline(), 0.5)
+            except asyncio.TimeoutError:
+                continue
+            if not line:
+                break
+            if line.startswith(b'data:'):
+                received += 1
+    finally:
+        counts.append(received)
+        writer.close()
+
+
+async def run_level(port, job_ids, clients, duration):
+    stop = asyncio.Event()
+    latencies, counts, errors = [], [], []
+    tasks = []
+    for i in range(clients):
+        job_id = job_ids[i % len(job_ids)]
+        if i % 2:
+            tasks.append(asyncio.create_task(subscriber(port, job_id, stop, counts, errors)))
+        else:
+            tasks.append(asyncio.create_task(poller(port, job_id, stop, latencies, errors)))
+    await asyncio.sleep(duration)
+    stop.set()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99)] if latencies else float('nan')
+    return {
+        'clients': clients,
+        'status_rps': len(latencies) / duration,
+        'p50_ms': statistics.median(latencies) * 1000 if latencies else float('nan'),
+        'p99_ms': p99 * 1000,
+        'events_per_sub_s': (statistics.mean(counts) / duration) if counts else 0.0,
+        'errors': len(errors),
+    }
+
+
+async def run(port, levels, duration, workers):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    job_ids = []
+    for i in range(workers):
+        status, job = await request(reader, writer, 'POST', '/jobs',
+                                    {'url': f'https://youtu.be/load{i:07d}'})
+        assert status == 201, (status, job)
+        job_ids.append(job['id'])
+    writer.close()
+
+    print(f"{'clients':>8} {'status rps':>11} {'p50 ms':>8} {'p99 ms':>8} {'events/sub/s':>13} {'errors':>7}")
+    for clients in levels:
+        result = await run_level(port, job_ids, clients, duration)
+        print(f"{result['clients']:>8} {result['status_rps']:>11.0f} {result['p50_ms']:>8.2f} "
+              f"{result['p99_ms']:>8.2f} {result['events_per_sub_s']:>13.1f} {result['errors']:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--levels', default='10,50,100,200,500')
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--workers', type=int, default=2)
+    args = parser.parse_args()
+
+    port_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=run_server, args=(port_queue, args.workers), daemon=True)
+    server.start()
+    try:
+        port = port_queue.get(timeout=30)
+        asyncio.run(run(port, [int(x) for x in args.levels.split(',')], args.duration, args.workers))
+    finally:
+        server.terminate()
+        server.join()
+
+
+if __name__ == '__main__':
+    main()
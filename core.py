@@ -1,8 +1,27 @@
 import os
-from urllib.parse import urlparse, parse_qs
 import yt_dlp
 import subprocess
-import json
+import logging
+import struct
+import functools
+import media_probe
+import audio_pipeline
+import encoders
+import segment_encode
+import atomic_files
+import watermark_verify
+import metrics
+import settings_store
+import format_planner
+import disk_budget
+import url_canon
+import retry_policy
+import throughput
+import time
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
 
 Debug = False
 watermark_function = True
@@ -20,7 +39,7 @@ def check_ffmpeg_available():
                                   text=True,
                                   timeout=5)
             if result.returncode == 0:
-                print(f"[DEBUG] FFmpeg found at: {ffmpeg_path}")
+                logger.debug("FFmpeg found at: %s", ffmpeg_path)
                 return True
 
         # 嘗試系統路徑
@@ -29,132 +48,344 @@ def check_ffmpeg_available():
                               text=True,
                               timeout=5)
         if result.returncode == 0:
-            print("[DEBUG] FFmpeg found in system PATH")
+            logger.debug("FFmpeg found in system PATH")
             return True
 
-        print("[DEBUG] FFmpeg not found or failed to run")
+        logger.debug("FFmpeg not found or failed to run")
         return False
     except FileNotFoundError:
-        print("[DEBUG] FFmpeg not found (FileNotFoundError)")
+        logger.debug("FFmpeg not found (FileNotFoundError)")
         return False
     except Exception as e:
-        print(f"[DEBUG] FFmpeg check failed: {e}")
+        logger.debug("FFmpeg check failed: %s", e)
         return False
 
+def get_ffmpeg_path():
+    """取得 ffmpeg 執行檔路徑（優先使用本地 bin 目錄）"""
+    ffmpeg_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               'bin', 'ffmpeg.exe')
+    if os.path.exists(ffmpeg_path):
+        return ffmpeg_path
+    return 'ffmpeg'
+
 def load_settings():
-    settings_file = 'settings.json'
-    default_settings = {
-        'watermark_width': 300,
-        'watermark_height': 10
-    }
-    
-    if os.path.exists(settings_file):
-        try:
-            with open(settings_file, 'r') as f:
-                return json.load(f)
-        except:
-            return default_settings
-    return default_settings
-
-def get_watermark_position():
-    """获取水印位置和大小设置"""
-    settings = load_settings()
+    """返回目前設定的唯讀快照（已合併預設值，不會讀取檔案）"""
+    return settings_store.get_settings().snapshot
+
+# 舊版 settings.json 的 watermark_width/height 以 1920x1080 影片為基準
+WATERMARK_REFERENCE_WIDTH = 1920
+WATERMARK_REFERENCE_HEIGHT = 1080
+
+LOGO_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Logo.png')
+
+@functools.lru_cache(maxsize=None)
+def _read_png_size(path, mtime_ns):
+    """從 PNG 檔頭讀取寬高，不需要額外的圖片函式庫"""
+    with open(path, 'rb') as f:
+        header = f.read(24)
+    if header[:8] != b'\x89PNG\r\n\x1a\n':
+        return None
+    width, height = struct.unpack('>II', header[16:24])
+    return (width, height) if width and height else None
+
+def get_logo_size():
+    """取得 Logo.png 的原始尺寸，讀取失敗時返回 None"""
+    try:
+        return _read_png_size(LOGO_PATH, os.stat(LOGO_PATH).st_mtime_ns)
+    except OSError:
+        return None
+
+def get_watermark_geometry_settings():
+    """读取浮水印的相對幾何設定（以畫面寬度的比例表示）"""
+    settings = settings_store.get_settings()
+    legacy_width = settings['watermark_width']
+    legacy_height = settings['watermark_height']
+
+    width_ratio = settings['watermark_width_ratio']
+    if width_ratio is None:
+        width_ratio = legacy_width / WATERMARK_REFERENCE_WIDTH
+
+    # 高寬比：未設定時沿用舊版寬高（與舊版相同的浮水印大小）；設為 "logo" 時使用 Logo 原始比例
+    aspect = settings['watermark_aspect']
+    if aspect == 'logo':
+        logo_size = get_logo_size()
+        aspect = logo_size[1] / logo_size[0] if logo_size else None
+    if aspect is None:
+        aspect = legacy_height / legacy_width
+
+    return float(width_ratio), float(aspect), float(settings['watermark_margin_ratio'])
+
+@functools.lru_cache(maxsize=64)
+def _resolve_watermark_geometry(frame_width, frame_height, width_ratio, aspect, margin_ratio):
+    """將相對設定換算成像素位置與大小（依解析度快取）"""
+    margin = max(1, int(round(frame_width * margin_ratio)))
+    scale_width = int(round(frame_width * width_ratio))
+    scale_width = max(1, min(scale_width, frame_width - 2 * margin))
+    scale_height = max(1, int(round(scale_width * aspect)))
+    scale_height = min(scale_height, max(1, frame_height - 2 * margin))
     return {
-        'x': '(W-w)-1',  # 从右边开始计算，减去浮水印宽度再减1像素
-        'y': '(H-h)-1',  # 从底部开始计算，减去浮水印高度再减1像素
-        'scale_width': settings.get('watermark_width', 300),
-        'scale_height': settings.get('watermark_height', 10)
+        'x': max(0, frame_width - scale_width - margin),  # 右下角，保留邊距
+        'y': max(0, frame_height - scale_height - margin),
+        'scale_width': scale_width,
+        'scale_height': scale_height
     }
 
-def add_watermark(input_file, output_file):
-    """添加浮水印到影片"""
+def get_watermark_position(frame_width=None, frame_height=None):
+    """获取水印位置和大小设置
+
+    浮水印大小以畫面寬度的比例定義，因此 360p 與 2160p 影片上的相對大小一致。
+    ffmpeg 濾鏡與縮圖預覽都使用這裡的結果。
+
+    Args:
+        frame_width: 畫面寬度（影片由 ffprobe 取得，預覽則為預覽圖寬度）
+        frame_height: 畫面高度
+    """
+    if not frame_width or not frame_height:
+        frame_width, frame_height = WATERMARK_REFERENCE_WIDTH, WATERMARK_REFERENCE_HEIGHT
+    return dict(_resolve_watermark_geometry(int(frame_width), int(frame_height),
+                                            *get_watermark_geometry_settings()))
+
+# 各輸出容器可直接複製（不重新編碼）的音訊編碼；None 表示任何編碼皆可
+COPY_AUDIO_CODECS = {
+    '.mp4': {'aac', 'mp3', 'alac', 'ac3', 'eac3', 'opus'},
+    '.m4a': {'aac', 'mp3', 'alac', 'ac3', 'eac3', 'opus'},
+    '.mov': {'aac', 'mp3', 'alac', 'ac3', 'eac3'},
+    '.webm': {'opus', 'vorbis'},
+    '.mkv': None,
+}
+
+def get_audio_args(input_file, output_file, input_index=0):
+    """根據來源音訊串流決定複製或轉碼參數
+
+    Args:
+        input_index: 來源檔在 ffmpeg 命令中的輸入編號
+    """
+    streams = media_probe.audio_streams(input_file)
+    if streams is None:
+        # 探測失敗：保留原本的轉碼行為，但允許沒有音訊的影片
+        return ['-map', f'{input_index}:a?', '-c:a', 'aac', '-b:a', '192k']
+    if not streams:
+        # 純視訊來源
+        return ['-an']
+
+    ext = os.path.splitext(output_file)[1].lower()
+    allowed = COPY_AUDIO_CODECS.get(ext, set())
+    args = ['-map', f'{input_index}:a']
+    for i, stream in enumerate(streams):
+        if allowed is None or stream['codec_name'] in allowed:
+            args.extend([f'-c:a:{i}', 'copy'])
+        elif ext == '.webm':
+            args.extend([f'-c:a:{i}', 'libopus', f'-b:a:{i}', '160k'])
+        else:
+            args.extend([f'-c:a:{i}', 'aac', f'-b:a:{i}', '192k'])
+    return args
+
+# 執行中的 ffmpeg 行程：{job_id: set(Popen)}，取消下載時由 terminate_processes 終止
+_processes = {}
+_processes_lock = threading.Lock()
+# 最近取消的工作：之後才啟動的行程（例如分段編碼中排隊的片段）登記時立即終止
+_cancelled_jobs = deque(maxlen=100)
+
+
+class DownloadCancelled(Exception):
+    """下載已被取消"""
+
+
+def _track_process(process):
+    job_id = metrics.current_job()
+    with _processes_lock:
+        _processes.setdefault(job_id, set()).add(process)
+        cancelled = job_id is not None and job_id in _cancelled_jobs
+    if cancelled:
+        process.terminate()
+
+
+def _untrack_process(process):
+    with _processes_lock:
+        for job_id, job_processes in list(_processes.items()):
+            job_processes.discard(process)
+            # 工作沒有執行中的行程時移除，長時間執行不會累積空集合
+            if not job_processes:
+                del _processes[job_id]
+
+
+def terminate_processes(job_id, timeout=5):
+    """終止某個工作仍在執行的 ffmpeg 行程；之後才登記的同一工作行程也會立即終止"""
+    with _processes_lock:
+        processes = list(_processes.pop(job_id, ()))
+        if job_id is not None and job_id not in _cancelled_jobs:
+            _cancelled_jobs.append(job_id)
+    for process in processes:
+        if process.poll() is None:
+            process.terminate()
+            try:
+                process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+def ffmpeg_progress_event(state, total_frames):
+    """將 ffmpeg -progress 的一組鍵值轉成進度事件"""
+    d = {'status': 'processing', 'speed': state.get('speed', '').rstrip('x')}
+    if total_frames:
+        try:
+            frame = int(state.get('frame') or 0)
+        except ValueError:
+            frame = 0
+        d['frame'] = min(frame, total_frames)
+        d['total_frames'] = total_frames
+    return d
+
+def _read_ffmpeg_progress(process, total_frames, progress_hook):
+    """解析 ffmpeg -progress 輸出並回報處理進度"""
+    state = {}
+    for line in process.stdout:
+        key, _, value = line.strip().partition('=')
+        state[key] = value
+        if key != 'progress' or not progress_hook:
+            continue
+        progress_hook(ffmpeg_progress_event(state, total_frames))
+
+def run_ffmpeg(command, total_frames=None, progress_hook=None):
+    """執行帶 -progress pipe:1 的 ffmpeg 命令並返回結束碼；行程登記在目前工作下，可被取消"""
+    # 使用Popen而不是run，以便可以获取进程对象
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    _track_process(process)
     try:
-        # 檢查 FFmpeg 是否可用
-        if not check_ffmpeg_available():
-            print("⚠️ FFmpeg 不可用，跳過水印處理")
-            return False
+        _read_ffmpeg_progress(process, total_frames, progress_hook)
+        process.wait()  # 等待进程完成
+    finally:
+        _untrack_process(process)
+    return process.returncode
+
+def prepare_watermark(input_file, output_file, parallel=None):
+    """準備浮水印命令（同步與 asyncio 版本共用）
+
+    Returns:
+        dict：'command'（單一行程的 ffmpeg 命令）、'total_frames'、'encoder'、
+        'position'（浮水印位置），以及可分段平行編碼時的 'parallel'（encode_parallel 的參數）；
+        FFmpeg 或浮水印圖片不可用時返回 None
+    """
+    # 檢查 FFmpeg 是否可用
+    if not check_ffmpeg_available():
+        logger.warning("⚠️ FFmpeg 不可用，跳過水印處理")
+        return None
 
-        # 設置ffmpeg路徑
-        ffmpeg_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
-                                 'bin', 'ffmpeg.exe')
+    ffmpeg_path = get_ffmpeg_path()
+
+    # 浮水印圖片路徑
+    logo_path = LOGO_PATH
+
+    if not os.path.exists(logo_path):
+        logger.warning("⚠️ 找不到浮水印圖片：Logo.png，跳過水印處理")
+        return None
+
+    # 探測來源（結果已快取），用於浮水印縮放與進度總幀數
+    source_info = media_probe.probe(input_file)
+    if source_info:
+        position = get_watermark_position(source_info['width'], source_info['height'])
+    else:
+        position = get_watermark_position()
+    total_frames = source_info['frame_count'] if source_info else None
+
+    # 選擇編碼器：已測速的硬體編碼器中最快且達品質門檻者，否則使用 CPU 編碼
+    codec = encoders.target_codec(source_info['vcodec'] if source_info else None)
+    min_psnr = load_settings()['encoder_min_psnr']
+    encoder = encoders.select_encoder(ffmpeg_path, codec, min_psnr)
+    input_args, filter_suffix, video_args = encoders.build_encode_args(encoder)
+    logger.debug("Watermark encoder: %s", encoder)
+
+    overlay = '[1:v]scale={scale_width}:{scale_height}[watermark];[0:v][watermark]overlay={x}:{y}'.format(**position)
+    if filter_suffix:
+        overlay += ',' + filter_suffix
+
+    # 分段平行編碼：在關鍵幀切段、多行程編碼後無損串接；硬體編碼器本身已經夠快
+    if parallel is None:
+        parallel = load_settings()['parallel_watermark']
+    parallel_args = None
+    if parallel and not encoders.ENCODER_SPECS[encoder]['hardware'] and not input_args:
+        parallel_args = (ffmpeg_path, input_file, output_file, logo_path, overlay + '[v]', video_args,
+                         get_audio_args(input_file, output_file, input_index=1))
+
+    # 使用ffmpeg添加浮水印，保持原始影片品質
+    command = [
+        ffmpeg_path, '-hide_banner', '-nostats', '-progress', 'pipe:1',
+        *input_args,
+        '-i', input_file,
+        '-i', logo_path,
+        '-filter_complex', overlay + '[v]',
+        '-map', '[v]',
+    ]
+    command.extend(video_args)
+
+    # 音訊：容器相容時直接複製，否則才轉碼；沒有音訊時不映射
+    command.extend(get_audio_args(input_file, output_file))
+    command.append(output_file)
+    return {'command': command, 'total_frames': total_frames, 'encoder': encoder,
+            'parallel': parallel_args, 'position': position}
+
+def finalize_watermark(input_file, temp_file, output_file, job):
+    """檢查暫存輸出的時長、幀數與取樣幀上的 Logo，通過後原子換名為 output_file；
+    未通過時刪除暫存檔並返回 False
+    """
+    ok, _ = watermark_verify.verify(get_ffmpeg_path(), input_file, temp_file, LOGO_PATH, job['position'],
+                                    samples=load_settings()['watermark_verify_frames'])
+    if not ok:
+        atomic_files.discard(temp_file)
+        return False
+    atomic_files.finalize(temp_file, output_file, stage='watermark')
+    return True
 
-        # 如果本地找不到，使用系統路徑
-        if not os.path.exists(ffmpeg_path):
-            ffmpeg_path = 'ffmpeg'
+def add_watermark(input_file, output_file, progress_hook=None, parallel=None):
+    """添加浮水印到影片
 
-        # 浮水印圖片路徑
-        logo_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
-                               'Logo.png')
+    Args:
+        progress_hook: 可選，接收 {'status': 'processing', 'frame', 'total_frames', 'speed'}
+        parallel: 是否分段平行編碼（只用於軟體編碼器），None 時依 settings.json 的 parallel_watermark
 
-        if not os.path.exists(logo_path):
-            print("⚠️ 找不到浮水印圖片：Logo.png，跳過水印處理")
+    Returns:
+        編碼成功且通過輸出檢查（watermark_verify）時返回 True，呼叫端之後才可刪除原始檔
+    """
+    # 編碼寫入暫存檔，檢查通過後才換名，中斷時不會留下看似完成的輸出
+    temp_file = atomic_files.part_path(output_file)
+    try:
+        job = prepare_watermark(input_file, temp_file, parallel)
+        if job is None:
             return False
+        encoder = job['encoder']
+
+        if job['parallel']:
+            with metrics.span(metrics.current_job(), 'watermark', encoder=encoder, mode='parallel') as span:
+                ok = segment_encode.encode_parallel(*job['parallel'], run_ffmpeg=run_ffmpeg,
+                                                    progress_hook=progress_hook)
+                span['exit_code'] = 0 if ok else 1
+            if ok:
+                return finalize_watermark(input_file, temp_file, output_file, job)
+            logger.warning("⚠️ 分段編碼失敗，改用單一行程編碼")
+
+        with metrics.span(metrics.current_job(), 'watermark', encoder=encoder) as span:
+            returncode = run_ffmpeg(job['command'], job['total_frames'], progress_hook)
+            span['exit_code'] = returncode
+            if returncode == 0:
+                span['bytes'] = os.path.getsize(temp_file)
         
-        # 檢查是否支持NVIDIA硬體加速
-        try:
-            result = subprocess.run([ffmpeg_path, '-hide_banner', '-encoders'], 
-                                 capture_output=True, text=True, check=True)
-            has_nvenc = 'h264_nvenc' in result.stdout
-        except:
-            has_nvenc = False
-        
-        # 使用ffmpeg添加浮水印，保持原始影片品質
-        command = [
-            ffmpeg_path, '-i', input_file,
-            '-i', logo_path,
-            '-filter_complex', '[1:v]scale={scale_width}:{scale_height}[watermark];[0:v][watermark]overlay={x}:{y}'.format(**get_watermark_position()),
-        ]
-        
-        if has_nvenc:
-            # 使用NVIDIA硬體加速
-            command.extend([
-                '-c:v', 'h264_nvenc',  # 使用NVENC編碼器
-                '-preset', 'p7',  # 最高品質預設
-                '-rc', 'constqp',  # 固定QP模式
-                '-qp', '0',  # 最高品質
-                '-profile:v', 'high',  # 高配置
-                '-pixel_format', 'yuv420p',  # 標準像素格式
-            ])
-        else:
-            # 使用CPU編碼
-            command.extend([
-                '-c:v', 'libx264',  # 使用x264編碼器
-                '-preset', 'veryslow',  # 使用最慢的編碼預設以獲得最好的質量
-                '-crf', '0',  # 設置最高品質（無損）
-            ])
-        
-        # 確保音訊串流被正確複製
-        command.extend([
-            '-map', '0:a',  # 映射第一個輸入文件的音訊串流
-            '-c:a', 'aac',  # 使用AAC編碼器
-            '-b:a', '192k',  # 設置音訊位元率
-            output_file
-        ])
-        
-        # 使用Popen而不是run，以便可以获取进程对象
-        process = subprocess.Popen(command)
-        process.wait()  # 等待进程完成
-        
-        if process.returncode == 0:
-            return True
+        if returncode == 0:
+            return finalize_watermark(input_file, temp_file, output_file, job)
         else:
-            print(f"❌ 添加浮水印失敗：ffmpeg返回錯誤碼 {process.returncode}")
+            logger.error("❌ 添加浮水印失敗：ffmpeg返回錯誤碼 %s", returncode)
+            atomic_files.discard(temp_file)
             return False
     except Exception as e:
-        print(f"❌ 添加浮水印失敗：{e}")
+        logger.error("❌ 添加浮水印失敗：%s", e)
+        atomic_files.discard(temp_file)
         return False
 
 def clean_url(raw_url):
-    parsed = urlparse(raw_url)
-    if "youtu.be" in raw_url:
-        video_id = parsed.path.strip("/")
-    else:
-        query = parse_qs(parsed.query)
-        video_id = query.get("v", [None])[0]
-    if not video_id:
-        print("❌ 無效的 YouTube 連結")
+    """返回標準化的影片網址，無效連結返回 None（解析結果見 url_canon.canonicalize）"""
+    result = url_canon.canonicalize(raw_url)
+    if result.video_id is None:
+        logger.warning("❌ 無效的 YouTube 連結：%s (%s)", raw_url, result.error)
         return None
-    return f"https://www.youtube.com/watch?v={video_id}"
+    return result.url
 
 def download_video(url):
     # 確保 Download 資料夾存在
@@ -167,7 +398,7 @@ def download_video(url):
     if ffmpeg_available:
         format_string = 'bestvideo+bestaudio/best'
     else:
-        print("⚠️ FFmpeg 不可用，將下載預先合併的格式（可能畫質較低）")
+        logger.warning("⚠️ FFmpeg 不可用，將下載預先合併的格式（可能畫質較低）")
         format_string = 'best[ext=mp4]/best'
 
     ydl_opts = {
@@ -192,7 +423,7 @@ def download_video(url):
 
     with yt_dlp.YoutubeDL(ydl_opts) as ydl:
         try:
-            print("⬇️ 正在下載影片...")
+            logger.info("⬇️ 正在下載影片...")
             info = ydl.extract_info(url, download=True)
             video_path = ydl.prepare_filename(info)
             if not video_path.endswith('.mp4'):
@@ -204,64 +435,168 @@ def download_video(url):
 
                 if ffmpeg_available:
                     # 添加浮水印
-                    print("🖌️ 正在添加浮水印...")
+                    logger.info("🖌️ 正在添加浮水印...")
                     watermarked_path = os.path.splitext(video_path)[0] + '_watermarked.mkv'
                     if add_watermark(video_path, watermarked_path):
                         # 刪除原始文件
                         os.remove(video_path)
-                        print("✅ 下載完成並添加浮水印！")
+                        logger.info("✅ 下載完成並添加浮水印！")
                         return watermarked_path
                     else:
-                        print("✅ 下載完成，但添加浮水印失敗！")
+                        logger.warning("✅ 下載完成，但添加浮水印失敗！")
                         return video_path
                 else:
                     # FFmpeg 不可用，直接返回原始文件
-                    print("⚠️ FFmpeg 不可用，跳過水印處理")
-                    print("✅ 下載完成！")
+                    logger.warning("⚠️ FFmpeg 不可用，跳過水印處理")
+                    logger.info("✅ 下載完成！")
                     return video_path
             else:
                 # 不添加浮水印
-                print("✅ 下載完成！")
+                logger.info("✅ 下載完成！")
                 return video_path
                 
         except Exception as e:
-            print(f"❌ 發生錯誤：{e}")
+            logger.error("❌ 發生錯誤：%s", e)
             return None
 
+# 影片資訊快取：{video_id: (取得時間, 精簡資訊)}，格式清單在有效期內可重複用於規劃
+INFO_CACHE_TTL = 3600
+_info_cache = {}
+_info_lock = threading.Lock()
+
+
+# 介面預覽圖大小；YouTube 縮圖檔名對應的尺寸（未處理的 info 中通常沒有寬高）
+THUMBNAIL_PREVIEW_SIZE = (120, 68)
+YOUTUBE_THUMBNAIL_SIZES = {
+    'default': (120, 90),
+    'mqdefault': (320, 180),
+    'hqdefault': (480, 360),
+    'sddefault': (640, 480),
+    'hq720': (1280, 720),
+    'maxresdefault': (1280, 720),
+}
+
+
+def _thumbnail_size(thumbnail):
+    if thumbnail.get('width') and thumbnail.get('height'):
+        return thumbnail['width'], thumbnail['height']
+    url = thumbnail.get('url') or ''
+    name = os.path.splitext(url.split('?', 1)[0].rsplit('/', 1)[-1])[0]
+    return YOUTUBE_THUMBNAIL_SIZES.get(name)
+
+
+def pick_thumbnail(thumbnails, width, height):
+    """足以顯示 width x height 的最小縮圖網址（優先相同長寬比與 JPEG）；無法判斷時返回 None"""
+    candidates = []
+    for thumbnail in thumbnails or []:
+        size = _thumbnail_size(thumbnail)
+        if not size or size[0] < width or size[1] < height:
+            continue
+        # 4:3 的縮圖對 16:9 影片含有黑邊，縮放後畫面較小
+        aspect_mismatch = abs(size[0] * height - size[1] * width) > 0.1 * size[1] * width
+        webp = '.webp' in thumbnail['url']
+        candidates.append((aspect_mismatch, size[0] * size[1], webp, thumbnail['url']))
+    return min(candidates)[3] if candidates else None
+
+
+def trim_info(info):
+    """只保留規劃與顯示需要的欄位（格式清單不含 URL，過期也不影響規劃）"""
+    thumbnail = info.get('thumbnail')
+    if not thumbnail and info.get('thumbnails'):
+        thumbnail = info['thumbnails'][-1].get('url')
+    return {
+        'id': info.get('id'),
+        'title': info.get('title', 'Unknown Title'),
+        'thumbnail': thumbnail or '',
+        'thumbnail_small': pick_thumbnail(info.get('thumbnails'), *THUMBNAIL_PREVIEW_SIZE) or thumbnail or '',
+        'duration': info.get('duration'),
+        'formats': format_planner.format_table(info.get('formats')),
+    }
+
+
+def trim_download_info(info):
+    """下載完成後返回給呼叫端的資訊；完整的 info 含所有格式與字幕，不跨執行緒保留"""
+    return {
+        'id': info.get('id'),
+        'title': info.get('title', 'Unknown Title'),
+        'duration': info.get('duration'),
+        'format_id': info.get('format_id'),
+        'width': info.get('width'),
+        'height': info.get('height'),
+        'ext': info.get('ext'),
+    }
+
+
+def cache_info(info):
+    trimmed = trim_info(info)
+    if trimmed['id']:
+        with _info_lock:
+            _info_cache[trimmed['id']] = (time.monotonic(), trimmed)
+    return trimmed
+
+
+def get_cached_info(cleaned_url):
+    """返回快取中的精簡資訊，不存在或過期時返回 None"""
+    video_id = url_canon.video_id(cleaned_url)
+    with _info_lock:
+        entry = _info_cache.get(video_id)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] > INFO_CACHE_TTL:
+            del _info_cache[video_id]
+            return None
+        return entry[1]
+
+
+def forget_info(url):
+    """移除快取中的影片資訊（格式清單已不可用時）"""
+    video_id = url_canon.video_id(url)
+    with _info_lock:
+        _info_cache.pop(video_id, None)
+
+
+def fetch_info(url):
+    """取得精簡影片資訊（含格式表），優先使用快取；失敗時返回 None"""
+    cleaned_url = clean_url(url)
+    if not cleaned_url:
+        return None
+    cached = get_cached_info(cleaned_url)
+    if cached is not None:
+        return cached
+
+    ydl_opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'extract_flat': False,  # 需要獲取完整資訊以取得封面與格式清單
+        'http_headers': {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+            'Accept-Language': 'en-us,en;q=0.5',
+            'Sec-Fetch-Mode': 'navigate',
+        },
+        'extractor_args': {
+            'youtube': {
+                'player_client': ['android', 'web'],
+                'player_skip': ['webpage', 'configs'],
+            }
+        },
+    }
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        with metrics.span(metrics.current_job(), 'metadata'):
+            # 不在這裡做格式選擇，交給 format_planner
+            info = ydl.extract_info(cleaned_url, download=False, process=False)
+    return cache_info(info)
+
+
 def get_video_info(url):
-    """獲取影片資訊（標題和封面URL）"""
+    """獲取影片資訊（標題和預覽用的小封面URL）"""
     try:
-        # 清理URL
-        cleaned_url = clean_url(url)
-        if not cleaned_url:
+        info = fetch_info(url)
+        if info is None:
             return None, None
-
-        # 獲取影片資訊
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': True,
-            'extract_flat': False,  # 需要獲取完整資訊以取得封面
-            'http_headers': {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-                'Accept-Language': 'en-us,en;q=0.5',
-                'Sec-Fetch-Mode': 'navigate',
-            },
-            'extractor_args': {
-                'youtube': {
-                    'player_client': ['android', 'web'],
-                    'player_skip': ['webpage', 'configs'],
-                }
-            },
-        }
-
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(cleaned_url, download=False)
-            video_title = info.get('title', 'Unknown Title')
-            thumbnail_url = info.get('thumbnail', '')  # 獲取封面URL
-            return video_title, thumbnail_url
+        return info['title'], info['thumbnail_small']
     except Exception as e:
-        print(f"獲取影片資訊失敗：{str(e)}")
+        logger.warning("獲取影片資訊失敗：%s", e)
         return None, None
 
 class YouTubeDownloader:
@@ -296,13 +631,36 @@ class YouTubeDownloader:
 
         # 如果 FFmpeg 不可用，移除 abort_on_error 並調整格式選擇
         if not self.ffmpeg_available:
-            print("⚠️ FFmpeg 不可用，將下載預先合併的格式（可能畫質較低）")
+            logger.warning("⚠️ FFmpeg 不可用，將下載預先合併的格式（可能畫質較低）")
             # 優先選擇已合併的格式，避免需要 FFmpeg 合併
             self.ydl_opts['format'] = 'best[ext=mp4]/best'
 
         if progress_hook:
             self.ydl_opts['progress_hooks'] = [progress_hook]
 
+        # 依設定開啟 JSON-lines 與 Prometheus 輸出
+        metrics.configure(load_settings())
+        self.last_job_id = None
+        self.last_plan = None
+        # 單一格式下載在下載途中累加雜湊，完成後不必再讀一次（見 atomic_files.StreamHasher）
+        self.stream_hasher = None
+        self._cancelled = threading.Event()
+        # 同一下載資料夾的所有下載器共用磁碟預算
+        self.budget = disk_budget.get_budget(os.path.dirname(self.ydl_opts['outtmpl']),
+                                             int(load_settings()['disk_margin_mb'] * disk_budget.MB))
+
+    def _resolve_output_path(self, ydl, info, is_audio_only):
+        """取得實際輸出檔案路徑（後處理後的路徑），並以 ffprobe 確認"""
+        candidates = [d.get('filepath') for d in info.get('requested_downloads') or []]
+        candidates.append(info.get('filepath'))
+        for path in candidates:
+            if path and os.path.exists(path):
+                return path
+
+        # yt-dlp 未回報路徑時，在同名檔案中找出可探測的媒體檔
+        base_path = os.path.splitext(ydl.prepare_filename(info))[0]
+        return media_probe.find_media_file(base_path, want_video=not is_audio_only)
+
     def get_info(self, url):
         """獲取影片資訊"""
         return get_video_info(url)
@@ -311,82 +669,154 @@ class YouTubeDownloader:
         """根据指定的高度获取格式字符串"""
         return f"bestvideo[height<={height}]+bestaudio[ext=m4a]/best[height<={height}]/best"
 
-    def download(self, url, format_string="bestvideo+bestaudio/best"):
+    def plan(self, url, format_request):
+        """依快取的格式表規劃下載（不下載），供排程估算磁碟與頻寬
+
+        Returns:
+            format_planner.plan_formats 的結果；無法取得資訊或沒有可用格式時返回 None
+        """
+        info = fetch_info(url)
+        if info is None:
+            return None
+        return format_planner.plan_formats(info['formats'], format_request,
+                                           ffmpeg_available=self.ffmpeg_available,
+                                           duration=info['duration'])
+
+    def download(self, url, format_string=None, format_request=None):
         """下載影片
 
         Args:
             url: YouTube視頻URL
-            format_string: 影片格式和畫質設置，例如：
+            format_string: 舊式格式字串（相容用），例如：
                          "bestvideo[height<=1080][vcodec^=avc]+bestaudio[ext=m4a]/best[height<=1080]"
                          或 "bestaudio/best" 用於只下載音頻
+            format_request: 格式需求，見 format_planner.make_request；優先於 format_string
         """
-        cleaned_url = clean_url(url)  # 使用全局的clean_url函數
+        if format_request is None:
+            format_request = (format_planner.request_from_selector(format_string)
+                              if format_string else format_planner.make_request())
+        # 每次下載一個工作，記錄各階段耗時（見 metrics.get_job）
+        self.last_job_id = metrics.start_job(url)
+        self.last_plan = None
+        with metrics.activate(self.last_job_id):
+            try:
+                return self._download_with_retry(url, format_request, self.last_job_id)
+            finally:
+                self.budget.release(self.last_job_id)
+
+    def cancel(self):
+        """取消目前的下載：中斷 yt-dlp 並終止 ffmpeg 行程"""
+        self._cancelled.set()
+        self.terminate_ffmpeg_processes()
+
+    def terminate_ffmpeg_processes(self):
+        if self.last_job_id is not None:
+            terminate_processes(self.last_job_id)
+
+    def _check_cancelled(self, d=None):
+        # 也作為 yt-dlp 的 progress hook，在下載途中拋出例外中斷
+        if self._cancelled.is_set():
+            raise DownloadCancelled("下載已取消")
+
+    def _new_watchdog(self, settings):
+        return throughput.Watchdog.from_settings(settings)
+
+    def _new_retry_policy(self):
+        return retry_policy.RetryPolicy.from_settings(load_settings())
+
+    def _download_with_retry(self, url, format_request, job_id):
+        """依失敗類別重試：保留 .part 檔續傳，403/格式不可用時更換 player_client"""
+        policy = self._new_retry_policy()
+        while True:
+            try:
+                return self._download(url, format_request, job_id, policy.player_client)
+            except Exception as e:
+                if self._cancelled.is_set():
+                    if self.progress_hook:
+                        self.progress_hook({'status': 'error', 'message': '下載已取消'})
+                    raise DownloadCancelled("下載已取消") from e
+                decision = policy.on_failure(e, job_id)
+                if decision is None:
+                    if self.progress_hook:
+                        self.progress_hook({'status': 'error', 'message': str(e)})
+                    raise
+                # 失敗後重新排隊，讓其他工作可以使用預留的空間
+                self.budget.release(job_id)
+                if decision['replan']:
+                    forget_info(url)
+                if self.progress_hook and decision['class'] == retry_policy.STALLED:
+                    self.progress_hook({'status': 'downloading',
+                                        'message': '🐢 下載速度過慢，從目前位置重新連線...'})
+                elif self.progress_hook:
+                    self.progress_hook({'status': 'downloading',
+                                        'message': f"🔁 {decision['class']} 錯誤，"
+                                                   f"{decision['delay']:.0f} 秒後重試"
+                                                   f"（第 {decision['attempt']} 次）"})
+                with metrics.span(job_id, 'retry_wait', failure=decision['class']):
+                    # 等待期間也能被取消
+                    self._cancelled.wait(decision['delay'])
+
+    def _apply_plan(self, ydl, plan):
+        """將規劃結果寫入 yt-dlp 參數；沒有可用格式時拋出例外"""
+        if plan is None:
+            raise Exception("找不到符合條件的格式")
+        for reason in plan['fallbacks']:
+            logger.warning("格式規劃：%s", reason)
+            if self.progress_hook:
+                self.progress_hook({'status': 'downloading', 'message': f'⚠️ {reason}'})
+        logger.debug("Format plan: %s container=%s expected_size=%s",
+                     plan['format'], plan['container'], plan['expected_size'])
+        ydl.params['format'] = plan['format']
+        if plan['video'] and plan['audio']:
+            ydl.params['merge_output_format'] = plan['container']
+        # 合併後的檔案由 ffmpeg 產生，下載途中的雜湊用不上
+        if self.stream_hasher is not None:
+            self.stream_hasher.enabled = not (plan['video'] and plan['audio'])
+        self.last_plan = plan
+
+    def _preflight(self, plan, job_id, is_audio_only):
+        """估算最終與峰值磁碟用量並在共用預算中預留，空間不足時等待其他工作"""
+        settings = load_settings()
+        watermark = (not is_audio_only and watermark_function and self.ffmpeg_available)
+        footprint = disk_budget.estimate_footprint(
+            plan, watermark=watermark, parallel=settings['parallel_watermark'],
+            size_factor=settings['watermark_size_factor'])
+        if footprint is None:
+            logger.warning("無法估算 %s 的檔案大小，略過磁碟空間檢查", plan['format'])
+            return None
+        plan['footprint'] = footprint
+
+        notified = []
+
+        def on_wait(needed, available):
+            if self.progress_hook and not notified:
+                notified.append(True)
+                self.progress_hook({'status': 'downloading',
+                                    'message': f'⏳ 磁碟空間不足（需要 {needed // disk_budget.MB} MB），'
+                                               f'等待其他下載完成...'})
+
+        with metrics.span(job_id, 'disk_wait', bytes=footprint['peak']):
+            # 分段等待，讓取消可以生效
+            while not self.budget.acquire(job_id, footprint['peak'], timeout=1.0, on_wait=on_wait):
+                self._check_cancelled()
+        return footprint
+
+    def _download(self, url, format_request, job_id, player_client=None):
+        with metrics.span(job_id, 'url_clean'):
+            cleaned_url = clean_url(url)  # 使用全局的clean_url函數
         if not cleaned_url:
             raise ValueError("無效的 YouTube 連結")
 
-        # 檢查是否為音頻下載
-        is_audio_only = format_string.startswith("bestaudio")
-        print(f"[DEBUG core] is_audio_only: {is_audio_only}")
-        print(f"[DEBUG core] format_string: {format_string}")
-        print(f"[DEBUG core] ffmpeg_available: {self.ffmpeg_available}")
-
-        # 根据format_string确定输出格式
-        if is_audio_only:
-            output_format = 'bestaudio'  # 音頻保留原始格式，不轉換
-        else:
-            output_format = 'mp4'  # 默认为mp4
-            if 'vcodec^=hev' in format_string:
-                output_format = 'mp4'  # H.265默认使用mp4
-            elif '[vcodec^=vp9]' in format_string:
-                output_format = 'webm'  # VP9默认使用webm
-            elif 'MKV' in format_string:
-                output_format = 'mkv'
-
-        # 如果 FFmpeg 不可用，調整格式字串
-        if not self.ffmpeg_available:
-            print(f"[DEBUG core] FFmpeg not available, adjusting format")
-            if is_audio_only:
-                # 音頻下載：不限制擴展名，讓 yt-dlp 選擇最佳音頻
-                # YouTube 通常提供 m4a (AAC), opus (WEBM), 或其他格式
-                format_string = 'bestaudio'
-                output_format = 'bestaudio'  # 保留原始格式
-                print(f"[DEBUG core] Adjusted to audio format: {format_string}")
-                if self.progress_hook:
-                    self.progress_hook({
-                        'status': 'downloading',
-                        'message': '⚠️ FFmpeg 不可用，下載最佳音頻格式'
-                    })
-            else:
-                # 視頻下載：從格式字串中提取畫質要求
-                if 'height<=' in format_string:
-                    # 提取畫質限制，例如從 "bestvideo[height<=1080]..." 提取 1080
-                    import re
-                    match = re.search(r'height<=(\d+)', format_string)
-                    if match:
-                        height = match.group(1)
-                        # 使用已合併的格式，但限制畫質
-                        format_string = f'best[height<={height}][ext=mp4]/best[ext=mp4]/best'
-                    else:
-                        format_string = 'best[ext=mp4]/best'
-                else:
-                    format_string = 'best[ext=mp4]/best'
-
-                if self.progress_hook:
-                    self.progress_hook({
-                        'status': 'downloading',
-                        'message': '⚠️ FFmpeg 不可用，下載預合併格式'
-                    })
+        is_audio_only = format_request['audio_only']
+        logger.debug("format_request=%s ffmpeg_available=%s", format_request, self.ffmpeg_available)
 
         # 手動創建下載選項，避免 deepcopy 無法複製 progress_hook
-        print(f"[DEBUG core] Final format_string before creating opts: {format_string}")
-        print(f"[DEBUG core] Final output_format: {output_format}")
         download_opts = {
             'outtmpl': self.ydl_opts['outtmpl'],
-            'format': format_string,
             'quiet': self.ydl_opts.get('quiet', False),
             'noplaylist': self.ydl_opts.get('noplaylist', True),
+            'continuedl': True,  # 重試時從 .part 檔續傳
         }
-        print(f"[DEBUG core] download_opts format: {download_opts['format']}")
 
         # 複製 HTTP headers
         if 'http_headers' in self.ydl_opts:
@@ -397,110 +827,148 @@ class YouTubeDownloader:
             download_opts['extractor_args'] = {
                 'youtube': self.ydl_opts['extractor_args']['youtube'].copy()
             }
+            if player_client:
+                download_opts['extractor_args']['youtube']['player_client'] = list(player_client)
 
         # 複製 progress_hooks（這是無法 deepcopy 的部分）
-        if 'progress_hooks' in self.ydl_opts:
-            download_opts['progress_hooks'] = self.ydl_opts['progress_hooks']
-
-        # 只在非音頻模式下設置 merge_output_format
-        if output_format != 'bestaudio':
-            download_opts['merge_output_format'] = output_format
-
-        # 如果是音頻下載且有 FFmpeg，添加音頻提取後處理器
-        if is_audio_only and self.ffmpeg_available:
-            download_opts['postprocessors'] = [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'm4a',  # 使用 M4A（兼容 Apple 設備）
-                'preferredquality': '0',   # 0 = 最佳音質，不重新編碼
-            }]
-            # 設置 FFmpeg 位置
-            ffmpeg_location = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bin')
-            download_opts['ffmpeg_location'] = ffmpeg_location
-            print(f"[DEBUG core] Added FFmpegExtractAudio postprocessor, ffmpeg at: {ffmpeg_location}")
+        tracker = metrics.YtdlpTracker(job_id)
+        self.stream_hasher = atomic_files.StreamHasher()
+        download_opts['progress_hooks'] = ([self._check_cancelled, tracker.progress_hook,
+                                            self.stream_hasher.progress_hook]
+                                           + self.ydl_opts.get('progress_hooks', []))
+        # 串流速度持續低於近期峰值時中斷，交給重試從 .part 續傳
+        settings = load_settings()
+        if settings['watchdog_enabled']:
+            download_opts['progress_hooks'].append(self._new_watchdog(settings).progress_hook)
+        download_opts['postprocessor_hooks'] = [tracker.postprocessor_hook]
+
+        # 只有本地 bin 目錄有 ffmpeg 時才指定位置，否則讓 yt-dlp 使用 PATH 中的 ffmpeg
+        # 純音訊不再加入 FFmpegExtractAudio，下載後由 _finish_audio 依實際檔案決定
+        ffmpeg_path = get_ffmpeg_path()
+        if ffmpeg_path != 'ffmpeg':
+            download_opts['ffmpeg_location'] = ffmpeg_path
 
         with yt_dlp.YoutubeDL(download_opts) as ydl:
-            try:
-                # 獲取影片資訊
-                info = ydl.extract_info(cleaned_url, download=False)
-                video_title = info.get('title', 'Unknown Title')
-
-                # 下載影片
-                ydl.download([cleaned_url])
-
-                # 準備文件路徑
-                file_path = ydl.prepare_filename(info)
-
-                # 對於音頻下載，需要找到實際下載的文件
-                if output_format == 'bestaudio':
-                    # 如果使用了 FFmpeg 提取，文件會是 .m4a
-                    base_path = os.path.splitext(file_path)[0]
-
-                    if self.ffmpeg_available:
-                        # 有 FFmpeg 時，文件會被提取為 .m4a
-                        file_path = base_path + '.m4a'
-                        print(f"[DEBUG core] Looking for extracted audio: {file_path}")
-                    else:
-                        # 沒有 FFmpeg 時，嘗試找原始音頻格式
-                        possible_extensions = ['.m4a', '.webm', '.opus', '.mp4', '.aac']
-                        file_found = False
-                        for ext in possible_extensions:
-                            test_path = base_path + ext
-                            if os.path.exists(test_path):
-                                file_path = test_path
-                                file_found = True
-                                print(f"[DEBUG core] Found audio file: {file_path}")
-                                break
-
-                        if not file_found and not os.path.exists(file_path):
-                            raise Exception(f"找不到下載的音頻文件。嘗試過的路徑: {base_path}{{.m4a,.webm,.opus,.mp4,.aac}}")
-                else:
-                    # 視頻下載：調整擴展名
-                    if not file_path.endswith(f'.{output_format}'):
-                        file_path = os.path.splitext(file_path)[0] + f'.{output_format}'
-
-                    # 確認文件存在
-                    if not os.path.exists(file_path):
-                        raise Exception(f"下載的文件不存在: {file_path}")
+            # 下載影片（單次擷取）：快取命中時直接以具體格式 ID 下載，
+            # 否則先擷取未處理的資訊、規劃格式後再交給 yt-dlp 處理
+            tracker.start_extract()
+            cached = get_cached_info(cleaned_url)
+            if cached is not None:
+                self._apply_plan(ydl, format_planner.plan_formats(
+                    cached['formats'], format_request,
+                    ffmpeg_available=self.ffmpeg_available, duration=cached['duration']))
+                self._preflight(self.last_plan, job_id, is_audio_only)
+                info = ydl.extract_info(cleaned_url, download=True)
+            else:
+                info = ydl.extract_info(cleaned_url, download=False, process=False)
+                cached = cache_info(info)
+                self._apply_plan(ydl, format_planner.plan_formats(
+                    cached['formats'], format_request,
+                    ffmpeg_available=self.ffmpeg_available, duration=cached['duration']))
+                self._preflight(self.last_plan, job_id, is_audio_only)
+                info = ydl.process_ie_result(info, download=True)
+            tracker.finish()
+            video_title = info.get('title', 'Unknown Title')
 
-                # 音頻文件不需要水印處理
-                if is_audio_only:
+            # 以 yt-dlp 回報的實際輸出路徑為準，不再依副檔名猜測
+            file_path = self._resolve_output_path(ydl, info, is_audio_only)
+            if not file_path:
+                base_path = os.path.splitext(ydl.prepare_filename(info))[0]
+                raise Exception(f"下載的文件不存在: {base_path}.*")
+
+            logger.debug("Resolved output file: %s", file_path)
+            # 後處理期間（可能數十分鐘）不保留完整的 info
+            info = trim_download_info(info)
+        return self._finish(info, video_title, file_path, is_audio_only)
+
+    def _finish_audio(self, file_path):
+        """純音訊：容器已相符時直接使用，只需換容器時串流複製，必要時才轉碼；返回實際輸出路徑"""
+        target = load_settings()['audio_loudnorm']
+        plan = audio_pipeline.plan_output(file_path, loudnorm=target is not None)
+        if plan is None or plan['action'] == 'none':
+            return file_path
+        if not self.ffmpeg_available:
+            logger.warning("⚠️ FFmpeg 不可用，保留原始音訊檔：%s", file_path)
+            return file_path
+
+        ffmpeg_path = get_ffmpeg_path()
+        audio_filter = None
+        if target is not None:
+            if self.progress_hook:
+                self.progress_hook({'status': 'processing', 'message': '正在分析響度...'})
+            with metrics.span(metrics.current_job(), 'loudness_analysis'):
+                measured = audio_pipeline.measure_loudness(ffmpeg_path, file_path, target)
+            if measured is not None:
+                audio_filter = audio_pipeline.loudnorm_filter(target, measured)
+            else:
+                # 無法正規化：改用不正規化的處理方式
+                plan = audio_pipeline.plan_output(file_path)
+                if plan['action'] == 'none':
+                    return file_path
+
+        # 寫入暫存檔後原子換名；取代來源時直接換名到來源路徑
+        final_path = file_path if plan['replace'] else plan['output']
+        plan = dict(plan, output=atomic_files.part_path(final_path))
+        with metrics.span(metrics.current_job(), 'audio', action=plan['action'], codec=plan['codec']) as span:
+            returncode = run_ffmpeg(audio_pipeline.build_command(ffmpeg_path, file_path, plan, audio_filter),
+                                    progress_hook=self.progress_hook)
+            span['exit_code'] = returncode
+        if returncode != 0:
+            atomic_files.discard(plan['output'])
+        self._check_cancelled()
+        if returncode != 0:
+            logger.error("❌ 音訊處理失敗：ffmpeg返回錯誤碼 %s，使用原始文件", returncode)
+            return file_path
+
+        atomic_files.finalize(plan['output'], final_path, stage='audio')
+        if final_path != file_path:
+            os.remove(file_path)
+        return final_path
+
+    def _finish(self, info, video_title, file_path, is_audio_only):
+        """下載完成後的處理（浮水印）；asyncio 版本覆寫此方法改用非同步行程"""
+        # 音頻文件不需要水印處理
+        if is_audio_only:
+            file_path = self._finish_audio(file_path)
+            # 音訊階段換名時已記錄；直接使用下載檔時在這裡記錄
+            atomic_files.record_existing(file_path, stage='download', hasher=self.stream_hasher)
+            if self.progress_hook:
+                self.progress_hook({'status': 'finished', 'message': '音頻下載完成'})
+            return info, video_title, file_path
+
+        # 根據watermark_function決定是否添加浮水印
+        if watermark_function:
+            # 檢查 FFmpeg 是否可用
+            ffmpeg_available = check_ffmpeg_available()
+
+            if ffmpeg_available:
+                # FFmpeg 可用，添加浮水印
+                if self.progress_hook:
+                    self.progress_hook({'status': 'processing', 'message': '正在添加浮水印...'})
+
+                watermarked_path = os.path.splitext(file_path)[0] + '_watermarked.mp4'
+                watermarked = add_watermark(file_path, watermarked_path, self.progress_hook)
+                self._check_cancelled()
+                if watermarked:
+                    # 刪除原始文件
+                    os.remove(file_path)
                     if self.progress_hook:
-                        self.progress_hook({'status': 'finished', 'message': '音頻下載完成'})
-                    return info, video_title, file_path
-
-                # 根據watermark_function決定是否添加浮水印
-                if watermark_function:
-                    # 檢查 FFmpeg 是否可用
-                    ffmpeg_available = check_ffmpeg_available()
-
-                    if ffmpeg_available:
-                        # FFmpeg 可用，添加浮水印
-                        if self.progress_hook:
-                            self.progress_hook({'status': 'processing', 'message': '正在添加浮水印...'})
-
-                        watermarked_path = os.path.splitext(file_path)[0] + '_watermarked.mp4'
-                        if add_watermark(file_path, watermarked_path):
-                            # 刪除原始文件
-                            os.remove(file_path)
-                            if self.progress_hook:
-                                self.progress_hook({'status': 'finished', 'message': '浮水印添加完成'})
-                            return info, video_title, watermarked_path
-                        else:
-                            if self.progress_hook:
-                                self.progress_hook({'status': 'finished', 'message': '浮水印添加失敗，使用原始文件'})
-                            return info, video_title, file_path
-                    else:
-                        # FFmpeg 不可用，直接返回原始文件
-                        if self.progress_hook:
-                            self.progress_hook({'status': 'finished', 'message': '⚠️ FFmpeg 不可用，跳過水印處理'})
-                        return info, video_title, file_path
+                        self.progress_hook({'status': 'finished', 'message': '浮水印添加完成'})
+                    return info, video_title, watermarked_path
                 else:
-                    # 不添加浮水印
+                    atomic_files.record_existing(file_path, stage='download', hasher=self.stream_hasher)
                     if self.progress_hook:
-                        self.progress_hook({'status': 'finished', 'message': '下載完成'})
+                        self.progress_hook({'status': 'finished', 'message': '浮水印添加失敗，使用原始文件'})
                     return info, video_title, file_path
-                    
-            except Exception as e:
+            else:
+                # FFmpeg 不可用，直接返回原始文件
+                atomic_files.record_existing(file_path, stage='download', hasher=self.stream_hasher)
                 if self.progress_hook:
-                    self.progress_hook({'status': 'error', 'message': str(e)})
-                raise 
\ No newline at end of file
+                    self.progress_hook({'status': 'finished', 'message': '⚠️ FFmpeg 不可用，跳過水印處理'})
+                return info, video_title, file_path
+        else:
+            # 不添加浮水印
+            atomic_files.record_existing(file_path, stage='download', hasher=self.stream_hasher)
+            if self.progress_hook:
+                self.progress_hook({'status': 'finished', 'message': '下載完成'})
+            return info, video_title, file_path
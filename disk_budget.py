@@ -0,0 +1,127 @@
+import os
+import shutil
+import logging
+import threading
+import contextlib
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+
+class InsufficientSpaceError(OSError):
+    """所需空間超過磁碟可提供的上限，等待也無法滿足"""
+
+
+def estimate_footprint(plan, watermark=False, parallel=False, size_factor=1.0):
+    """依格式規劃估算磁碟用量
+
+    各階段同時存在的檔案：
+        下載：分離的影像與音訊（.part 完成後改名，大小相同）
+        合併：影像 + 音訊 + 合併後檔案
+        浮水印：合併後檔案 + 浮水印版本
+        分段平行浮水印：合併後檔案 + 串流複製切出的來源片段（視訊軌，以來源大小計）
+                        + 加浮水印的片段 + 串接後的浮水印版本
+    浮水印版本以 size_factor 乘上來源大小估算（無損編碼通常比來源大）
+
+    Returns:
+        {'final': 最終檔案大小, 'peak': 過程中的最大用量}，無法估算時返回 None
+    """
+    if plan is None or not plan.get('expected_size'):
+        return None
+    source = plan['expected_size']
+    peak = source
+    if plan.get('video') and plan.get('audio'):
+        peak = 2 * source  # 合併時分離檔與合併檔同時存在
+
+    final = source
+    if watermark:
+        output = int(source * size_factor)
+        peak = max(peak, 2 * source + 2 * output if parallel else source + output)
+        final = output
+    return {'final': final, 'peak': peak}
+
+
+class DiskBudget:
+    """同一資料夾內所有下載工作共用的磁碟空間預留
+
+    可用空間 = 目前剩餘空間 - 已預留的量 - 保留邊界。執行中的工作已寫入的部分
+    同時反映在剩餘空間與預留量中，所以估算偏保守；空間不足時等待其他工作釋放
+    """
+
+    def __init__(self, folder, margin=512 * MB):
+        self.folder = folder
+        self.margin = margin
+        self._cond = threading.Condition()
+        self._reserved = {}
+
+    def free_bytes(self):
+        os.makedirs(self.folder, exist_ok=True)
+        return shutil.disk_usage(self.folder).free
+
+    def reserved_bytes(self):
+        with self._cond:
+            return sum(self._reserved.values())
+
+    def _fits(self, nbytes):
+        return self.free_bytes() - sum(self._reserved.values()) - self.margin >= nbytes
+
+    def acquire(self, job_id, nbytes, timeout=None, on_wait=None):
+        """預留 nbytes，空間不足時等待其他工作釋放
+
+        Args:
+            on_wait: 開始等待時呼叫一次，參數為 (需要, 目前可用) 的位元組數
+            timeout: 最長等待秒數，None 表示一直等待
+        Returns:
+            是否成功預留（逾時返回 False）
+        Raises:
+            InsufficientSpaceError: 其他預留全部釋放後仍放不下，等待也不會有結果
+        """
+        with self._cond:
+            waited = False
+            while not self._fits(nbytes):
+                reserved = sum(self._reserved.values())
+                available = self.free_bytes() - reserved - self.margin
+                # 即使其他工作全部釋放也放不下時不必等待
+                if available + reserved < nbytes:
+                    raise InsufficientSpaceError(
+                        f"需要 {nbytes / MB:.0f} MB，{self.folder} 只剩 {max(available, 0) / MB:.0f} MB")
+                if not waited:
+                    waited = True
+                    logger.debug("Job %s waiting for disk space: need %d bytes, %d available",
+                                job_id, nbytes, available)
+                    if on_wait:
+                        on_wait(nbytes, available)
+                if not self._cond.wait(timeout):
+                    return False
+            self._reserved[job_id] = self._reserved.get(job_id, 0) + nbytes
+            return True
+
+    def release(self, job_id):
+        with self._cond:
+            if self._reserved.pop(job_id, None) is not None:
+                self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def reserve(self, job_id, nbytes, timeout=None, on_wait=None):
+        if not self.acquire(job_id, nbytes, timeout, on_wait):
+            raise TimeoutError(f"等待磁碟空間逾時（{nbytes / MB:.0f} MB）")
+        try:
+            yield
+        finally:
+            self.release(job_id)
+
+
+_budgets = {}
+_budgets_lock = threading.Lock()
+
+
+def get_budget(folder, margin=512 * MB):
+    """取得資料夾共用的預算物件（同一路徑只建立一次，margin 以最後一次設定為準）"""
+    key = os.path.abspath(folder)
+    with _budgets_lock:
+        budget = _budgets.get(key)
+        if budget is None:
+            budget = _budgets[key] = DiskBudget(folder, margin)
+        budget.margin = margin
+        return budget
@@ -0,0 +1,247 @@
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import tempfile
+import functools
+import threading
+import subprocess
+
+# 各編碼器的參數：input_args 放在 -i 之前，filter 接在浮水印濾鏡之後，args 放在 -c:v 之後
+ENCODER_SPECS = {
+    # NVIDIA
+    'h264_nvenc': {'codec': 'h264', 'hardware': True,
+                   'args': ['-preset', 'p7', '-rc', 'constqp', '-qp', '0',
+                            '-profile:v', 'high', '-pix_fmt', 'yuv420p']},
+    'hevc_nvenc': {'codec': 'hevc', 'hardware': True,
+                   'args': ['-preset', 'p7', '-rc', 'constqp', '-qp', '0',
+                            '-pix_fmt', 'yuv420p']},
+    # Intel Quick Sync
+    'h264_qsv': {'codec': 'h264', 'hardware': True,
+                 'args': ['-preset', 'veryslow', '-global_quality', '18',
+                          '-pix_fmt', 'nv12']},
+    'hevc_qsv': {'codec': 'hevc', 'hardware': True,
+                 'args': ['-preset', 'veryslow', '-global_quality', '18',
+                          '-pix_fmt', 'nv12']},
+    # VAAPI（Linux，Intel/AMD）
+    'h264_vaapi': {'codec': 'h264', 'hardware': True,
+                   'input_args': ['-vaapi_device', '/dev/dri/renderD128'],
+                   'filter': 'format=nv12,hwupload',
+                   'args': ['-qp', '18']},
+    'hevc_vaapi': {'codec': 'hevc', 'hardware': True,
+                   'input_args': ['-vaapi_device', '/dev/dri/renderD128'],
+                   'filter': 'format=nv12,hwupload',
+                   'args': ['-qp', '18']},
+    # Apple VideoToolbox
+    'h264_videotoolbox': {'codec': 'h264', 'hardware': True,
+                          'args': ['-q:v', '80', '-pix_fmt', 'yuv420p']},
+    'hevc_videotoolbox': {'codec': 'hevc', 'hardware': True,
+                          'args': ['-q:v', '80', '-pix_fmt', 'yuv420p']},
+    # 軟體編碼
+    'libx264': {'codec': 'h264', 'hardware': False,
+                'args': ['-preset', 'veryslow', '-crf', '0']},
+    'libx265': {'codec': 'hevc', 'hardware': False,
+                'args': ['-preset', 'slow', '-x265-params', 'lossless=1:log-level=error']},
+}
+
+# 各編碼格式的候選編碼器，最後一個是軟體後備
+CODEC_CANDIDATES = {
+    'h264': ['h264_nvenc', 'h264_qsv', 'h264_vaapi', 'h264_videotoolbox', 'libx264'],
+    'hevc': ['hevc_nvenc', 'hevc_qsv', 'hevc_vaapi', 'hevc_videotoolbox', 'libx265'],
+}
+
+# 品質門檻：測試片段的平均 PSNR（dB）
+DEFAULT_MIN_PSNR = 40.0
+
+BENCHMARK_CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                    'encoder_benchmark.json')
+
+# 測試片段：lavfi 產生，不需要任何外部檔案
+BENCHMARK_SOURCE = 'testsrc2=size=1280x720:rate=30'
+BENCHMARK_SECONDS = 2
+
+_benchmark_lock = threading.Lock()
+_encoder_list_cache = {}
+
+
+def target_codec(source_vcodec):
+    """依來源影片編碼決定輸出編碼；沒有對應編碼器的格式（VP9、AV1 等）輸出 H.264"""
+    return source_vcodec if source_vcodec in CODEC_CANDIDATES else 'h264'
+
+
+def list_encoders(ffmpeg_path):
+    """列出本機 ffmpeg 編譯時支援的視訊編碼器名稱"""
+    if ffmpeg_path in _encoder_list_cache:
+        return _encoder_list_cache[ffmpeg_path]
+
+    encoders = set()
+    try:
+        result = subprocess.run([ffmpeg_path, '-hide_banner', '-encoders'],
+                                capture_output=True, text=True, timeout=10)
+        for line in result.stdout.splitlines():
+            # 格式：" V....D libx264              libx264 H.264 ..."
+            match = re.match(r'\s*V\S{5}\s+(\S+)', line)
+            if match:
+                encoders.add(match.group(1))
+    except (OSError, subprocess.SubprocessError):
+        pass
+
+    _encoder_list_cache[ffmpeg_path] = encoders
+    return encoders
+
+
+def supported_candidates(ffmpeg_path, codec):
+    """返回本機 ffmpeg 有編譯進來的候選編碼器（尚未確認硬體可用）"""
+    available = list_encoders(ffmpeg_path)
+    return [name for name in CODEC_CANDIDATES.get(codec, []) if name in available]
+
+
+@functools.lru_cache(maxsize=None)
+def get_ffmpeg_version(ffmpeg_path):
+    try:
+        result = subprocess.run([ffmpeg_path, '-version'],
+                                capture_output=True, text=True, timeout=5)
+        return result.stdout.splitlines()[0] if result.stdout else ''
+    except (OSError, subprocess.SubprocessError):
+        return ''
+
+
+def build_encode_args(encoder):
+    """返回 (input_args, filter_suffix, output_args)
+
+    filter_suffix 需接在濾鏡鏈最後（例如 VAAPI 的 hwupload），沒有時為空字串
+    """
+    spec = ENCODER_SPECS.get(encoder, ENCODER_SPECS['libx264'])
+    output_args = ['-c:v', encoder] + list(spec['args'])
+    return list(spec.get('input_args', [])), spec.get('filter', ''), output_args
+
+
+def _measure_psnr(ffmpeg_path, encoded, reference):
+    result = subprocess.run([ffmpeg_path, '-hide_banner', '-nostats',
+                             '-i', encoded, '-i', reference,
+                             '-lavfi', '[0:v][1:v]psnr', '-f', 'null', '-'],
+                            capture_output=True, text=True, timeout=120)
+    match = re.search(r'average:(\S+)', result.stderr)
+    if result.returncode != 0 or not match:
+        return None
+    value = match.group(1)
+    return float('inf') if value == 'inf' else float(value)
+
+
+def benchmark_encoder(ffmpeg_path, encoder, reference, frames):
+    """以測試片段實際編碼一次，返回 {'ok', 'fps', 'psnr', 'seconds'}"""
+    input_args, filter_suffix, output_args = build_encode_args(encoder)
+    encoded = os.path.join(os.path.dirname(reference), f'{encoder}.mkv')
+    command = [ffmpeg_path, '-hide_banner', '-nostats', '-loglevel', 'error', '-y',
+               *input_args, '-i', reference]
+    if filter_suffix:
+        command.extend(['-vf', filter_suffix])
+    command.extend(output_args + ['-an', encoded])
+
+    start = time.perf_counter()
+    try:
+        result = subprocess.run(command, capture_output=True, text=True, timeout=300)
+    except (OSError, subprocess.SubprocessError) as e:
+        return {'ok': False, 'error': str(e)}
+    seconds = time.perf_counter() - start
+
+    if result.returncode != 0:
+        # 編譯有支援但沒有對應硬體時會在這裡失敗
+        return {'ok': False, 'error': result.stderr.strip()[-300:]}
+
+    psnr = _measure_psnr(ffmpeg_path, encoded, reference)
+    return {
+        'ok': psnr is not None,
+        'fps': frames / seconds if seconds > 0 else 0.0,
+        'psnr': psnr,
+        'seconds': seconds,
+    }
+
+
+def run_benchmark(ffmpeg_path, candidates):
+    """為候選編碼器建立測試片段並逐一測速"""
+    frames = BENCHMARK_SECONDS * 30
+    workdir = tempfile.mkdtemp(prefix='encoder_bench_')
+    try:
+        reference = os.path.join(workdir, 'reference.mkv')
+        # FFV1 無損參考片段，PSNR 才能反映編碼器本身的品質
+        subprocess.run([ffmpeg_path, '-hide_banner', '-loglevel', 'error', '-y',
+                        '-f', 'lavfi', '-i', BENCHMARK_SOURCE,
+                        '-t', str(BENCHMARK_SECONDS), '-pix_fmt', 'yuv420p',
+                        '-c:v', 'ffv1', reference],
+                       capture_output=True, check=True, timeout=120)
+        return {name: benchmark_encoder(ffmpeg_path, name, reference, frames)
+                for name in candidates}
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _load_benchmark_cache(cache_file):
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_benchmark_cache(cache_file, data):
+    tmp_file = cache_file + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_file, cache_file)
+
+
+def get_benchmark_results(ffmpeg_path, codec, cache_file=None):
+    """取得候選編碼器的測速結果；同一版本的 ffmpeg 只測一次並寫入快取檔"""
+    cache_file = cache_file or BENCHMARK_CACHE_FILE
+    candidates = supported_candidates(ffmpeg_path, codec)
+    if not candidates:
+        return {}
+
+    with _benchmark_lock:
+        version = get_ffmpeg_version(ffmpeg_path)
+        cache = _load_benchmark_cache(cache_file)
+        if cache.get('ffmpeg_version') != version:
+            cache = {'ffmpeg_version': version, 'results': {}}
+
+        results = cache['results']
+        missing = [name for name in candidates if name not in results]
+        if missing:
+            results.update(run_benchmark(ffmpeg_path, missing))
+            try:
+                _save_benchmark_cache(cache_file, cache)
+            except OSError:
+                pass
+        return {name: results[name] for name in candidates}
+
+
+def select_encoder(ffmpeg_path, codec='h264', min_psnr=DEFAULT_MIN_PSNR, cache_file=None):
+    """選出達到品質門檻的最快編碼器；全部不可用時退回軟體編碼器"""
+    candidates = supported_candidates(ffmpeg_path, codec)
+    fallback = CODEC_CANDIDATES.get(codec, CODEC_CANDIDATES['h264'])[-1]
+    if fallback not in candidates:
+        # 沒有對應的軟體編碼器時，H.264 一定可用
+        fallback = 'libx264'
+
+    try:
+        results = get_benchmark_results(ffmpeg_path, codec, cache_file)
+    except (OSError, subprocess.SubprocessError):
+        return fallback
+
+    passed = [(r['fps'], name) for name, r in results.items()
+              if r.get('ok') and r.get('psnr') is not None and r['psnr'] >= min_psnr]
+    if not passed:
+        return fallback
+    return max(passed)[1]
+
+
+if __name__ == '__main__':
+    # 用法：python encoders.py [ffmpeg路徑] [h264|hevc]
+    ffmpeg = sys.argv[1] if len(sys.argv) > 1 else 'ffmpeg'
+    codec = sys.argv[2] if len(sys.argv) > 2 else 'h264'
+    print(f"支援的候選編碼器: {supported_candidates(ffmpeg, codec)}")
+    for name, result in get_benchmark_results(ffmpeg, codec).items():
+        print(f"{name:20s} {result}")
+    print(f"選用: {select_encoder(ffmpeg, codec)}")
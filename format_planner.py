@@ -0,0 +1,209 @@
+import re
+
+# 格式表只保留排序與估算大小需要的欄位
+FORMAT_FIELDS = ('format_id', 'ext', 'vcodec', 'acodec', 'width', 'height', 'fps',
+                 'tbr', 'vbr', 'abr', 'asr', 'filesize', 'filesize_approx', 'protocol',
+                 'language_preference', 'preference', 'format_note')
+
+# 各容器可直接放入（不需轉碼）的編碼
+CONTAINER_CODECS = {
+    'mp4': {'video': {'avc', 'hevc', 'av1', 'vp9'}, 'audio': {'aac', 'opus', 'mp3'}},
+    'webm': {'video': {'vp9', 'av1'}, 'audio': {'opus', 'vorbis'}},
+    'mkv': None,  # 任何編碼皆可
+}
+
+# 音訊容器偏好（純音訊下載時）：m4a 優先 AAC，webm/opus 優先 Opus
+AUDIO_PREFERENCE = {'m4a': 'aac', 'mp4': 'aac', 'webm': 'opus', 'opus': 'opus'}
+
+# 格式需求可用的容器
+CONTAINERS = tuple(dict.fromkeys([*CONTAINER_CODECS, *AUDIO_PREFERENCE]))
+
+
+def codec_family(codec):
+    """將 'avc1.640028'、'hvc1'、'vp09.00.51.08' 等編碼字串正規化"""
+    if not codec or codec == 'none':
+        return None
+    codec = codec.lower()
+    for prefix, family in (('avc', 'avc'), ('h264', 'avc'), ('hev', 'hevc'), ('hvc', 'hevc'),
+                           ('h265', 'hevc'), ('vp09', 'vp9'), ('vp9', 'vp9'), ('vp8', 'vp8'),
+                           ('av01', 'av1'), ('av1', 'av1'), ('mp4a', 'aac'), ('aac', 'aac'),
+                           ('opus', 'opus'), ('vorbis', 'vorbis'), ('mp3', 'mp3')):
+        if codec.startswith(prefix):
+            return family
+    return codec
+
+
+def format_table(formats):
+    """從 yt-dlp 的 formats 取出精簡的格式表（不含 URL 與 headers，可長期快取）"""
+    table = []
+    for f in formats or []:
+        if f.get('format_id') is None:
+            continue
+        # 略過 storyboard 等非影音格式
+        if f.get('vcodec') in (None, 'none') and f.get('acodec') in (None, 'none') \
+                and f.get('ext') == 'mhtml':
+            continue
+        table.append({key: f.get(key) for key in FORMAT_FIELDS})
+    return table
+
+
+def estimate_size(fmt, duration):
+    """估算格式大小（bytes）：優先使用 filesize，其次為位元率乘以時長"""
+    if not fmt:
+        return 0
+    size = fmt.get('filesize') or fmt.get('filesize_approx')
+    if size:
+        return int(size)
+    bitrate = fmt.get('tbr') or (fmt.get('vbr') or 0) + (fmt.get('abr') or 0)
+    if bitrate and duration:
+        return int(bitrate * 1000 / 8 * duration)
+    return None
+
+
+def _has_video(f):
+    return codec_family(f.get('vcodec')) is not None
+
+
+def _has_audio(f):
+    return codec_family(f.get('acodec')) is not None
+
+
+def _compatible(container, kind, codec):
+    allowed = CONTAINER_CODECS.get(container)
+    return allowed is None or codec in allowed[kind]
+
+
+def _video_key(f, request):
+    family = codec_family(f.get('vcodec'))
+    return (
+        family == request['vcodec'],  # 使用者指定的編碼優先
+        _compatible(request['container'], 'video', family),
+        f.get('height') or 0,
+        f.get('fps') or 0,
+        f.get('vbr') or f.get('tbr') or 0,
+    )
+
+
+def _preference(value):
+    # yt-dlp 未設定時視為 -1
+    return value if value is not None else -1
+
+
+def _is_drc(f):
+    return '-drc' in (f.get('format_id') or '') or 'drc' in (f.get('format_note') or '').lower()
+
+
+def _audio_key(f, preferred, container):
+    family = codec_family(f.get('acodec'))
+    return (
+        # 多音軌影片：原始語言（language_preference 最高）優先，不選配音或 DRC 版本
+        _preference(f.get('language_preference')),
+        _preference(f.get('preference')),
+        not _is_drc(f),
+        not (f.get('protocol') or '').startswith('m3u8'),
+        family == preferred,
+        _compatible(container, 'audio', family) if container else True,
+        f.get('abr') or f.get('tbr') or 0,
+    )
+
+
+def make_request(height=None, vcodec=None, container='mp4', audio_only=False):
+    """格式需求：height 為 None 表示不限畫質，vcodec 為 None 表示不限編碼"""
+    return {'height': height, 'vcodec': vcodec, 'container': container,
+            'audio_only': audio_only}
+
+
+def request_from_selector(selector):
+    """將舊式 yt-dlp 選擇字串（例如 GUI 以前產生的）轉成格式需求"""
+    if selector.startswith('bestaudio'):
+        return make_request(audio_only=True, container='m4a')
+    height = re.search(r'height<=(\d+)', selector)
+    vcodec = re.search(r'vcodec\^=(\w+)', selector)
+    family = codec_family(vcodec.group(1)) if vcodec else None
+    container = 'webm' if family == 'vp9' else 'mp4'
+    return make_request(height=int(height.group(1)) if height else None,
+                        vcodec=family, container=container)
+
+
+def plan_formats(formats, request, ffmpeg_available=True, duration=None):
+    """從格式表挑出具體的格式 ID
+
+    Returns:
+        dict：
+            format: 傳給 yt-dlp 的格式，例如 '137+140'
+            video / audio: 選中的格式（純音訊或預先合併時 video/audio 其一為 None）
+            container: 輸出容器
+            expected_size: 預估大小（bytes），無法估算時為 None
+            fallbacks: 與需求不符之處的說明列表（不再靜默回退）
+        沒有任何可用格式時返回 None
+    """
+    formats = formats or []
+    fallbacks = []
+
+    if request['audio_only']:
+        candidates = [f for f in formats if _has_audio(f) and not _has_video(f)]
+        if not candidates:
+            candidates = [f for f in formats if _has_audio(f)]
+            fallbacks.append('沒有純音訊格式，改用含影像的格式')
+        if not candidates:
+            return None
+        preferred = AUDIO_PREFERENCE.get(request['container'], 'aac')
+        audio = max(candidates, key=lambda f: _audio_key(f, preferred, None))
+        if codec_family(audio.get('acodec')) != preferred:
+            fallbacks.append(f"沒有 {preferred} 音訊，改用 {codec_family(audio.get('acodec'))}")
+        return {
+            'format': audio['format_id'],
+            'video': None,
+            'audio': audio,
+            'container': audio.get('ext'),
+            'expected_size': estimate_size(audio, duration),
+            'fallbacks': fallbacks,
+        }
+
+    height = request['height'] or float('inf')
+    if ffmpeg_available:
+        videos = [f for f in formats if _has_video(f) and not _has_audio(f)
+                  and (f.get('height') or 0) <= height]
+        audios = [f for f in formats if _has_audio(f) and not _has_video(f)]
+    else:
+        # 沒有 FFmpeg 無法合併，只能選預先合併的格式
+        videos, audios = [], []
+        fallbacks.append('FFmpeg 不可用，改用預先合併的格式')
+
+    if videos and audios:
+        video = max(videos, key=lambda f: _video_key(f, request))
+        container = request['container']
+        preferred = 'opus' if container == 'webm' else 'aac'
+        audio = max(audios, key=lambda f: _audio_key(f, preferred, container))
+        if request['vcodec'] and codec_family(video.get('vcodec')) != request['vcodec']:
+            fallbacks.append(f"沒有 {request['vcodec']} 影像（≤{request['height']}p），"
+                             f"改用 {codec_family(video.get('vcodec'))}")
+        sizes = [estimate_size(video, duration), estimate_size(audio, duration)]
+        return {
+            'format': f"{video['format_id']}+{audio['format_id']}",
+            'video': video,
+            'audio': audio,
+            'container': container,
+            'expected_size': None if None in sizes else sum(sizes),
+            'fallbacks': fallbacks,
+        }
+
+    muxed = [f for f in formats if _has_video(f) and _has_audio(f)]
+    if not muxed:
+        return None
+    within = [f for f in muxed if (f.get('height') or 0) <= height]
+    if not within:
+        within = muxed
+        fallbacks.append(f"沒有 ≤{request['height']}p 的格式")
+    # 沒有 FFmpeg 時無法轉換容器，以 mp4 為優先
+    best = max(within, key=lambda f: (f.get('ext') == 'mp4',) + _video_key(f, request))
+    if ffmpeg_available:
+        fallbacks.append('沒有分離的影音串流，改用預先合併的格式')
+    return {
+        'format': best['format_id'],
+        'video': best,
+        'audio': None,
+        'container': best.get('ext'),
+        'expected_size': estimate_size(best, duration),
+        'fallbacks': fallbacks,
+    }
@@ -1,22 +1,33 @@
 import sys
 import os
+import logging
 import subprocess
 import urllib.request
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                             QHBoxLayout, QLineEdit, QPushButton, QLabel, 
                             QListWidget, QListWidgetItem, QTextEdit, QSplitter,
                             QFrame, QFileDialog, QProgressBar, QComboBox, QSizePolicy)
-from PyQt6.QtCore import Qt, QThread, pyqtSignal, QSize
-from PyQt6.QtGui import QIcon, QFont, QPixmap, QPainter
+from PyQt6.QtCore import Qt, QThread, QObject, QTimer, pyqtSignal, QSize, QByteArray, QBuffer, QIODevice
+from PyQt6.QtGui import QIcon, QFont, QPixmap, QPainter, QImage, QImageReader
 import core
+import format_planner
+import playlist
+import url_canon
+import library_index
+import previews
 import requests
-from io import BytesIO
 from user import MemberPage
 from settings_page import SettingsPage 
 
 
 
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+# 媒體庫搜尋框停止輸入多久後才查詢（毫秒）
+LIBRARY_SEARCH_DELAY_MS = 200
+# 同時取得標題與封面的執行緒上限（展開大型清單時不會一次開數百個執行緒）
+TITLE_WORKER_LIMIT = 4
+
+logger = logging.getLogger(__name__)
 
 class DownloadWorker(QThread):
     """下載影片的工作執行緒"""
@@ -24,10 +35,10 @@ class DownloadWorker(QThread):
     progress = pyqtSignal(str)
     progress_percent = pyqtSignal(float)
 
-    def __init__(self, url, format_string):
+    def __init__(self, url, format_request):
         super().__init__()
         self.url = url
-        self.format_string = format_string
+        self.format_request = format_request
         self.downloader = core.YouTubeDownloader(progress_hook=self.progress_hook)
         self._is_running = True
         
@@ -67,17 +78,13 @@ class DownloadWorker(QThread):
         
     def run(self):
         try:
-            print(f"[DEBUG Worker] Starting download for: {self.url}")
-            print(f"[DEBUG Worker] Format string: {self.format_string}")
-            print(f"[DEBUG Worker] Is running: {self._is_running}")
+            logger.debug("Starting download for %s (format %s)", self.url, self.format_request)
 
             if not self._is_running:
-                print(f"[DEBUG Worker] Not running, returning")
                 return
 
-            print(f"[DEBUG Worker] Calling downloader.download()")
-            info, video_title, file_path = self.downloader.download(self.url, self.format_string)
-            print(f"[DEBUG Worker] Download completed. File path: {file_path}")
+            info, video_title, file_path = self.downloader.download(self.url, format_request=self.format_request)
+            logger.debug("Download completed: %s", file_path)
 
             if not self._is_running:
                 return
@@ -89,18 +96,16 @@ class DownloadWorker(QThread):
                 raise Exception(f"File not found: {file_path}")
 
         except Exception as e:
-            print(f"[DEBUG Worker] Exception caught: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("Download failed for %s", self.url)
             if self._is_running:
                 self.progress.emit(f"❌ Error: {str(e)}")
                 self.progress_percent.emit(0)
                 self.finished.emit(self.url, "error", "")
 
     def stop(self):
-        """停止執行緒"""
+        """停止執行緒：取消下載並終止 ffmpeg 行程"""
         self._is_running = False
-        self.terminate_ffmpeg_processes()
+        self.downloader.cancel()
 
     def terminate_ffmpeg_processes(self):
         """终止所有ffmpeg进程"""
@@ -110,90 +115,152 @@ class DownloadWorker(QThread):
 
 
 class ThumbnailWorker(QThread):
-    """縮圖下載工作執行緒"""
-    finished = pyqtSignal(str, QPixmap)
+    """縮圖下載工作執行緒
+
+    以串流方式讀取（有大小上限），QImageReader 直接解碼成預覽尺寸；
+    在工作執行緒中只使用 QImage，轉成 QPixmap 在主執行緒進行。
+    """
+    finished = pyqtSignal(str, QImage)
+
+    MAX_BYTES = 2 * 1024 * 1024
 
     def __init__(self, url, thumbnail_url):
         super().__init__()
         self.url = url
         self.thumbnail_url = thumbnail_url
 
+    def _download(self):
+        data = QByteArray()
+        with requests.get(self.thumbnail_url, stream=True, timeout=10) as response:
+            if response.status_code != 200:
+                return None
+            for chunk in response.iter_content(64 * 1024):
+                data.append(chunk)
+                if data.size() > self.MAX_BYTES:
+                    raise ValueError(f"thumbnail larger than {self.MAX_BYTES} bytes")
+        return data
+
     def run(self):
         try:
-            response = requests.get(self.thumbnail_url)
-            if response.status_code == 200:
-                image_data = BytesIO(response.content)
-                pixmap = QPixmap()
-                pixmap.loadFromData(image_data.getvalue())
-
-                # 缩放到预览尺寸
-                preview_width = 120
-                preview_height = 68
-                pixmap = pixmap.scaled(preview_width, preview_height, 
-                                     Qt.AspectRatioMode.KeepAspectRatio, 
+            data = self._download()
+            if data is None:
+                self.finished.emit(self.url, QImage())
+                return
+            buffer = QBuffer(data)
+            buffer.open(QIODevice.OpenModeFlag.ReadOnly)
+            reader = QImageReader(buffer)
+
+            # 缩放到预览尺寸：JPEG 可在解碼時直接縮小，不必先解出完整大圖
+            preview_width, preview_height = core.THUMBNAIL_PREVIEW_SIZE
+            size = reader.size()
+            if size.isValid():
+                reader.setScaledSize(size.scaled(preview_width, preview_height,
+                                                 Qt.AspectRatioMode.KeepAspectRatio))
+            image = reader.read()
+            if not image.isNull() and image.width() > preview_width:
+                # 讀取器無法回報尺寸時才會走到這裡
+                image = image.scaled(preview_width, preview_height,
+                                     Qt.AspectRatioMode.KeepAspectRatio,
                                      Qt.TransformationMode.SmoothTransformation)
-                
-                # 获取浮水印位置信息
-                watermark_pos = core.get_watermark_position()
-                
-                # 加载Logo.png
-                logo_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Logo.png')
-                if os.path.exists(logo_path):
-                    logo_pixmap = QPixmap(logo_path)
-                    
-                    # 计算预览图中浮水印的相对大小
-                    scale_factor = preview_width / 1920  # 假设原始视频宽度为1920
-                    wm_width = int(watermark_pos['scale_width'] * scale_factor)
-                    wm_height = int(watermark_pos['scale_height'] * scale_factor)
-                    
-                    # 缩放Logo到对应大小
-                    logo_pixmap = logo_pixmap.scaled(wm_width, wm_height, 
-                                                   Qt.AspectRatioMode.KeepAspectRatio,
-                                                   Qt.TransformationMode.SmoothTransformation)
-                    
-                    # 在预览图上绘制Logo，使用core.get_watermark_position()返回的位置
-                    painter = QPainter(pixmap)
-                    painter.setOpacity(0.7)  # 设置透明度
-                    
-                    # 解析x和y坐标
-                    x = watermark_pos['x']
-                    y = watermark_pos['y']
-                    
-                    # 替换变量为实际值
-                    x = x.replace('W', str(preview_width)).replace('w', str(wm_width))
-                    y = y.replace('H', str(preview_height)).replace('h', str(wm_height))
-                    
-                    # 计算最终位置
-                    x_pos = eval(x)
-                    y_pos = eval(y)
-                    
-                    painter.drawPixmap(x_pos, y_pos, logo_pixmap)
-                    painter.end()
 
-                self.finished.emit(self.url, pixmap)
+            # 加载Logo.png
+            logo_path = core.LOGO_PATH
+            if os.path.exists(logo_path) and not image.isNull():
+                # 以预览图实际尺寸计算浮水印位置，与ffmpeg滤镜使用相同的相对几何
+                watermark_pos = core.get_watermark_position(image.width(), image.height())
+
+                # 缩放Logo到对应大小
+                logo_image = QImage(logo_path).scaled(watermark_pos['scale_width'],
+                                                      watermark_pos['scale_height'],
+                                                      Qt.AspectRatioMode.IgnoreAspectRatio,
+                                                      Qt.TransformationMode.SmoothTransformation)
+
+                # 在预览图上绘制Logo
+                painter = QPainter(image)
+                painter.setOpacity(0.7)  # 设置透明度
+                painter.drawImage(watermark_pos['x'], watermark_pos['y'], logo_image)
+                painter.end()
+
+            self.finished.emit(self.url, image)
         except Exception as e:
-            print(f"Error downloading thumbnail: {e}")
-            self.finished.emit(self.url, QPixmap())
+            logger.warning("Error downloading thumbnail: %s", e)
+            self.finished.emit(self.url, QImage())
             
 class TitleWorker(QThread):
     """獲取影片標題和封面的工作執行緒"""
     finished = pyqtSignal(str, str, str) 
 
-    def __init__(self, url):
+    def __init__(self, url, fallback_title=None):
         super().__init__()
         self.url = url
-        self.downloader = core.YouTubeDownloader()
+        # 失敗時顯示的標題（例如清單展開時已取得的標題）
+        self.fallback_title = fallback_title
 
     def run(self):
         try:
-
-            title, thumbnail_url = self.downloader.get_info(self.url)
+            # 只需要標題與封面，不建立下載器（會檢查 ffmpeg 並保留下載選項）
+            title, thumbnail_url = core.get_video_info(self.url)
             if title and thumbnail_url:
                 self.finished.emit(self.url, title, thumbnail_url)
             else:
-                self.finished.emit(self.url, "Failed to get info", "")
+                self.finished.emit(self.url, self.fallback_title or "Failed to get info", "")
+        except Exception as e:
+            self.finished.emit(self.url, self.fallback_title or f"Failed to get info: {str(e)}", "")
+
+class PlaylistWorker(QThread):
+    """逐批展開播放清單或頻道的工作執行緒"""
+    batch_ready = pyqtSignal(str, list)  # (清單網址, [{'id', 'url', 'title'}, ...])
+    finished = pyqtSignal(str, int, str)  # (清單網址, 新項目數, 錯誤訊息)
+
+    def __init__(self, collection_url, cursor):
+        super().__init__()
+        self.collection_url = collection_url
+        self.cursor = cursor
+
+    def run(self):
+        count = 0
+        try:
+            for batch in playlist.iter_batches(self.collection_url, cursor=self.cursor):
+                count += len(batch)
+                self.batch_ready.emit(self.collection_url, batch)
+            self.finished.emit(self.collection_url, count, "")
         except Exception as e:
-            self.finished.emit(self.url, f"Failed to get info: {str(e)}", "")
+            logger.exception("Failed to expand %s", self.collection_url)
+            self.finished.emit(self.collection_url, count, str(e))
+
+class PreviewLoader(QObject):
+    """把 previews 背景執行緒池的結果轉成 Qt 訊號（跨執行緒以佇列方式送到主執行緒）"""
+    ready = pyqtSignal(str, str)  # (影片路徑, sprite 路徑)
+
+    def request(self, file_path):
+        future = previews.request(file_path)
+        future.add_done_callback(lambda f: self._emit(file_path, f))
+
+    def _emit(self, file_path, future):
+        try:
+            sprite = future.result()
+        except Exception as e:
+            logger.warning("Preview failed for %s: %s", file_path, e)
+            return
+        if sprite:
+            self.ready.emit(file_path, sprite)
+
+class LibraryScanWorker(QThread):
+    """在背景增量掃描下載資料夾"""
+    finished = pyqtSignal(dict)
+
+    def __init__(self, index, root):
+        super().__init__()
+        self.index = index
+        self.root = root
+
+    def run(self):
+        try:
+            result = self.index.scan(self.root)
+        except Exception as e:
+            logger.exception("Library scan failed")
+            result = {'error': str(e)}
+        self.finished.emit(result)
 
 class YouTubeDownloaderGUI(QMainWindow):
     def __init__(self):
@@ -365,7 +432,14 @@ class YouTubeDownloaderGUI(QMainWindow):
         
 
         download_list_layout.addWidget(self.download_list)
-        content_layout.addWidget(download_list_container, 1)
+
+        # 下載佇列與媒體庫上下並列，可拖曳調整高度
+        content_splitter = QSplitter(Qt.Orientation.Vertical)
+        content_splitter.addWidget(download_list_container)
+        content_splitter.addWidget(self.create_library_panel())
+        content_splitter.setStretchFactor(0, 3)
+        content_splitter.setStretchFactor(1, 2)
+        content_layout.addWidget(content_splitter, 1)
         
 
         self.output_text = QTextEdit()
@@ -379,7 +453,10 @@ class YouTubeDownloaderGUI(QMainWindow):
                 padding: 5px;
             }
         """)
-        if core.Debug:
+        # 輸出區：core.Debug 或 settings.json 的 ui_debug 開啟時才顯示與更新
+        ui_debug = core.load_settings()['ui_debug']
+        self.ui_log_enabled = core.Debug if ui_debug is None else ui_debug
+        if self.ui_log_enabled:
             content_layout.addWidget(self.output_text)
         
 
@@ -388,8 +465,106 @@ class YouTubeDownloaderGUI(QMainWindow):
 
         self.pending_items = []
         self.title_workers = {} 
+        self.title_queue = []  # 等待取得標題與封面的 (網址, 已知標題)
         self.workers = {}
+
+        # 清單批次下載：依序排隊，同時只下載 batch_concurrency 個
+        self.batch_cursor = playlist.BatchCursor()
+        self.batch_queue = []
+        self.batch_keys = {}  # {影片網址: (清單網址, video_id)}
+        self.playlist_workers = {}
+
+        # 媒體庫：啟動時在背景增量掃描，只探測新增或變動的檔案
+        self.library = library_index.LibraryIndex()
+        self.library_scan_worker = None
+        self.refresh_library()
+
+        # 已完成項目的預覽圖：{影片路徑: 顯示 sprite 的 QLabel}
+        self.preview_labels = {}
+        self.preview_loader = PreviewLoader()
+        self.preview_loader.ready.connect(self.on_preview_ready)
+        self.scan_library()
     
+    def create_library_panel(self):
+        """媒體庫面板：搜尋與篩選已下載的檔案"""
+        panel = QWidget()
+        layout = QVBoxLayout(panel)
+        layout.setContentsMargins(0, 0, 0, 0)
+
+        header = QHBoxLayout()
+        header.addWidget(QLabel("Library"))
+        self.library_search = QLineEdit()
+        self.library_search.setPlaceholderText("Search title, file name or video ID")
+        # 輸入停頓後才查詢，不在每次按鍵時重建清單
+        self.library_search_timer = QTimer(self)
+        self.library_search_timer.setSingleShot(True)
+        self.library_search_timer.setInterval(LIBRARY_SEARCH_DELAY_MS)
+        self.library_search_timer.timeout.connect(self.refresh_library)
+        self.library_search.textChanged.connect(lambda _: self.library_search_timer.start())
+        header.addWidget(self.library_search, 1)
+        self.library_filter = QComboBox()
+        self.library_filter.addItems(["All", "Video", "Audio", "Watermarked", "Not watermarked"])
+        self.library_filter.currentIndexChanged.connect(self.refresh_library)
+        header.addWidget(self.library_filter)
+        self.library_count = QLabel("")
+        self.library_count.setStyleSheet("font-size: 12px; font-weight: normal; color: #7f8c8d;")
+        header.addWidget(self.library_count)
+        layout.addLayout(header)
+
+        self.library_list = QListWidget()
+        self.library_list.setStyleSheet("""
+            QListWidget {
+                background-color: #f8f9f9;
+                border: 1px solid #ddd;
+                border-radius: 5px;
+            }
+        """)
+        self.library_list.itemDoubleClicked.connect(
+            lambda item: self.play_video(item.data(Qt.ItemDataRole.UserRole)))
+        layout.addWidget(self.library_list)
+        return panel
+
+    def scan_library(self):
+        """在背景掃描下載資料夾，完成後更新媒體庫清單"""
+        if self.library_scan_worker is not None and self.library_scan_worker.isRunning():
+            return
+        self.library_scan_worker = LibraryScanWorker(self.library, library_index.DEFAULT_ROOT)
+        self.library_scan_worker.finished.connect(self.on_library_scanned)
+        self.library_scan_worker.start()
+
+    def on_library_scanned(self, result):
+        logger.debug("Library scan result: %s", result)
+        self.refresh_library()
+
+    def refresh_library(self):
+        """依搜尋字串與篩選條件更新媒體庫清單（直接查詢索引）"""
+        filters = {
+            "Video": {'kind': 'video'},
+            "Audio": {'kind': 'audio'},
+            "Watermarked": {'watermarked': True},
+            "Not watermarked": {'kind': 'video', 'watermarked': False},
+        }.get(self.library_filter.currentText(), {})
+        rows = self.library.search(self.library_search.text(), **filters)
+
+        self.library_list.clear()
+        for row in rows:
+            details = []
+            if row['height']:
+                details.append(f"{row['height']}p {row['vcodec'] or ''}".strip())
+            elif row['acodec']:
+                details.append(row['acodec'])
+            if row['duration']:
+                minutes, seconds = divmod(int(row['duration']), 60)
+                details.append(f"{minutes}:{seconds:02d}")
+            details.append(f"{row['size'] / (1024 * 1024):.0f} MB")
+            if row['watermarked']:
+                details.append("watermarked")
+            item = QListWidgetItem(f"{row['title'] or row['name']}    {' · '.join(details)}")
+            item.setData(Qt.ItemDataRole.UserRole, row['path'])
+            item.setToolTip(row['path'])
+            self.library_list.addItem(item)
+        self.library_count.setText(f"{len(rows)} shown")
+
     def create_sidebar_content(self):
         """創建側邊欄內容"""
         sidebar_layout = QVBoxLayout()
@@ -473,10 +648,25 @@ class YouTubeDownloaderGUI(QMainWindow):
     
     def add_url(self):
         """添加URL到下載列表"""
-        url = self.url_input.text().strip()
-        if not url:
+        text = self.url_input.text().strip()
+        if not text:
             return
-            
+
+        # 一次貼上多個連結時批次解析並去除重複
+        links = text.split()
+        if len(links) > 1:
+            self.add_urls(links)
+            self.url_input.clear()
+            return
+
+        collection = playlist.collection_url(text)
+        if collection:
+            self.add_collection(collection)
+            self.url_input.clear()
+            return
+
+        # 同一影片的不同連結形式（youtu.be、shorts、時間戳）視為同一項目
+        url = url_canon.canonicalize(text).url or text
 
         for i, (completed_url, _) in enumerate(self.completed_items):
             if completed_url == url:
@@ -488,11 +678,7 @@ class YouTubeDownloaderGUI(QMainWindow):
                             widget = self.create_pending_item_widget(url)
                             item.setSizeHint(widget.sizeHint())
                             self.download_list.setItemWidget(item, widget)
-                            
-                            title_worker = TitleWorker(url)
-                            title_worker.finished.connect(lambda u, t, s: self.update_video_title(u, t, s))
-                            self.title_workers[url] = title_worker
-                            title_worker.start()
+                            self.request_title(url)
                             
                             self.update_output(f"✨ Reset download status for: {url}")
                             return
@@ -546,21 +732,101 @@ class YouTubeDownloaderGUI(QMainWindow):
                 self.update_output(f"✨ Updated download settings: {url}")
             return
         
+        self.url_input.clear()
+        self.add_pending_item(url)
+
+    def add_pending_item(self, url, title=None):
+        """在下載列表新增一個未下載項，並排入取得標題與封面
+
+        title 為已知的標題（清單展開的結果），會先顯示在卡片上
+        """
         item = QListWidgetItem()
         self.download_list.addItem(item)
         self.pending_items.append(url)
-        
-        self.url_input.clear()
-        
-        widget = self.create_pending_item_widget(url)
+
+        widget = self.create_pending_item_widget(url, title)
         item.setSizeHint(widget.sizeHint())
         self.download_list.setItemWidget(item, widget)
-        
-        title_worker = TitleWorker(url)
-        title_worker.finished.connect(lambda u, t, s: self.update_video_title(u, t, s))
-        self.title_workers[url] = title_worker
-        title_worker.start()
+        self.request_title(url, title)
+
+    def request_title(self, url, title=None):
+        """排入取得標題與封面；同時執行的 TitleWorker 不超過 TITLE_WORKER_LIMIT"""
+        self.title_queue.append((url, title))
+        self.start_queued_titles()
+
+    def start_queued_titles(self):
+        while self.title_queue and len(self.title_workers) < TITLE_WORKER_LIMIT:
+            url, title = self.title_queue.pop(0)
+            if url in self.title_workers or url not in self.pending_items:
+                continue
+            title_worker = TitleWorker(url, title)
+            title_worker.finished.connect(lambda u, t, s: self.update_video_title(u, t, s))
+            self.title_workers[url] = title_worker
+            title_worker.start()
     
+    def add_urls(self, links):
+        """批次加入多個連結：清單另行展開，影片依 ID 去除重複"""
+        videos = []
+        for link in links:
+            collection = playlist.collection_url(link)
+            if collection:
+                self.add_collection(collection)
+            else:
+                videos.append(link)
+
+        result = url_canon.canonicalize_many(videos)
+        added = 0
+        for entry in result['unique']:
+            if entry.url not in self.pending_items:
+                self.add_pending_item(entry.url)
+                added += 1
+        self.update_output(f"➕ Added {added} videos, skipped {len(result['unique']) - added + result['duplicates']} "
+                           f"duplicates, {len(result['invalid'])} invalid links")
+
+    def add_collection(self, collection):
+        """展開播放清單或頻道，每批項目一到就加入列表並排入下載"""
+        if collection in self.playlist_workers:
+            self.update_output(f"⏳ Already expanding: {collection}")
+            return
+        self.update_output(f"📃 Expanding: {collection}")
+        worker = PlaylistWorker(collection, self.batch_cursor)
+        worker.batch_ready.connect(self.on_playlist_batch)
+        worker.finished.connect(self.on_playlist_finished)
+        self.playlist_workers[collection] = worker
+        worker.start()
+
+    def on_playlist_batch(self, collection, entries):
+        for entry in entries:
+            url = entry['url']
+            if url in self.pending_items or url in self.batch_keys:
+                continue
+            # 清單展開已有標題，封面與完整資訊由有上限的 TitleWorker 依序取得
+            self.add_pending_item(url, entry.get('title'))
+            self.batch_keys[url] = (collection, entry['id'])
+            self.batch_queue.append(url)
+        self.start_queued_downloads()
+
+    def on_playlist_finished(self, collection, count, error):
+        if error:
+            self.update_output(f"❌ Failed to expand {collection}: {error}")
+        else:
+            self.update_output(f"📃 {collection}: {count} new videos")
+        worker = self.playlist_workers.pop(collection, None)
+        if worker is not None:
+            worker.deleteLater()
+
+    def start_queued_downloads(self):
+        """在同時下載數未達上限時，開始排隊中的清單項目"""
+        limit = core.load_settings()['batch_concurrency']
+        running = sum(1 for url in self.batch_keys
+                      if isinstance(self.workers.get(url), DownloadWorker))
+        while self.batch_queue and running < limit:
+            url = self.batch_queue.pop(0)
+            if url in self.workers:  # 已手動開始下載
+                continue
+            self.start_download(url)
+            running += 1
+
     def update_video_title(self, url, title, thumbnail_url):
         """更新影片標題和封面"""
 
@@ -588,16 +854,17 @@ class YouTubeDownloaderGUI(QMainWindow):
                 worker.wait(500)
             worker.deleteLater()
             del self.title_workers[url]
+        self.start_queued_titles()
     
-    def on_thumbnail_downloaded(self, url, pixmap):
+    def on_thumbnail_downloaded(self, url, image):
         """當縮圖下載完成時更新UI"""
         for i in range(self.download_list.count()):
             item = self.download_list.item(i)
             if self.pending_items[i] == url:
                 widget = self.download_list.itemWidget(item)
                 cover_label = widget.findChild(QLabel, "cover")
-                if cover_label and not pixmap.isNull():
-                    cover_label.setPixmap(pixmap)
+                if cover_label and not image.isNull():
+                    cover_label.setPixmap(QPixmap.fromImage(image))
                 break
         
         if f"{url}_thumbnail" in self.workers:
@@ -607,7 +874,7 @@ class YouTubeDownloaderGUI(QMainWindow):
             worker.deleteLater()
             del self.workers[f"{url}_thumbnail"]
     
-    def create_pending_item_widget(self, url):
+    def create_pending_item_widget(self, url, title=None):
         """創建未下載項的卡片部件"""
         widget = QWidget()
         widget.setObjectName("card")
@@ -655,7 +922,7 @@ class YouTubeDownloaderGUI(QMainWindow):
         info_layout.setContentsMargins(0, 0, 0, 0)
         info_layout.setSpacing(10)
         
-        title_label = QLabel("Getting video info...")
+        title_label = QLabel(title or "Getting video info...")
         title_label.setWordWrap(True)
         title_label.setStyleSheet("""
             font-size: 16px;
@@ -909,6 +1176,19 @@ class YouTubeDownloaderGUI(QMainWindow):
         """)
         folder_btn.clicked.connect(lambda: self.open_folder(file_path))
         
+        # 關鍵幀預覽（背景產生），滑鼠停留時顯示大圖，不必開啟原始檔即可確認浮水印
+        preview_label = QLabel()
+        preview_label.setObjectName("preview")
+        preview_label.setFixedHeight(32)
+        preview_label.setStyleSheet("background-color: white;")
+        button_layout.addWidget(preview_label)
+        key = os.path.abspath(file_path)
+        self.preview_labels[key] = preview_label
+        # 卡片被移除或重建時一併移除，避免保留已刪除的 QLabel
+        preview_label.destroyed.connect(
+            lambda _=None, key=key, label=preview_label: self.forget_preview(key, label))
+        self.preview_loader.request(file_path)
+
         button_layout.addStretch()
         button_layout.addWidget(play_btn)
         button_layout.addWidget(folder_btn)
@@ -919,13 +1199,34 @@ class YouTubeDownloaderGUI(QMainWindow):
         
         return widget
     
-    def get_format_string(self):
-        """根據選擇的畫質和格式返回對應的format字串"""
+    def on_preview_ready(self, file_path, sprite):
+        """預覽圖產生完成：縮小顯示在已完成卡片上"""
+        label = self.preview_labels.get(os.path.abspath(file_path))
+        if label is None:
+            return
+        pixmap = QPixmap(sprite)
+        if pixmap.isNull():
+            return
+        # 預覽圖只需設定一次，之後不再需要查詢這個標籤
+        del self.preview_labels[os.path.abspath(file_path)]
+        try:
+            label.setPixmap(pixmap.scaledToHeight(label.height(), Qt.TransformationMode.SmoothTransformation))
+            label.setToolTip(f'<img src="{sprite}" width="{pixmap.width() // 2}">')
+        except RuntimeError:
+            # 卡片已被移除（例如重新下載同一網址）
+            pass
+
+    def forget_preview(self, key, label):
+        if self.preview_labels.get(key) is label:
+            del self.preview_labels[key]
+
+    def get_format_request(self):
+        """根據選擇的畫質和格式返回格式需求（見 format_planner.make_request）"""
         selected_format = self.format_combo.currentText()
 
-        # 如果選擇音頻格式，返回音頻專用的格式字串
+        # 音頻格式：優先 M4A，沒有時由規劃器改用其他音頻
         if selected_format == "Audio Only (M4A/OPUS)":
-            return "bestaudio/best"  # 如果音頻不可用，回退到完整視頻
+            return format_planner.make_request(audio_only=True, container='m4a')
 
         quality_map = {
             "Best Quality (4K/2160p)": 2160,
@@ -938,22 +1239,20 @@ class YouTubeDownloaderGUI(QMainWindow):
         selected_quality = self.quality_combo.currentText()
         height = quality_map.get(selected_quality, 2160)
 
+        # (影像編碼, 容器)
         format_map = {
-            "MP4 (H.264)": "bestvideo[height<={height}][vcodec^=avc]+bestaudio[ext=m4a]/best[height<={height}]",
-            "MP4 (H.265/HEVC)": "bestvideo[height<={height}][vcodec^=hev]+bestaudio[ext=m4a]/best[height<={height}]",
-            "MKV (H.264)": "bestvideo[height<={height}][vcodec^=avc]+bestaudio/best[height<={height}]",
-            "MKV (H.265/HEVC)": "bestvideo[height<={height}][vcodec^=hev]+bestaudio/best[height<={height}]",
-            "WEBM (VP9)": "bestvideo[height<={height}][vcodec^=vp9]+bestaudio[ext=webm]/best[height<={height}]"
+            "MP4 (H.264)": ('avc', 'mp4'),
+            "MP4 (H.265/HEVC)": ('hevc', 'mp4'),
+            "MKV (H.264)": ('avc', 'mkv'),
+            "MKV (H.265/HEVC)": ('hevc', 'mkv'),
+            "WEBM (VP9)": ('vp9', 'webm'),
         }
-        format_string = format_map.get(selected_format, format_map["MP4 (H.264)"])
+        vcodec, container = format_map.get(selected_format, format_map["MP4 (H.264)"])
+        return format_planner.make_request(height=height, vcodec=vcodec, container=container)
 
-        return format_string.format(height=height)
-    
     def start_download(self, url):
         """開始下載影片"""
-        print(f"[DEBUG] start_download called with URL: {url}")
         self.update_output(f"Starting download: {url}")
-        print(f"[DEBUG] Updated output")
         
         for i in range(self.download_list.count()):
             item = self.download_list.item(i)
@@ -976,37 +1275,36 @@ class YouTubeDownloaderGUI(QMainWindow):
                     }
                 """)
                 
-                format_string = self.get_format_string()
-                print(f"[DEBUG] Format string: {format_string}")
+                format_request = self.get_format_request()
+                logger.debug("start_download %s format=%s", url, format_request)
 
-                worker = DownloadWorker(url, format_string)
-                print(f"[DEBUG] Worker created")
+                worker = DownloadWorker(url, format_request)
 
                 self.workers[url] = worker
                 worker.progress.connect(self.update_output)
                 worker.progress_percent.connect(lambda p: progress_bar.setValue(int(p)))
                 worker.finished.connect(self.on_download_finished)
 
-                print(f"[DEBUG] Starting worker thread")
                 worker.start()
-                print(f"[DEBUG] Worker thread started")
 
                 break
     
     def on_download_finished(self, url, status, file_path):
         """下載完成後的處理"""
-        self.update_output(f"DEBUG: Download finished callback - URL: {url}, Status: {status}, File path: {file_path}")
+        logger.debug("Download finished: url=%s status=%s file=%s", url, status, file_path)
+        batch_key = self.batch_keys.pop(url, None)
+        if batch_key is not None:
+            if status == "success":
+                self.batch_cursor.mark_done(*batch_key)
+            else:
+                # 失敗的項目移除 worker，讓下一批可以開始
+                worker = self.workers.pop(url, None)
+                if worker is not None:
+                    worker.deleteLater()
+            self.start_queued_downloads()
         if status == "success" and os.path.exists(file_path):
             try:
-
-                self.update_output(f"DEBUG: Finding index of URL in pending_items: {url}")
-                self.update_output(f"DEBUG: Current pending_items: {self.pending_items}")
-                
-                QApplication.processEvents()
-                
-
                 index = self.pending_items.index(url)
-                self.update_output(f"DEBUG: Found index: {index}")
                 
                 item = self.download_list.item(index)
                 if item is None:
@@ -1017,7 +1315,12 @@ class YouTubeDownloaderGUI(QMainWindow):
                 self.download_list.setItemWidget(item, completed_widget)
                 
                 self.completed_items.append((url, file_path))
-                self.update_output(f"DEBUG: Updated item status to completed")
+
+                # 記錄到媒體庫（影片 ID 與標題以下載時的資訊為準）
+                info = core.get_cached_info(url)
+                self.library.record_download(file_path, url_canon.video_id(url),
+                                             info['title'] if info else None)
+                self.refresh_library()
                 
 
                 if url in self.workers:
@@ -1026,7 +1329,6 @@ class YouTubeDownloaderGUI(QMainWindow):
                         worker.wait(1000)  # 等待執行緒完成
                     worker.deleteLater()
                     del self.workers[url]
-                    self.update_output(f"DEBUG: Cleaning worker")
                 
                 self.update_output(f"✅ Download completed: {os.path.basename(file_path)}")
                 
@@ -1040,7 +1342,10 @@ class YouTubeDownloaderGUI(QMainWindow):
             self.update_output(f"❌ Download failed or file does not exist: {file_path}")
     
     def update_output(self, message):
-        """更新輸出區"""
+        """更新輸出區（輸出區關閉時只寫入日誌，不做 UI 更新）"""
+        if not self.ui_log_enabled:
+            logger.debug("%s", message)
+            return
         self.output_text.append(message)
     
     def play_video(self, file_path):
@@ -1103,7 +1408,18 @@ class YouTubeDownloaderGUI(QMainWindow):
                     worker.terminate()
                     worker.wait(1000)
 
+        # 停止清單展開執行緒
+        for worker in list(self.playlist_workers.values()):
+            if worker.isRunning():
+                worker.terminate()
+                worker.wait(1000)
+
+        # 等待媒體庫掃描結束（掃描只在最後寫入一次，不強制終止）
+        if self.library_scan_worker is not None and self.library_scan_worker.isRunning():
+            self.library_scan_worker.wait(3000)
+
         # 停止所有標題執行緒
+        self.title_queue.clear()
         for worker in list(self.title_workers.values()):
             if worker.isRunning():
                 worker.terminate()
@@ -0,0 +1,376 @@
+"""多台機器共用的下載工作佇列（SQLite 檔案放在共用儲存空間）
+
+每台機器執行一個或多個 worker，從同一個資料庫領取工作。領取時取得租約，
+執行期間定期心跳延長租約；worker 當機時租約過期，工作會被重新排入佇列。
+完成的檔案記錄到同一資料庫的 library 表，作為共用的媒體索引。
+
+用法：
+    python job_queue.py --db /mnt/shared/jobs.db submit https://youtu.be/VIDEO_ID --height 1080
+    python job_queue.py --db /mnt/shared/jobs.db worker --concurrency 2
+    python job_queue.py --db /mnt/shared/jobs.db list [--state queued]
+    python job_queue.py --db /mnt/shared/jobs.db cancel JOB_ID
+
+注意：租約以各機器的系統時間計算，機器之間需要校時（NTP）；共用檔案系統
+必須支援 SQLite 的檔案鎖（一般的 NFSv4/SMB 掛載可以，部分 FUSE 檔案系統不行）。
+"""
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import logging
+import argparse
+import threading
+import contextlib
+
+import core
+import url_canon
+import log_config
+import retry_policy
+import format_planner
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'jobs.db')
+
+QUEUED = 'queued'
+RUNNING = 'running'
+CANCELLING = 'cancelling'
+FINISHED = 'finished'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+LEASE_SECONDS = 60
+HEARTBEAT_SECONDS = 15
+MAX_ATTEMPTS = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    format_request TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    worker TEXT,
+    lease_until REAL,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (state, priority DESC, created);
+CREATE TABLE IF NOT EXISTS library (
+    video_id TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    title TEXT,
+    host TEXT NOT NULL,
+    file TEXT NOT NULL,
+    size INTEGER,
+    job_id TEXT,
+    finished REAL NOT NULL
+);
+"""
+
+
+def make_job(url, format_request, priority=0, max_attempts=MAX_ATTEMPTS):
+    """建立可序列化的工作描述（與 YouTubeDownloader.download 的參數對應）"""
+    canonical = url_canon.canonicalize(url)
+    if canonical.video_id is None:
+        raise ValueError(f"無效的 YouTube 連結：{url} ({canonical.error})")
+    return {
+        'id': uuid.uuid4().hex[:12],
+        'url': canonical.url,
+        'format_request': dict(format_request),
+        'priority': priority,
+        'max_attempts': max_attempts,
+    }
+
+
+def _row_to_job(row):
+    job = dict(row)
+    job['format_request'] = json.loads(job['format_request'])
+    job['result'] = json.loads(job['result']) if job['result'] else None
+    return job
+
+
+class JobQueue:
+    """SQLite 工作佇列；每個執行緒使用自己的連線，寫入以 BEGIN IMMEDIATE 互斥"""
+
+    def __init__(self, path=DEFAULT_DB, timeout=30.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        # executescript 會自行提交，不放在交易內
+        self._connect().executescript(SCHEMA)
+
+    def _connect(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            # 共用儲存空間上不使用 WAL（需要共享記憶體，跨機器不可靠）
+            db = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            db.execute('PRAGMA journal_mode=DELETE')
+            self._local.db = db
+        return db
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        db = self._connect()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            yield db
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    def submit(self, job):
+        with self._transaction() as db:
+            db.execute('INSERT INTO jobs (id, url, format_request, priority, state, max_attempts, created) '
+                       'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                       (job['id'], job['url'], json.dumps(job['format_request']), job['priority'],
+                        QUEUED, job['max_attempts'], time.time()))
+        return job['id']
+
+    def _requeue_expired(self, db, now):
+        """租約過期（worker 當機或斷線）的工作重新排隊，超過嘗試次數則標記失敗"""
+        expired = db.execute('SELECT id, worker, attempts, max_attempts, state FROM jobs '
+                             'WHERE state IN (?, ?) AND lease_until < ?',
+                             (RUNNING, CANCELLING, now)).fetchall()
+        for row in expired:
+            if row['state'] == CANCELLING:
+                state, error = CANCELLED, None
+            elif row['attempts'] >= row['max_attempts']:
+                state, error = FAILED, f"lease expired on {row['worker']} after {row['attempts']} attempts"
+            else:
+                state, error = QUEUED, None
+            logger.warning("Lease of job %s on %s expired, now %s", row['id'], row['worker'], state)
+            db.execute('UPDATE jobs SET state = ?, worker = NULL, lease_until = NULL, error = ?, '
+                       'finished = CASE WHEN ? = ? THEN finished ELSE ? END WHERE id = ?',
+                       (state, error, state, QUEUED, now, row['id']))
+        return len(expired)
+
+    def requeue_expired(self):
+        with self._transaction() as db:
+            return self._requeue_expired(db, time.time())
+
+    def claim(self, worker_id, lease_seconds=LEASE_SECONDS):
+        """領取優先順序最高的工作並取得租約，沒有工作時返回 None"""
+        now = time.time()
+        with self._transaction() as db:
+            self._requeue_expired(db, now)
+            row = db.execute('SELECT * FROM jobs WHERE state = ? ORDER BY priority DESC, created LIMIT 1',
+                             (QUEUED,)).fetchone()
+            if row is None:
+                return None
+            db.execute('UPDATE jobs SET state = ?, worker = ?, lease_until = ?, attempts = attempts + 1, '
+                       'started = ?, error = NULL WHERE id = ?',
+                       (RUNNING, worker_id, now + lease_seconds, now, row['id']))
+        job = _row_to_job(row)
+        job.update(state=RUNNING, worker=worker_id, attempts=row['attempts'] + 1)
+        return job
+
+    def heartbeat(self, job_id, worker_id, lease_seconds=LEASE_SECONDS):
+        """延長租約；返回工作目前狀態（running/cancelling），租約已失去時返回 None"""
+        with self._transaction() as db:
+            row = db.execute('SELECT state FROM jobs WHERE id = ? AND worker = ? AND state IN (?, ?)',
+                             (job_id, worker_id, RUNNING, CANCELLING)).fetchone()
+            if row is None:
+                return None
+            db.execute('UPDATE jobs SET lease_until = ? WHERE id = ?',
+                       (time.time() + lease_seconds, job_id))
+            return row['state']
+
+    def complete(self, job_id, worker_id, result):
+        """記錄完成結果並寫入共用媒體索引；租約已被其他 worker 取得時返回 False"""
+        now = time.time()
+        with self._transaction() as db:
+            row = db.execute('SELECT url FROM jobs WHERE id = ? AND worker = ?',
+                             (job_id, worker_id)).fetchone()
+            if row is None:
+                return False
+            db.execute('UPDATE jobs SET state = ?, finished = ?, result = ?, lease_until = NULL '
+                       'WHERE id = ?', (FINISHED, now, json.dumps(result, ensure_ascii=False), job_id))
+            db.execute('INSERT OR REPLACE INTO library (video_id, url, title, host, file, size, job_id, finished) '
+                       'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                       (url_canon.video_id(row['url']), row['url'], result.get('title'), result['host'],
+                        result['file'], result.get('size'), job_id, now))
+        return True
+
+    def fail(self, job_id, worker_id, error, cancelled=False, permanent=False):
+        """記錄失敗；尚有嘗試次數且不是永久性失敗時重新排隊"""
+        now = time.time()
+        with self._transaction() as db:
+            row = db.execute('SELECT attempts, max_attempts FROM jobs WHERE id = ? AND worker = ?',
+                             (job_id, worker_id)).fetchone()
+            if row is None:
+                return None
+            if cancelled:
+                state = CANCELLED
+            elif not permanent and row['attempts'] < row['max_attempts']:
+                state = QUEUED
+            else:
+                state = FAILED
+            db.execute('UPDATE jobs SET state = ?, worker = NULL, lease_until = NULL, error = ?, '
+                       'finished = ? WHERE id = ?',
+                       (state, error, None if state == QUEUED else now, job_id))
+            return state
+
+    def cancel(self, job_id):
+        """排隊中的工作直接取消；執行中的工作由 worker 在下次心跳時中斷"""
+        with self._transaction() as db:
+            db.execute('UPDATE jobs SET state = ?, finished = ? WHERE id = ? AND state = ?',
+                       (CANCELLED, time.time(), job_id, QUEUED))
+            db.execute('UPDATE jobs SET state = ? WHERE id = ? AND state = ?',
+                       (CANCELLING, job_id, RUNNING))
+            row = db.execute('SELECT state FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return row['state'] if row else None
+
+    def get(self, job_id):
+        row = self._connect().execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return _row_to_job(row) if row else None
+
+    def list(self, state=None, limit=100):
+        if state:
+            rows = self._connect().execute('SELECT * FROM jobs WHERE state = ? ORDER BY created DESC LIMIT ?',
+                                           (state, limit)).fetchall()
+        else:
+            rows = self._connect().execute('SELECT * FROM jobs ORDER BY created DESC LIMIT ?',
+                                           (limit,)).fetchall()
+        return [_row_to_job(row) for row in rows]
+
+    def library(self):
+        return [dict(row) for row in self._connect().execute('SELECT * FROM library ORDER BY finished DESC')]
+
+
+class QueueWorker:
+    """從 JobQueue 領取工作並以 YouTubeDownloader 執行，執行期間在背景心跳"""
+
+    def __init__(self, queue, worker_id=None, lease_seconds=LEASE_SECONDS,
+                 heartbeat_seconds=HEARTBEAT_SECONDS, poll_seconds=5.0,
+                 downloader_factory=core.YouTubeDownloader):
+        self.queue = queue
+        self.host = socket.gethostname()
+        self.worker_id = worker_id or f'{self.host}:{os.getpid()}:{uuid.uuid4().hex[:6]}'
+        self.lease_seconds = lease_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.poll_seconds = poll_seconds
+        self.downloader_factory = downloader_factory
+        self._stop = threading.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    def _heartbeat(self, job, downloader, done):
+        while not done.wait(self.heartbeat_seconds):
+            try:
+                state = self.queue.heartbeat(job['id'], self.worker_id, self.lease_seconds)
+            except sqlite3.Error as e:
+                # 暫時無法存取共用資料庫：繼續執行，租約到期前還有機會成功
+                logger.warning("Heartbeat for job %s failed: %s", job['id'], e)
+                continue
+            if state is None or state == CANCELLING:
+                logger.info("Job %s %s, stopping download", job['id'],
+                            'cancelled' if state else 'lease lost')
+                downloader.cancel()
+                return
+
+    def run_one(self):
+        """領取並執行一個工作；沒有工作時返回 False"""
+        job = self.queue.claim(self.worker_id, self.lease_seconds)
+        if job is None:
+            return False
+        logger.info("Worker %s running job %s (%s, attempt %d)",
+                    self.worker_id, job['id'], job['url'], job['attempts'])
+        downloader = self.downloader_factory()
+        done = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job, downloader, done),
+                                     name=f'heartbeat-{job["id"]}', daemon=True)
+        heartbeat.start()
+        try:
+            _, title, file_path = downloader.download(job['url'], format_request=job['format_request'])
+            result = {'title': title, 'host': self.host, 'file': os.path.abspath(file_path),
+                      'size': os.path.getsize(file_path), 'metrics_job': downloader.last_job_id}
+            if not self.queue.complete(job['id'], self.worker_id, result):
+                logger.warning("Job %s finished after its lease was taken over", job['id'])
+        except core.DownloadCancelled as e:
+            self.queue.fail(job['id'], self.worker_id, str(e), cancelled=True)
+        except Exception as e:
+            logger.exception("Job %s failed", job['id'])
+            self.queue.fail(job['id'], self.worker_id, str(e),
+                            permanent=retry_policy.classify(e) in retry_policy.PERMANENT)
+        finally:
+            done.set()
+            heartbeat.join()
+        return True
+
+    def run(self):
+        while not self._stop.is_set():
+            if not self.run_one():
+                self._stop.wait(self.poll_seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Shared download queue for several machines')
+    parser.add_argument('--db', default=DEFAULT_DB, help='SQLite file on shared storage')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    submit = commands.add_parser('submit')
+    submit.add_argument('urls', nargs='+')
+    submit.add_argument('--height', type=int)
+    submit.add_argument('--vcodec', help='avc/h264, hevc, vp9, av1 ...')
+    submit.add_argument('--container', default='mp4', choices=format_planner.CONTAINERS)
+    submit.add_argument('--audio-only', action='store_true')
+    submit.add_argument('--priority', type=int, default=0)
+
+    worker = commands.add_parser('worker')
+    worker.add_argument('--concurrency', type=int, default=1)
+    worker.add_argument('--lease', type=float, default=LEASE_SECONDS)
+
+    listing = commands.add_parser('list')
+    listing.add_argument('--state')
+    commands.add_parser('library')
+
+    cancel = commands.add_parser('cancel')
+    cancel.add_argument('job_id')
+
+    args = parser.parse_args()
+    log_config.setup_logging(core.load_settings(), debug=core.Debug)
+    queue = JobQueue(args.db)
+
+    if args.command == 'submit':
+        request = format_planner.make_request(height=args.height,
+                                              vcodec=format_planner.codec_family(args.vcodec),
+                                              container=args.container, audio_only=args.audio_only)
+        for url in args.urls:
+            print(queue.submit(make_job(url, request, args.priority)))
+    elif args.command == 'worker':
+        workers = [QueueWorker(JobQueue(args.db), lease_seconds=args.lease,
+                               heartbeat_seconds=args.lease / 4)
+                   for _ in range(args.concurrency)]
+        threads = [threading.Thread(target=w.run, name=w.worker_id) for w in workers]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                thread.join()
+        except KeyboardInterrupt:
+            for w in workers:
+                w.stop()
+    elif args.command == 'list':
+        for job in queue.list(args.state):
+            print(f"{job['id']}  {job['state']:<10} p={job['priority']:<3} "
+                  f"attempts={job['attempts']} {job['worker'] or '-'}  {job['url']}")
+    elif args.command == 'library':
+        for entry in queue.library():
+            print(f"{entry['video_id']}  {entry['host']}:{entry['file']}  {entry['title']}")
+    elif args.command == 'cancel':
+        print(queue.cancel(args.job_id))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,475 @@
+"""以 HTTP 服務方式執行下載引擎（無人值守的機器使用）
+
+用法：python job_server.py [--host 127.0.0.1] [--port 8765] [--workers 2] [--max-queue 100]
+
+端點：
+    POST   /jobs                 {"url", "format": {...}, "priority"} 建立工作；佇列已滿時回應 429
+    GET    /jobs[?state=queued]  列出工作
+    GET    /jobs/<id>            工作狀態
+    PATCH  /jobs/<id>            {"priority": n} 調整排隊中工作的優先順序
+    DELETE /jobs/<id>            取消工作
+    GET    /jobs/<id>/events     以 server-sent events 串流進度，工作結束後關閉
+    GET    /metrics              Prometheus 文字格式
+    GET    /health
+"""
+import json
+import time
+import heapq
+import asyncio
+import logging
+import argparse
+import itertools
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import core
+import metrics
+import url_canon
+import log_config
+import format_planner
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+FINISHED = 'finished'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+TERMINAL_STATES = (FINISHED, FAILED, CANCELLED)
+
+# 轉發給用戶端的進度欄位（yt-dlp 的 info_dict 太大且不能序列化）
+PROGRESS_FIELDS = ('status', 'message', 'downloaded_bytes', 'total_bytes', 'total_bytes_estimate',
+                   'speed', 'eta', 'frame', 'total_frames')
+
+# 同一工作的下載進度最多每隔這麼久發送一次；狀態改變時立即發送
+PROGRESS_INTERVAL = 0.2
+
+# 每個 SSE 用戶端最多暫存的事件數，慢的用戶端只會遺失較舊的進度
+SUBSCRIBER_BUFFER = 64
+
+MAX_BODY = 64 * 1024
+RETRY_AFTER = 5
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, job_id, url, format_request, priority):
+        self.id = job_id
+        self.url = url
+        self.format_request = format_request
+        self.priority = priority
+        self.state = QUEUED
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.downloader = None
+        self.cancel_requested = False
+        self.subscribers = set()
+        self._last_sent = 0.0
+        self._last_status = None
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'url': self.url,
+            'format': self.format_request,
+            'priority': self.priority,
+            'state': self.state,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+            'progress': self.progress,
+            'result': self.result,
+            'error': self.error,
+        }
+
+    def publish(self, event):
+        for queue in self.subscribers:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+    def progress_hook(self, loop, d):
+        """在下載執行緒中呼叫，節流後轉交事件迴圈"""
+        now = time.monotonic()
+        status = d.get('status')
+        if status == self._last_status and now - self._last_sent < PROGRESS_INTERVAL:
+            return
+        self._last_status = status
+        self._last_sent = now
+        event = {key: d[key] for key in PROGRESS_FIELDS if d.get(key) is not None}
+        loop.call_soon_threadsafe(self._on_progress, event)
+
+    def _on_progress(self, event):
+        self.progress = event
+        self.publish({'event': 'progress', 'job': self.id, **event})
+
+
+class JobServer:
+    """優先權佇列加上固定數量的工作協程；阻塞的 yt-dlp/ffmpeg 在執行緒池中執行"""
+
+    def __init__(self, workers=2, max_queue=100, downloader_factory=core.YouTubeDownloader,
+                 history=1000):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.downloader_factory = downloader_factory
+        self.history = history
+        self.jobs = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self._ids = itertools.count(1)
+        self._available = None
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+        self._tasks = []
+
+    def start(self):
+        self._available = asyncio.Condition()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for job in self.jobs.values():
+            if job.state == RUNNING and job.downloader is not None:
+                job.downloader.cancel()
+        for task in self._tasks:
+            task.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def queued_count(self):
+        return sum(1 for job in self.jobs.values() if job.state == QUEUED)
+
+    async def submit(self, url, format_request, priority=0):
+        if self.queued_count() >= self.max_queue:
+            raise QueueFull()
+        job = Job(f'j{next(self._ids)}', url, format_request, priority)
+        self.jobs[job.id] = job
+        self._trim_history()
+        async with self._available:
+            heapq.heappush(self._heap, (-priority, next(self._seq), job.id))
+            self._available.notify()
+        return job
+
+    def _trim_history(self):
+        finished = [job for job in self.jobs.values() if job.state in TERMINAL_STATES]
+        for job in finished[:max(0, len(finished) - self.history)]:
+            del self.jobs[job.id]
+
+    async def reprioritize(self, job_id, priority):
+        """調整排隊中工作的優先順序；已開始的工作返回 False"""
+        job = self.jobs[job_id]
+        if job.state != QUEUED:
+            return False
+        job.priority = priority
+        async with self._available:
+            # 舊的項目留在堆積中，取出時依優先順序不符而略過
+            heapq.heappush(self._heap, (-priority, next(self._seq), job.id))
+        return True
+
+    async def cancel(self, job_id):
+        job = self.jobs[job_id]
+        if job.state == QUEUED:
+            self._finish(job, CANCELLED)
+        elif job.state == RUNNING and job.downloader is None:
+            # 下載器仍在建立中，建立完成後由 _run 取消
+            job.cancel_requested = True
+        elif job.state == RUNNING:
+            # cancel 會等待 ffmpeg 結束，不在事件迴圈中執行
+            await asyncio.get_running_loop().run_in_executor(None, job.downloader.cancel)
+        return job
+
+    async def _next_job(self):
+        async with self._available:
+            while True:
+                while self._heap:
+                    neg_priority, _, job_id = heapq.heappop(self._heap)
+                    job = self.jobs.get(job_id)
+                    if job is not None and job.state == QUEUED and job.priority == -neg_priority:
+                        return job
+                await self._available.wait()
+
+    async def _worker(self):
+        while True:
+            job = await self._next_job()
+            await self._run(job)
+
+    async def _run(self, job):
+        loop = asyncio.get_running_loop()
+        job.state = RUNNING
+        job.started = time.time()
+        job.publish({'event': 'state', 'job': job.id, 'state': RUNNING})
+        try:
+            # 建立下載器會載入 yt-dlp 與設定，不在事件迴圈中執行
+            job.downloader = await loop.run_in_executor(
+                self._executor,
+                functools.partial(self.downloader_factory,
+                                  progress_hook=functools.partial(job.progress_hook, loop)))
+            if job.cancel_requested:
+                raise core.DownloadCancelled()
+            info, title, file_path = await loop.run_in_executor(
+                self._executor,
+                functools.partial(job.downloader.download, job.url, format_request=job.format_request))
+            job.result = {'title': title, 'file': file_path,
+                          'metrics_job': job.downloader.last_job_id}
+            self._finish(job, FINISHED)
+        except core.DownloadCancelled:
+            self._finish(job, CANCELLED)
+        except Exception as e:
+            logger.exception("Job %s failed", job.id)
+            job.error = str(e)
+            self._finish(job, FAILED)
+
+    def _finish(self, job, state):
+        job.state = state
+        job.finished = time.time()
+        job.publish({'event': 'state', 'job': job.id, 'state': state,
+                     'result': job.result, 'error': job.error})
+
+    def render_metrics(self):
+        states = {}
+        for job in self.jobs.values():
+            states[job.state] = states.get(job.state, 0) + 1
+        lines = ['# TYPE downloader_jobs gauge']
+        for state in (QUEUED, RUNNING, FINISHED, FAILED, CANCELLED):
+            lines.append(f'downloader_jobs{{state="{state}"}} {states.get(state, 0)}')
+        return metrics.render_prometheus() + '\n'.join(lines) + '\n'
+
+
+class HttpError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+REASONS = {200: 'OK', 201: 'Created', 202: 'Accepted', 400: 'Bad Request', 404: 'Not Found',
+           405: 'Method Not Allowed', 409: 'Conflict', 413: 'Payload Too Large',
+           429: 'Too Many Requests', 500: 'Internal Server Error'}
+
+
+def parse_format(data):
+    """將 JSON 的 format 欄位轉成格式需求，未知的鍵視為錯誤"""
+    data = data or {}
+    if not isinstance(data, dict):
+        raise HttpError(400, 'format must be an object')
+    allowed = ('height', 'vcodec', 'container', 'audio_only')
+    unknown = set(data) - set(allowed)
+    if unknown:
+        raise HttpError(400, f"unknown format fields: {sorted(unknown)}")
+    # 在提交時檢查型別，而不是等到工作執行時才在 plan_formats 中失敗
+    height = data.get('height')
+    if height is not None and (not isinstance(height, int) or isinstance(height, bool) or height <= 0):
+        raise HttpError(400, 'height must be a positive integer or null')
+    vcodec = data.get('vcodec')
+    if vcodec is not None and not isinstance(vcodec, str):
+        raise HttpError(400, 'vcodec must be a string or null')
+    container = data.get('container', 'mp4')
+    if container not in format_planner.CONTAINERS:
+        raise HttpError(400, f"container must be one of {list(format_planner.CONTAINERS)}")
+    audio_only = data.get('audio_only', False)
+    if not isinstance(audio_only, bool):
+        raise HttpError(400, 'audio_only must be a boolean')
+    # 'h264'、'avc1' 等寫法正規化成 plan_formats 比對用的 'avc'
+    return format_planner.make_request(height=height, vcodec=format_planner.codec_family(vcodec),
+                                       container=container, audio_only=audio_only)
+
+
+class HttpHandler:
+    """極簡的 HTTP/1.1 伺服器（支援 keep-alive），避免為服務模式引入額外依賴"""
+
+    def __init__(self, server):
+        self.server = server
+
+    async def __call__(self, reader, writer):
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                method, path, query, headers, body = request
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                if method == 'GET' and path.endswith('/events'):
+                    await self._stream_events(writer, path)
+                    break
+                try:
+                    status, payload, extra = await self._route(method, path, query, body)
+                except HttpError as e:
+                    status, payload, extra = e.status, {'error': str(e)}, e.headers
+                except Exception as e:
+                    logger.exception("Request failed: %s %s", method, path)
+                    status, payload, extra = 500, {'error': str(e)}, {}
+                await self._respond(writer, status, payload, extra, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except HttpError as e:
+            await self._respond(writer, e.status, {'error': str(e)}, {}, False)
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        try:
+            method, target, _ = line.decode('latin-1').split(' ', 2)
+        except ValueError:
+            raise HttpError(400, 'malformed request line')
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            key, _, value = line.decode('latin-1').partition(':')
+            headers[key.strip().lower()] = value.strip()
+        length = int(headers.get('content-length') or 0)
+        if length > MAX_BODY:
+            raise HttpError(413, 'request body too large')
+        body = await reader.readexactly(length) if length else b''
+        path, _, query_string = target.partition('?')
+        query = dict(part.partition('=')[::2] for part in query_string.split('&') if part)
+        return method.upper(), path.rstrip('/') or '/', query, headers, body
+
+    async def _respond(self, writer, status, payload, extra, keep_alive):
+        if isinstance(payload, str):
+            body, content_type = payload.encode('utf-8'), 'text/plain; version=0.0.4'
+        else:
+            body, content_type = json.dumps(payload, ensure_ascii=False).encode('utf-8'), 'application/json'
+        head = [f'HTTP/1.1 {status} {REASONS.get(status, "")}',
+                f'Content-Type: {content_type}',
+                f'Content-Length: {len(body)}',
+                f'Connection: {"keep-alive" if keep_alive else "close"}']
+        head += [f'{key}: {value}' for key, value in extra.items()]
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body)
+        await writer.drain()
+
+    def _job(self, job_id):
+        job = self.server.jobs.get(job_id)
+        if job is None:
+            raise HttpError(404, f'no such job: {job_id}')
+        return job
+
+    def _json(self, body):
+        try:
+            data = json.loads(body or b'{}')
+        except ValueError:
+            raise HttpError(400, 'invalid JSON body')
+        if not isinstance(data, dict):
+            raise HttpError(400, 'JSON body must be an object')
+        return data
+
+    async def _route(self, method, path, query, body):
+        parts = path.strip('/').split('/')
+        if path == '/health':
+            return 200, {'status': 'ok', 'queued': self.server.queued_count()}, {}
+        if path == '/metrics':
+            return 200, self.server.render_metrics(), {}
+        if parts[0] != 'jobs' or len(parts) > 2:
+            raise HttpError(404, f'no route: {path}')
+
+        if len(parts) == 1:
+            if method == 'GET':
+                state = query.get('state')
+                jobs = [job.as_dict() for job in self.server.jobs.values()
+                        if state is None or job.state == state]
+                return 200, {'jobs': jobs}, {}
+            if method == 'POST':
+                data = self._json(body)
+                canonical = url_canon.canonicalize(data.get('url') or '')
+                if canonical.video_id is None:
+                    raise HttpError(400, f"invalid url: {canonical.error}")
+                priority = data.get('priority', 0)
+                if not isinstance(priority, int):
+                    raise HttpError(400, 'priority must be an integer')
+                try:
+                    job = await self.server.submit(canonical.url, parse_format(data.get('format')),
+                                                   priority)
+                except QueueFull:
+                    raise HttpError(429, 'queue is full', {'Retry-After': str(RETRY_AFTER)})
+                except TypeError as e:
+                    raise HttpError(400, str(e))
+                return 201, job.as_dict(), {'Location': f'/jobs/{job.id}'}
+            raise HttpError(405, f'{method} not allowed')
+
+        job = self._job(parts[1])
+        if method == 'GET':
+            return 200, job.as_dict(), {}
+        if method == 'DELETE':
+            await self.server.cancel(job.id)
+            return 202, job.as_dict(), {}
+        if method == 'PATCH':
+            priority = self._json(body).get('priority')
+            if not isinstance(priority, int):
+                raise HttpError(400, 'priority must be an integer')
+            if not await self.server.reprioritize(job.id, priority):
+                raise HttpError(409, f'job is {job.state}, only queued jobs can be reprioritized')
+            return 200, job.as_dict(), {}
+        raise HttpError(405, f'{method} not allowed')
+
+    async def _stream_events(self, writer, path):
+        parts = path.strip('/').split('/')
+        job = self.server.jobs.get(parts[1]) if len(parts) == 3 and parts[0] == 'jobs' else None
+        if job is None:
+            await self._respond(writer, 404, {'error': f'no such job: {path}'}, {}, False)
+            return
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n'
+                     b'Cache-Control: no-cache\r\nConnection: close\r\n\r\n')
+        queue = asyncio.Queue(SUBSCRIBER_BUFFER)
+        job.subscribers.add(queue)
+        try:
+            event = {'event': 'state', **job.as_dict()}
+            while True:
+                name = event.get('event', 'progress')
+                writer.write(f'event: {name}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n'
+                             .encode('utf-8'))
+                await writer.drain()
+                # 以寫出的事件判斷而非 job.state：_finish 先改狀態再發布，
+                # 否則最後的 state 事件可能還在佇列中就結束串流
+                if name == 'state' and event.get('state') in TERMINAL_STATES:
+                    break
+                event = await queue.get()
+        finally:
+            job.subscribers.discard(queue)
+
+
+async def serve(host='127.0.0.1', port=8765, workers=2, max_queue=100,
+                downloader_factory=core.YouTubeDownloader, ready=None):
+    """啟動服務並持續執行；ready 為可選的回呼，參數為實際監聽的 (host, port)"""
+    job_server = JobServer(workers=workers, max_queue=max_queue,
+                           downloader_factory=downloader_factory)
+    job_server.start()
+    server = await asyncio.start_server(HttpHandler(job_server), host, port, limit=MAX_BODY)
+    address = server.sockets[0].getsockname()[:2]
+    logger.info("Job server listening on http://%s:%d", *address)
+    if ready:
+        ready(address)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await job_server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the downloader as a local HTTP job service')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=2, help='concurrent downloads')
+    parser.add_argument('--max-queue', type=int, default=100,
+                        help='queued jobs before POST /jobs returns 429')
+    args = parser.parse_args()
+
+    log_config.setup_logging(core.load_settings(), debug=core.Debug)
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers, args.max_queue))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+"""從已下載的影片批次取出音訊（不重新下載）
+
+每個檔案一個 ffmpeg 行程，以行程池平行處理；輸出已存在且比來源新的檔案直接略過。
+音訊編碼有對應容器時串流複製，否則轉碼，見 audio_pipeline.plan_output。
+
+用法：
+    python library_audio.py Download/ [更多檔案或資料夾] [--out Download/audio]
+                            [--workers 4] [--loudnorm -16]
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import core
+import log_config
+import media_probe
+import atomic_files
+import audio_pipeline
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OUTPUT_DIR = 'audio'
+MB = 1024 * 1024
+
+
+def collect_inputs(paths, output_dir=None):
+    """展開檔案與資料夾（資料夾只看第一層），略過輸出資料夾本身與非媒體檔"""
+    skip = os.path.abspath(output_dir) if output_dir else None
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            if skip and os.path.abspath(path) == skip:
+                continue
+            with os.scandir(path) as entries:
+                for entry in sorted(entries, key=lambda e: e.name):
+                    if entry.is_file() and os.path.splitext(entry.name)[1].lower() in media_probe.MEDIA_EXTENSIONS:
+                        files.append(entry.path)
+        elif os.path.isfile(path):
+            files.append(path)
+        else:
+            logger.warning("找不到檔案：%s", path)
+    return files
+
+
+def find_up_to_date(input_file, output_dir):
+    """輸出資料夾中已有比來源新的同名音訊檔時返回其路徑（不需 ffprobe）"""
+    base = os.path.join(output_dir, os.path.splitext(os.path.basename(input_file))[0])
+    try:
+        source_mtime = os.stat(input_file).st_mtime_ns
+    except OSError:
+        return None
+    for ext in set(audio_pipeline.OUTPUT_EXTENSIONS.values()):
+        try:
+            st = os.stat(base + ext)
+        except OSError:
+            continue
+        if st.st_size > 0 and st.st_mtime_ns >= source_mtime:
+            return base + ext
+    return None
+
+
+def extract_one(ffmpeg_path, input_file, output_dir, loudnorm=None):
+    """在行程池中處理單一檔案，返回結果 dict（status: done/failed/no_audio/already_audio）
+
+    檔案在批次途中被刪除或鎖定時返回 failed，不影響其他檔案
+    """
+    start = time.perf_counter()
+    result = {'input': input_file, 'output': None, 'action': None, 'status': 'failed',
+              'bytes_in': 0, 'bytes_out': 0, 'duration': None}
+    temp_path = None
+    try:
+        result['bytes_in'] = os.path.getsize(input_file)
+        plan = audio_pipeline.plan_output(input_file, loudnorm=loudnorm is not None,
+                                          output_dir=output_dir)
+        if plan is None:
+            result['status'] = 'no_audio'
+        elif plan['replace']:
+            # 輸出資料夾就是來源資料夾且來源已是音訊檔
+            result['status'] = 'already_audio'
+        else:
+            result.update(action=plan['action'], output=plan['output'], duration=plan['duration'])
+            audio_filter = None
+            if loudnorm is not None:
+                measured = audio_pipeline.measure_loudness(ffmpeg_path, input_file, loudnorm)
+                if measured is not None:
+                    audio_filter = audio_pipeline.loudnorm_filter(loudnorm, measured)
+            # 寫入暫存名稱，完成後才換名，中斷時不會留下看似最新的輸出
+            final_path = plan['output']
+            temp_path = atomic_files.part_path(final_path)
+            plan = dict(plan, output=temp_path)
+            completed = audio_pipeline.run(ffmpeg_path, input_file, plan, audio_filter)
+            if completed.returncode == 0:
+                result['sha256'] = atomic_files.finalize(temp_path, final_path, stage='audio')
+                temp_path = None
+                result['bytes_out'] = os.path.getsize(final_path)
+                result['status'] = 'done'
+            else:
+                lines = completed.stderr.strip().splitlines()
+                result['error'] = lines[-1] if lines else f'ffmpeg返回錯誤碼 {completed.returncode}'
+    except OSError as e:
+        result['status'] = 'failed'
+        result['error'] = str(e)
+    finally:
+        if temp_path is not None:
+            try:
+                atomic_files.discard(temp_path)
+            except OSError:
+                pass
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def extract_library(paths, output_dir=None, workers=None, loudnorm=None, on_result=None):
+    """批次取出音訊
+
+    Args:
+        output_dir: 輸出資料夾，None 時為第一個輸入資料夾（或檔案所在資料夾）下的 audio/
+        on_result: 每完成一個檔案呼叫一次，接收 extract_one 的結果
+
+    Returns:
+        dict：files（各檔結果）、skipped（已是最新的檔案數）、seconds、
+        bytes_in、bytes_out、media_seconds、realtime（媒體秒數 / 實際秒數）
+    """
+    if output_dir is None:
+        first = paths[0] if os.path.isdir(paths[0]) else os.path.dirname(paths[0])
+        output_dir = os.path.join(first, DEFAULT_OUTPUT_DIR)
+    os.makedirs(output_dir, exist_ok=True)
+    ffmpeg_path = core.get_ffmpeg_path()
+
+    start = time.perf_counter()
+    pending, results, skipped = [], [], 0
+    for input_file in collect_inputs(paths, output_dir):
+        existing = find_up_to_date(input_file, output_dir)
+        # 無法得知既有輸出是否以相同目標正規化過，正規化時一律重做
+        if existing and loudnorm is None:
+            skipped += 1
+            logger.debug("Up to date: %s -> %s", input_file, existing)
+        else:
+            pending.append(input_file)
+
+    # stream copy 主要受磁碟限制，行程數不需超過 CPU 數
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        futures = {pool.submit(extract_one, ffmpeg_path, input_file, output_dir, loudnorm): input_file
+                   for input_file in pending}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                # 單一檔案的意外錯誤不中斷整批，已完成的統計仍會返回
+                logger.exception("Audio extraction failed for %s", futures[future])
+                result = {'input': futures[future], 'output': None, 'action': None, 'status': 'failed',
+                          'bytes_in': 0, 'bytes_out': 0, 'duration': None, 'seconds': 0.0,
+                          'error': str(e)}
+            results.append(result)
+            if on_result:
+                on_result(result)
+
+    seconds = time.perf_counter() - start
+    done = [r for r in results if r['status'] == 'done']
+    media_seconds = sum(r['duration'] or 0 for r in done)
+    return {
+        'files': results,
+        'skipped': skipped,
+        'seconds': seconds,
+        'bytes_in': sum(r['bytes_in'] for r in done),
+        'bytes_out': sum(r['bytes_out'] for r in done),
+        'media_seconds': media_seconds,
+        'realtime': media_seconds / seconds if seconds else 0.0,
+    }
+
+
+def _print_result(result):
+    name = os.path.basename(result['input'])
+    if result['status'] != 'done':
+        print(f"{result['status']:<13} {name}  {result.get('error', '')}")
+        return
+    realtime = (result['duration'] or 0) / result['seconds'] if result['seconds'] else 0.0
+    rate = result['bytes_in'] / MB / result['seconds'] if result['seconds'] else 0.0
+    print(f"{result['action']:<13} {name} -> {os.path.basename(result['output'])}  "
+          f"{result['seconds']:.2f}s {realtime:.0f}x {rate:.1f} MB/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Extract audio from already downloaded videos')
+    parser.add_argument('paths', nargs='+', help='video files or folders')
+    parser.add_argument('--out', help='output folder (default: <first folder>/audio)')
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--loudnorm', type=float, help='normalize to this integrated loudness (LUFS)')
+    args = parser.parse_args()
+    log_config.setup_logging(core.load_settings(), debug=core.Debug)
+
+    summary = extract_library(args.paths, args.out, args.workers, args.loudnorm, on_result=_print_result)
+    failed = sum(1 for r in summary['files'] if r['status'] == 'failed')
+    print(f"{len(summary['files'])} processed, {summary['skipped']} up to date, {failed} failed; "
+          f"{summary['seconds']:.1f}s, {summary['bytes_in'] / MB:.0f} MB read, "
+          f"{summary['media_seconds'] / 60:.1f} min of audio ({summary['realtime']:.0f}x realtime)")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,270 @@
+"""Download 資料夾的媒體索引（SQLite）
+
+掃描以 os.scandir 走訪資料夾，只對新增或大小/修改時間變動的檔案執行 ffprobe，
+已刪除的檔案從索引移除；未變動的檔案只需一次 stat。下載完成時以 record_download
+記錄影片 ID 與浮水印狀態，掃描到的其他檔案則從檔名推斷。
+
+用法：python library_index.py [Download/] [--search 關鍵字]
+"""
+import os
+import re
+import time
+import sqlite3
+import logging
+import argparse
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+import media_probe
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'library.db')
+DEFAULT_ROOT = 'Download'
+
+WATERMARK_SUFFIX = '_watermarked'
+# yt-dlp 常見檔名樣式 "標題 [VIDEO_ID].ext"
+_VIDEO_ID_IN_NAME = re.compile(r'\[([0-9A-Za-z_-]{11})\]$')
+# 下載或轉檔中的暫存檔：title.part.m4a、title.f137.mp4、title.norm.m4a
+_TEMP_NAME = re.compile(r'\.(part|norm|f\d+)\.\w+$|\.(part|ytdl|tmp)$')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    kind TEXT,
+    title TEXT,
+    video_id TEXT,
+    watermarked INTEGER,
+    duration REAL,
+    width INTEGER,
+    height INTEGER,
+    vcodec TEXT,
+    acodec TEXT
+);
+CREATE INDEX IF NOT EXISTS files_video_id ON files (video_id);
+CREATE INDEX IF NOT EXISTS files_mtime ON files (mtime_ns);
+"""
+
+COLUMNS = ('path', 'name', 'size', 'mtime_ns', 'kind', 'title', 'video_id', 'watermarked',
+           'duration', 'width', 'height', 'vcodec', 'acodec')
+
+# 重新探測時更新媒體欄位；影片 ID、標題與浮水印狀態以 record_download 記錄的為準
+_UPSERT = (f"INSERT INTO files ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))}) "
+           "ON CONFLICT(path) DO UPDATE SET name = excluded.name, size = excluded.size, "
+           "mtime_ns = excluded.mtime_ns, kind = excluded.kind, duration = excluded.duration, "
+           "width = excluded.width, height = excluded.height, vcodec = excluded.vcodec, "
+           "acodec = excluded.acodec, title = COALESCE(files.title, excluded.title), "
+           "video_id = COALESCE(files.video_id, excluded.video_id), "
+           "watermarked = COALESCE(files.watermarked, excluded.watermarked)")
+
+
+_MEDIA_EXTENSIONS = frozenset(media_probe.MEDIA_EXTENSIONS)
+
+
+def is_media_name(name):
+    # 每次掃描對每個檔案都會呼叫，避免 os.path.splitext 的額外開銷
+    dot = name.rfind('.')
+    return (dot > 0 and name[0] != '.' and name[dot:].lower() in _MEDIA_EXTENSIONS
+            and not _TEMP_NAME.search(name))
+
+
+def parse_name(name):
+    """從檔名推斷 (標題, 影片 ID, 是否有浮水印)"""
+    stem = os.path.splitext(name)[0]
+    watermarked = stem.endswith(WATERMARK_SUFFIX)
+    if watermarked:
+        stem = stem[:-len(WATERMARK_SUFFIX)]
+    match = _VIDEO_ID_IN_NAME.search(stem)
+    video_id = match.group(1) if match else None
+    if match:
+        stem = stem[:match.start()].rstrip()
+    return stem, video_id, watermarked
+
+
+def _escape_like(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+class LibraryIndex:
+    """媒體索引；每個執行緒使用自己的連線（WAL，搜尋不會被掃描阻塞）"""
+
+    def __init__(self, path=DEFAULT_DB, probe=media_probe.probe):
+        self.path = path
+        self.probe = probe
+        self._local = threading.local()
+        self._connect().executescript(SCHEMA)
+
+    def _connect(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return db
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        db = self._connect()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            yield db
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    def _row(self, path, st):
+        """探測檔案並組出索引列（探測失敗時媒體欄位為 None）"""
+        name = os.path.basename(path)
+        title, video_id, watermarked = parse_name(name)
+        info = self.probe(path)
+        if info is None:
+            kind = None
+        elif media_probe.has_video(info):
+            kind = 'video'
+        else:
+            kind = 'audio' if info['acodec'] else None
+        # 純音訊不會加浮水印
+        watermarked = watermarked if kind != 'audio' else False
+        return (path, name, st.st_size, st.st_mtime_ns, kind, title, video_id, int(watermarked),
+                info and info['duration'], info and info['width'], info and info['height'],
+                info and info['vcodec'], info and info['acodec'])
+
+    def _walk(self, root):
+        """走訪 root（略過隱藏資料夾），產生 (路徑, stat)"""
+        stack = [root]
+        while stack:
+            folder = stack.pop()
+            try:
+                entries = os.scandir(folder)
+            except OSError as e:
+                logger.warning("無法讀取資料夾 %s：%s", folder, e)
+                continue
+            with entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if not entry.name.startswith('.'):
+                            stack.append(entry.path)
+                    elif is_media_name(entry.name) and entry.is_file():
+                        try:
+                            yield entry.path, entry.stat()
+                        except OSError:
+                            continue
+
+    def scan(self, root=DEFAULT_ROOT, probe_workers=4):
+        """增量掃描 root
+
+        Returns:
+            dict：files（目前檔案數）、probed（重新探測數）、removed、seconds
+        """
+        start = time.perf_counter()
+        root = os.path.abspath(root)
+        if not os.path.isdir(root):
+            # 資料夾暫時不可用（例如外接硬碟未連接）時不要把索引清空
+            logger.warning("無法掃描 %s：資料夾不存在", root)
+            return {'files': 0, 'probed': 0, 'removed': 0, 'seconds': 0.0}
+        # root 底下的路徑：以字串範圍查詢（主鍵索引），不用 LIKE
+        prefix = os.path.join(root, '')
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        db = self._connect()
+        db.row_factory = None
+        try:
+            known = {path: (size, mtime_ns) for path, size, mtime_ns in db.execute(
+                'SELECT path, size, mtime_ns FROM files WHERE path >= ? AND path < ?', (prefix, upper))}
+        finally:
+            db.row_factory = sqlite3.Row
+
+        seen = set()
+        changed = []
+        for path, st in self._walk(root):
+            seen.add(path)
+            if known.get(path) != (st.st_size, st.st_mtime_ns):
+                changed.append((path, st))
+        removed = [(path,) for path in known if path not in seen]
+
+        rows = []
+        if changed:
+            # ffprobe 是子行程，執行緒池即可平行
+            with ThreadPoolExecutor(max_workers=probe_workers) as pool:
+                rows = list(pool.map(lambda item: self._row(*item), changed))
+        if rows or removed:
+            with self._transaction() as db:
+                db.executemany(_UPSERT, rows)
+                db.executemany('DELETE FROM files WHERE path = ?', removed)
+
+        result = {'files': len(seen), 'probed': len(rows), 'removed': len(removed),
+                  'seconds': time.perf_counter() - start}
+        logger.debug("Library scan of %s: %s", root, result)
+        return result
+
+    def record_download(self, path, video_id=None, title=None, watermarked=None):
+        """記錄剛下載完成的檔案（影片 ID、標題與浮水印狀態以這裡為準）"""
+        path = os.path.abspath(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        row = list(self._row(path, st))
+        with self._transaction() as db:
+            db.execute(_UPSERT, row)
+            db.execute('UPDATE files SET video_id = COALESCE(?, video_id), title = COALESCE(?, title), '
+                       'watermarked = COALESCE(?, watermarked) WHERE path = ?',
+                       (video_id, title, None if watermarked is None else int(watermarked), path))
+        return True
+
+    def search(self, text='', kind=None, watermarked=None, limit=200):
+        """依標題/檔名/影片 ID 搜尋，新檔案在前"""
+        clauses, params = [], []
+        text = text.strip()
+        if text:
+            pattern = f'%{_escape_like(text)}%'
+            clauses.append("(title LIKE ? ESCAPE '\\' OR name LIKE ? ESCAPE '\\' OR video_id = ?)")
+            params += [pattern, pattern, text]
+        if kind:
+            clauses.append('kind = ?')
+            params.append(kind)
+        if watermarked is not None:
+            clauses.append('watermarked = ?')
+            params.append(int(watermarked))
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        rows = self._connect().execute(
+            f'SELECT * FROM files {where} ORDER BY mtime_ns DESC LIMIT ?', params + [limit])
+        return [dict(row) for row in rows]
+
+    def find_video(self, video_id):
+        """已下載的同一部影片（用於避免重複下載）"""
+        rows = self._connect().execute('SELECT * FROM files WHERE video_id = ? ORDER BY mtime_ns DESC',
+                                       (video_id,))
+        return [dict(row) for row in rows]
+
+    def stats(self):
+        row = self._connect().execute(
+            "SELECT COUNT(*) AS files, COALESCE(SUM(size), 0) AS bytes, "
+            "SUM(kind = 'video') AS videos, SUM(kind = 'audio') AS audio FROM files").fetchone()
+        return dict(row)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Scan the download folder into the library index')
+    parser.add_argument('root', nargs='?', default=DEFAULT_ROOT)
+    parser.add_argument('--db', default=DEFAULT_DB)
+    parser.add_argument('--search')
+    args = parser.parse_args()
+
+    index = LibraryIndex(args.db)
+    print(index.scan(args.root))
+    print(index.stats())
+    if args.search is not None:
+        for row in index.search(args.search):
+            print(f"{row['kind'] or '-':<5} {row['height'] or '':>5} {row['video_id'] or '-':<11} "
+                  f"{'WM' if row['watermarked'] else '  '} {row['name']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+import os
+import queue
+import atexit
+import logging
+import logging.handlers
+
+LOG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs')
+LOG_FORMAT = '%(asctime)s %(levelname)-7s %(name)s [%(threadName)s] %(message)s'
+
+# 單一日誌檔上限與保留份數
+MAX_BYTES = 5 * 1024 * 1024
+BACKUP_COUNT = 3
+
+_listener = None
+# 上一次由 log_levels 設定過等級的模組
+_module_levels = set()
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """不在呼叫端格式化訊息，留給背景執行緒處理（同一行程內的佇列不需要序列化）"""
+
+    def prepare(self, record):
+        return record
+
+
+def setup_logging(settings=None, debug=False):
+    """設定日誌：呼叫端只把紀錄放進佇列，格式化與寫檔在背景執行緒進行
+
+    settings 可包含：
+        log_level: 全域等級（預設 INFO，debug=True 時為 DEBUG）
+        log_levels: 各模組等級，例如 {"core": "DEBUG", "gui": "WARNING"}
+        log_console: 是否同時輸出到終端機（預設與 debug 相同）
+    重複呼叫時只更新等級，不會重複加入 handler；無效的等級名稱改用 INFO 並記錄警告
+    """
+    global _listener, _module_levels
+    settings = settings or {}
+    root = logging.getLogger()
+    _set_level(root, settings.get('log_level') or ('DEBUG' if debug else 'INFO'))
+    module_levels = settings.get('log_levels') or {}
+    # 重新載入時，已從 log_levels 移除的模組恢復跟隨上層等級
+    for name in _module_levels - set(module_levels):
+        logging.getLogger(name).setLevel(logging.NOTSET)
+    for name, level in module_levels.items():
+        _set_level(logging.getLogger(name), level)
+    _module_levels = set(module_levels)
+
+    if _listener is not None:
+        return
+
+    handlers = []
+    try:
+        os.makedirs(LOG_DIR, exist_ok=True)
+        file_handler = logging.handlers.RotatingFileHandler(
+            os.path.join(LOG_DIR, 'downloader.log'),
+            maxBytes=MAX_BYTES, backupCount=BACKUP_COUNT, encoding='utf-8')
+        handlers.append(file_handler)
+    except OSError:
+        pass
+    log_console = settings.get('log_console')
+    if debug if log_console is None else log_console:
+        handlers.append(logging.StreamHandler())
+
+    formatter = logging.Formatter(LOG_FORMAT)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    root.addHandler(_DeferredQueueHandler(log_queue))
+    _listener = logging.handlers.QueueListener(log_queue, *handlers,
+                                               respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def _set_level(logger, level):
+    try:
+        logger.setLevel(level)
+    except (ValueError, TypeError):
+        logger.setLevel(logging.INFO)
+        logging.getLogger(__name__).warning("Invalid log level %r for %s, using INFO",
+                                            level, logger.name or 'root')
+
+
+def shutdown_logging():
+    """停止背景執行緒並寫出佇列中剩餘的紀錄"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
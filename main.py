@@ -1,6 +1,9 @@
 from PyQt6.QtWidgets import QApplication
 import sys
 from gui import YouTubeDownloaderGUI
+import core
+import log_config
+import settings_store
 
 
 if __name__ == "__main__":
@@ -9,6 +12,11 @@ if __name__ == "__main__":
         import multiprocessing
         multiprocessing.freeze_support()
     
+    log_config.setup_logging(core.load_settings(), debug=core.Debug)
+    # 設定檔變更時即時套用新的日誌等級
+    settings_store.get_settings().on_change(
+        lambda settings: log_config.setup_logging(settings, debug=core.Debug))
+
     app = QApplication(sys.argv)
     window = YouTubeDownloaderGUI()
     window.show()
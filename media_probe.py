@@ -0,0 +1,234 @@
+import os
+import json
+import subprocess
+import threading
+from collections import OrderedDict
+
+import metrics
+
+# 探測結果快取：以 (絕對路徑, 檔案大小, 修改時間) 為鍵，檔案變動後自動失效；
+# 只保留最近使用的 PROBE_CACHE_SIZE 筆（長時間執行或掃描大型媒體庫時不會持續成長）
+PROBE_CACHE_SIZE = 512
+_probe_cache = OrderedDict()
+_probe_lock = threading.Lock()
+
+# 可視為媒體輸出的副檔名（用於找不到 yt-dlp 回報路徑時的後備搜尋）
+MEDIA_EXTENSIONS = ('.mp4', '.mkv', '.webm', '.m4a', '.opus', '.ogg',
+                    '.mp3', '.aac', '.mov', '.flac', '.wav')
+
+
+def get_ffprobe_path():
+    """取得 ffprobe 執行檔路徑（優先使用本地 bin 目錄）"""
+    ffprobe_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'bin', 'ffprobe.exe')
+    if os.path.exists(ffprobe_path):
+        return ffprobe_path
+    return 'ffprobe'
+
+
+_ffprobe_available = None
+
+
+def check_ffprobe_available():
+    """檢查 ffprobe 是否可用（只檢查一次，結果快取）"""
+    global _ffprobe_available
+    if _ffprobe_available is None:
+        try:
+            result = subprocess.run([get_ffprobe_path(), '-version'],
+                                    capture_output=True, timeout=5)
+            _ffprobe_available = result.returncode == 0
+        except (OSError, subprocess.SubprocessError):
+            _ffprobe_available = False
+    return _ffprobe_available
+
+
+def _cache_key(file_path):
+    st = os.stat(file_path)
+    return (os.path.abspath(file_path), st.st_size, st.st_mtime_ns)
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_rate(rate):
+    """解析 '30000/1001' 形式的幀率"""
+    if not rate or rate == '0/0':
+        return None
+    num, _, den = rate.partition('/')
+    num, den = _to_float(num), _to_float(den or 1)
+    if not num or not den:
+        return None
+    return num / den
+
+
+def _parse(data, file_path, size):
+    fmt = data.get('format', {})
+    streams = []
+    for s in data.get('streams', []):
+        streams.append({
+            'index': s.get('index'),
+            'codec_type': s.get('codec_type'),
+            'codec_name': s.get('codec_name'),
+            'width': s.get('width'),
+            'height': s.get('height'),
+            'fps': _parse_rate(s.get('avg_frame_rate') or s.get('r_frame_rate')),
+            'channels': s.get('channels'),
+            'sample_rate': _to_int(s.get('sample_rate')),
+            'duration': _to_float(s.get('duration')),
+            'nb_frames': _to_int(s.get('nb_frames')),
+            'attached_pic': bool(s.get('disposition', {}).get('attached_pic')),
+        })
+
+    duration = _to_float(fmt.get('duration'))
+    # 封面圖等附加圖片不算視訊串流
+    video = next((s for s in streams
+                  if s['codec_type'] == 'video' and not s['attached_pic']), None)
+    audio = next((s for s in streams if s['codec_type'] == 'audio'), None)
+
+    frame_count = None
+    if video:
+        frame_count = video['nb_frames']
+        if not frame_count:
+            # mkv/webm 沒有 nb_frames，以時長乘以幀率估算
+            v_duration = video['duration'] or duration
+            if v_duration and video['fps']:
+                frame_count = int(round(v_duration * video['fps']))
+
+    return {
+        'path': os.path.abspath(file_path),
+        'size': size,
+        'format_name': fmt.get('format_name'),
+        'duration': duration,
+        'bit_rate': _to_int(fmt.get('bit_rate')),
+        'vcodec': video['codec_name'] if video else None,
+        'acodec': audio['codec_name'] if audio else None,
+        'width': video['width'] if video else None,
+        'height': video['height'] if video else None,
+        'fps': video['fps'] if video else None,
+        'frame_count': frame_count,
+        # frame_count 是否來自容器記錄的 nb_frames（False 表示以時長估算）
+        'frame_count_exact': bool(video and video['nb_frames']),
+        'streams': streams,
+    }
+
+
+def probe_command(file_path):
+    """ffprobe 命令列（同步與 asyncio 版本共用）"""
+    return [get_ffprobe_path(), '-v', 'error',
+            '-print_format', 'json',
+            '-show_format', '-show_streams', file_path]
+
+
+def lookup(file_path):
+    """查詢快取；返回 (快取鍵, 探測結果)，未命中時結果為 None，檔案不存在時鍵為 None"""
+    try:
+        key = _cache_key(file_path)
+    except OSError:
+        return None, None
+    with _probe_lock:
+        info = _probe_cache.get(key)
+        if info is not None:
+            _probe_cache.move_to_end(key)
+        return key, info
+
+
+def store(key, file_path, output):
+    """解析 ffprobe 的 JSON 輸出並寫入快取；格式錯誤時拋出 ValueError"""
+    info = _parse(json.loads(output or '{}'), file_path, key[1])
+    with _probe_lock:
+        _probe_cache[key] = info
+        _probe_cache.move_to_end(key)
+        while len(_probe_cache) > PROBE_CACHE_SIZE:
+            _probe_cache.popitem(last=False)
+    return info
+
+
+def probe(file_path):
+    """使用 ffprobe 取得媒體資訊，每個檔案只探測一次
+
+    Returns:
+        dict，包含編碼、解析度、時長、幀數與 'streams' 串流列表；
+        探測失敗時返回 None
+    """
+    key, info = lookup(file_path)
+    if key is None or info is not None:
+        return info
+
+    try:
+        with metrics.span(metrics.current_job(), 'ffprobe', bytes=key[1]) as span:
+            result = subprocess.run(probe_command(file_path),
+                                    capture_output=True,
+                                    text=True,
+                                    timeout=30)
+            span['exit_code'] = result.returncode
+        if result.returncode != 0:
+            return None
+        return store(key, file_path, result.stdout)
+    except (OSError, subprocess.SubprocessError, ValueError):
+        return None
+
+
+def audio_streams(file_path):
+    """返回音訊串流列表；探測失敗時返回 None（與「沒有音訊」區分）"""
+    info = probe(file_path)
+    if info is None:
+        return None
+    return [s for s in info['streams'] if s['codec_type'] == 'audio']
+
+
+def has_video(info):
+    """探測結果是否包含真正的視訊串流（不含封面圖）"""
+    return bool(info) and info['vcodec'] is not None
+
+
+def find_media_file(base_path, want_video=True):
+    """在 base_path.* 中尋找實際可探測的媒體檔案
+
+    Args:
+        base_path: 不含副檔名的路徑
+        want_video: True 時只接受含視訊的檔案，False 時只需要音訊
+    """
+    folder = os.path.dirname(os.path.abspath(base_path))
+    prefix = os.path.basename(base_path) + '.'
+    try:
+        names = os.listdir(folder)
+    except OSError:
+        return None
+
+    fallback = None
+    for name in names:
+        ext = os.path.splitext(name)[1].lower()
+        if not name.startswith(prefix) or ext not in MEDIA_EXTENSIONS:
+            continue
+        # 排除 yt-dlp 的中間檔，例如 title.f137.mp4
+        if name[len(prefix):].count('.') != 0:
+            continue
+        path = os.path.join(folder, name)
+        info = probe(path)
+        if info is None:
+            # ffprobe 不可用時仍保留一個候選檔案
+            fallback = fallback or path
+            continue
+        if want_video and not has_video(info):
+            continue
+        if not want_video and info['acodec'] is None:
+            continue
+        return path
+    return fallback
+
+
+def clear_cache():
+    """清除探測快取"""
+    with _probe_lock:
+        _probe_cache.clear()
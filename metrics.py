@@ -0,0 +1,226 @@
+import os
+import json
+import time
+import uuid
+import threading
+import contextlib
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# 設為 False 時所有記錄函數都直接返回
+enabled = True
+
+# 只保留最近的工作，避免長時間執行時記憶體持續成長
+MAX_JOBS = 500
+
+_lock = threading.Lock()
+_jobs = OrderedDict()
+# Prometheus 彙總：{span 名稱: [次數, 總秒數, 總位元組, 失敗次數]}
+_totals = {}
+_jsonl_file = None
+_prometheus_server = None
+_local = threading.local()
+
+
+def start_job(url):
+    """建立一個新工作並返回 job_id"""
+    job_id = uuid.uuid4().hex[:12]
+    if not enabled:
+        return job_id
+    with _lock:
+        _jobs[job_id] = {'job_id': job_id, 'url': url, 'started': time.time(), 'spans': []}
+        while len(_jobs) > MAX_JOBS:
+            _jobs.popitem(last=False)
+    return job_id
+
+
+def record_span(job_id, name, duration, bytes=None, exit_code=None, **attrs):
+    """記錄一個已完成的區段"""
+    if not enabled or job_id is None:
+        return
+    span = {'job_id': job_id, 'name': name, 'duration': round(duration, 6)}
+    if bytes is not None:
+        span['bytes'] = bytes
+    if exit_code is not None:
+        span['exit_code'] = exit_code
+    if attrs:
+        span.update(attrs)
+
+    with _lock:
+        job = _jobs.get(job_id)
+        if job is not None:
+            job['spans'].append(span)
+        totals = _totals.setdefault(name, [0, 0.0, 0, 0])
+        totals[0] += 1
+        totals[1] += duration
+        totals[2] += bytes or 0
+        if exit_code not in (None, 0) or 'error' in attrs:
+            totals[3] += 1
+        if _jsonl_file is not None:
+            _jsonl_file.write(json.dumps(span, ensure_ascii=False) + '\n')
+            _jsonl_file.flush()
+
+
+@contextlib.contextmanager
+def span(job_id, name, **attrs):
+    """計時區段；可在區塊內修改 yield 出來的 dict 來補上 bytes、exit_code 等欄位"""
+    if not enabled or job_id is None:
+        yield {}
+        return
+    fields = dict(attrs)
+    start = time.perf_counter()
+    try:
+        yield fields
+    except BaseException as e:
+        fields.setdefault('error', type(e).__name__)
+        raise
+    finally:
+        record_span(job_id, name, time.perf_counter() - start, **fields)
+
+
+@contextlib.contextmanager
+def activate(job_id):
+    """將 job_id 設為目前執行緒的工作，讓 ffprobe 等底層呼叫自動歸屬"""
+    previous = getattr(_local, 'job_id', None)
+    _local.job_id = job_id
+    try:
+        yield job_id
+    finally:
+        _local.job_id = previous
+
+
+def current_job():
+    return getattr(_local, 'job_id', None)
+
+
+def get_job(job_id):
+    """返回工作與其區段的副本，不存在時返回 None"""
+    with _lock:
+        job = _jobs.get(job_id)
+        if job is None:
+            return None
+        return dict(job, spans=list(job['spans']))
+
+
+def get_jobs():
+    with _lock:
+        return [dict(job, spans=list(job['spans'])) for job in _jobs.values()]
+
+
+class YtdlpTracker:
+    """把 yt-dlp 的 progress/postprocessor hook 轉成區段
+
+    metadata：從開始擷取到第一個下載回呼；download：每個串流一段；
+    merge 等後處理：依 postprocessor 名稱各一段
+    """
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.extract_start = None
+        self.metadata_done = False
+        self.streams = {}
+        self.postprocessors = {}
+
+    def start_extract(self):
+        self.extract_start = time.perf_counter()
+
+    def _finish_metadata(self):
+        if not self.metadata_done and self.extract_start is not None:
+            self.metadata_done = True
+            record_span(self.job_id, 'metadata', time.perf_counter() - self.extract_start)
+
+    def progress_hook(self, d):
+        if not enabled:
+            return
+        self._finish_metadata()
+        filename = d.get('filename')
+        if d.get('status') == 'downloading':
+            self.streams.setdefault(filename, time.perf_counter())
+        elif d.get('status') in ('finished', 'error'):
+            start = self.streams.pop(filename, None)
+            info = d.get('info_dict') or {}
+            record_span(self.job_id, 'download',
+                        time.perf_counter() - start if start else d.get('elapsed') or 0.0,
+                        bytes=d.get('total_bytes') or d.get('downloaded_bytes'),
+                        format_id=info.get('format_id'),
+                        status=d['status'])
+
+    def postprocessor_hook(self, d):
+        if not enabled:
+            return
+        name = d.get('postprocessor')
+        if d.get('status') == 'started':
+            self.postprocessors[name] = time.perf_counter()
+        elif d.get('status') == 'finished' and name in self.postprocessors:
+            step = 'merge' if name == 'Merger' else f'postprocess.{name}'
+            record_span(self.job_id, step, time.perf_counter() - self.postprocessors.pop(name))
+
+    def finish(self):
+        # 沒有任何下載回呼（例如只擷取資訊）時也記錄 metadata
+        self._finish_metadata()
+
+
+def set_jsonl_sink(path):
+    """每個完成的區段以 JSON-lines 追加到檔案；path 為 None 時關閉"""
+    global _jsonl_file
+    with _lock:
+        if _jsonl_file is not None:
+            _jsonl_file.close()
+            _jsonl_file = None
+        if path:
+            _jsonl_file = open(path, 'a', encoding='utf-8')
+
+
+def render_prometheus():
+    """以 Prometheus 文字格式輸出各區段的彙總"""
+    lines = [
+        '# TYPE downloader_span_total counter',
+        '# TYPE downloader_span_seconds_total counter',
+        '# TYPE downloader_span_bytes_total counter',
+        '# TYPE downloader_span_errors_total counter',
+    ]
+    with _lock:
+        items = sorted((name, list(totals)) for name, totals in _totals.items())
+    for name, (count, seconds, nbytes, errors) in items:
+        label = '{span="%s"}' % name
+        lines.append(f'downloader_span_total{label} {count}')
+        lines.append(f'downloader_span_seconds_total{label} {seconds:.6f}')
+        lines.append(f'downloader_span_bytes_total{label} {nbytes}')
+        lines.append(f'downloader_span_errors_total{label} {errors}')
+    return '\n'.join(lines) + '\n'
+
+
+class _PrometheusHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = render_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_prometheus_server(port, host='127.0.0.1'):
+    """在背景執行緒提供 /metrics；重複呼叫時沿用已啟動的伺服器"""
+    global _prometheus_server
+    if _prometheus_server is None:
+        _prometheus_server = ThreadingHTTPServer((host, port), _PrometheusHandler)
+        threading.Thread(target=_prometheus_server.serve_forever, daemon=True).start()
+    return _prometheus_server
+
+
+def configure(settings):
+    """依設定開啟 JSON-lines 輸出與 Prometheus 端點（可重複呼叫）"""
+    path = settings.get('metrics_jsonl')
+    current = os.path.abspath(_jsonl_file.name) if _jsonl_file is not None else None
+    if path and os.path.abspath(path) != current:
+        set_jsonl_sink(path)
+    port = settings.get('metrics_port')
+    if port:
+        start_prometheus_server(int(port))
@@ -0,0 +1,136 @@
+import os
+import re
+import json
+import time
+import logging
+import tempfile
+import threading
+from urllib.parse import urlparse, parse_qs
+import yt_dlp
+
+logger = logging.getLogger(__name__)
+
+# 已完成的影片記錄：{清單網址: {'done': [video_id, ...], 'updated': 時間}}
+CURSOR_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'playlist_cursors.json')
+
+# 頻道依新到舊排列，連續遇到這麼多個已完成的影片時停止展開
+KNOWN_RUN_LIMIT = 10
+
+_CHANNEL_PATH = re.compile(r'^/(@[^/]+|channel/[^/]+|c/[^/]+|user/[^/]+)(/[^/]+)?/?$')
+
+
+def collection_url(raw_url):
+    """將播放清單或頻道連結轉成標準網址，不是清單時返回 None
+
+    watch?v=...&list=... 仍視為單一影片（與 noplaylist 一致）
+    """
+    parsed = urlparse(raw_url if '://' in raw_url else 'https://' + raw_url)
+    if 'youtube.com' not in parsed.netloc:
+        return None
+    if parsed.path.rstrip('/') == '/playlist':
+        list_id = parse_qs(parsed.query).get('list', [None])[0]
+        return f"https://www.youtube.com/playlist?list={list_id}" if list_id else None
+    match = _CHANNEL_PATH.match(parsed.path)
+    if match:
+        # 沒有指定分頁時只展開「影片」分頁，避免逐一展開所有分頁
+        return f"https://www.youtube.com/{match.group(1)}{match.group(2) or '/videos'}"
+    return None
+
+
+def is_channel(url):
+    return '/playlist?' not in url
+
+
+class BatchCursor:
+    """記錄每個清單已完成的影片，重新執行同一清單時只處理新項目"""
+
+    def __init__(self, path=CURSOR_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._data = {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self._data = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning("Failed to read %s: %s", path, e)
+
+    def done(self, key):
+        with self._lock:
+            return set(self._data.get(key, {}).get('done', []))
+
+    def mark_done(self, key, video_id):
+        with self._lock:
+            entry = self._data.setdefault(key, {'done': []})
+            if video_id in entry['done']:
+                return
+            entry['done'].append(video_id)
+            entry['updated'] = time.time()
+            self._save()
+
+    def _save(self):
+        folder = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix='.cursor_', suffix='.json', dir=folder)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(self._data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+def iter_entries(url, ydl_opts=None):
+    """以平面擷取逐頁展開清單，yt-dlp 取得下一頁時才送出請求"""
+    opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'extract_flat': 'in_playlist',
+        'lazy_playlist': True,
+    }
+    opts.update(ydl_opts or {})
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        info = ydl.extract_info(url, download=False, process=False)
+        for entry in info.get('entries') or []:
+            if not entry:
+                continue
+            # 頻道根頁面可能返回分頁清單，繼續展開
+            if entry.get('_type') in ('playlist', 'url') and entry.get('ie_key') == 'YoutubeTab':
+                yield from iter_entries(entry['url'], ydl_opts)
+            elif entry.get('id'):
+                yield entry
+
+
+def iter_batches(url, batch_size=20, cursor=None, ydl_opts=None):
+    """逐批返回尚未完成的影片 [{'id', 'url', 'title'}, ...]
+
+    第一批湊滿即返回，下載可以在展開其餘項目時開始
+    """
+    key = collection_url(url) or url
+    done = cursor.done(key) if cursor else set()
+    channel = is_channel(key)
+    batch, known_run, seen = [], 0, set()
+    for entry in iter_entries(key, ydl_opts):
+        video_id = entry['id']
+        if video_id in seen:
+            continue
+        seen.add(video_id)
+        if video_id in done:
+            known_run += 1
+            if channel and known_run >= KNOWN_RUN_LIMIT:
+                logger.debug("Stopping expansion of %s at known entries", key)
+                break
+            continue
+        known_run = 0
+        batch.append({
+            'id': video_id,
+            'url': f"https://www.youtube.com/watch?v={video_id}",
+            'title': entry.get('title'),
+        })
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -0,0 +1,143 @@
+"""已下載影片的預覽圖：數張關鍵幀拼成一張橫向 sprite，並快取在磁碟上
+
+每一幀都以輸入端 -ss 搭配 -skip_frame nokey 取得（只解碼關鍵幀，不必解碼整段
+4K 影片），全部輸入在同一個 ffmpeg 行程中以 hstack 拼接。快取檔名包含來源檔的
+大小與修改時間，檔案變動（例如重新加浮水印）後自動重新產生。產生工作在低優先權
+的背景執行緒池中執行，不影響下載與編碼。
+"""
+import os
+import sys
+import glob
+import hashlib
+import logging
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import core
+import media_probe
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.preview_cache')
+FRAME_COUNT = 6
+FRAME_WIDTH = 320
+FRAME_HEIGHT = 180
+POOL_WORKERS = 2
+
+_pool = None
+_pool_lock = threading.Lock()
+_pending = {}
+
+
+def _path_hash(file_path):
+    return hashlib.sha1(os.path.abspath(file_path).encode('utf-8')).hexdigest()[:16]
+
+
+def sprite_path(file_path, cache_dir=None):
+    """來源檔目前版本對應的 sprite 快取路徑（來源不存在時拋出 OSError）"""
+    st = os.stat(file_path)
+    return os.path.join(cache_dir or PREVIEW_CACHE_DIR,
+                        f'{_path_hash(file_path)}_{st.st_size}_{st.st_mtime_ns}.jpg')
+
+
+def cached_sprite(file_path, cache_dir=None):
+    """快取中與來源檔目前版本相符的 sprite，沒有時返回 None"""
+    try:
+        path = sprite_path(file_path, cache_dir)
+    except OSError:
+        return None
+    return path if os.path.exists(path) else None
+
+
+def _run_low_priority(command):
+    """以較低優先權執行 ffmpeg，返回 (結束碼, stderr)"""
+    kwargs = {}
+    if sys.platform == 'win32':
+        kwargs['creationflags'] = subprocess.BELOW_NORMAL_PRIORITY_CLASS
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                               text=True, errors='replace', **kwargs)
+    if hasattr(os, 'setpriority'):
+        # 不用 preexec_fn（多執行緒下不安全），行程啟動後再調整
+        try:
+            os.setpriority(os.PRIO_PROCESS, process.pid, 10)
+        except OSError:
+            pass
+    _, stderr = process.communicate()
+    return process.returncode, stderr
+
+
+def build_command(ffmpeg_path, file_path, duration, output, frames=FRAME_COUNT):
+    """以 frames 個只解碼關鍵幀的輸入拼出 sprite 的 ffmpeg 命令"""
+    command = [ffmpeg_path, '-hide_banner', '-loglevel', 'error', '-y']
+    for i in range(frames):
+        # 避開片頭片尾；-noaccurate_seek 直接使用跳到的關鍵幀
+        timestamp = duration * (i + 0.5) / frames
+        command += ['-skip_frame', 'nokey', '-noaccurate_seek', '-ss', f'{timestamp:.3f}', '-i', file_path]
+    scale = (f'scale={FRAME_WIDTH}:{FRAME_HEIGHT}:force_original_aspect_ratio=decrease,'
+             f'pad={FRAME_WIDTH}:{FRAME_HEIGHT}:(ow-iw)/2:(oh-ih)/2,setsar=1')
+    graph = ';'.join(f'[{i}:v:0]{scale}[f{i}]' for i in range(frames))
+    graph += ';' + ''.join(f'[f{i}]' for i in range(frames)) + f'hstack=inputs={frames}[sprite]'
+    command += ['-filter_complex', graph, '-map', '[sprite]', '-frames:v', '1', '-q:v', '4', output]
+    return command
+
+
+def generate(file_path, cache_dir=None):
+    """產生（或取用快取的）sprite，返回路徑；純音訊或失敗時返回 None"""
+    cache_dir = cache_dir or PREVIEW_CACHE_DIR
+    cached = cached_sprite(file_path, cache_dir)
+    if cached:
+        return cached
+
+    info = media_probe.probe(file_path)
+    if not media_probe.has_video(info) or not info['duration']:
+        return None
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        output = sprite_path(file_path, cache_dir)
+    except OSError:
+        return None
+    tmp_output = output[:-len('.jpg')] + '.tmp.jpg'
+    returncode, stderr = _run_low_priority(
+        build_command(core.get_ffmpeg_path(), file_path, info['duration'], tmp_output))
+    if returncode != 0 or not os.path.exists(tmp_output):
+        logger.warning("預覽圖產生失敗：%s %s", file_path, stderr.strip()[-200:])
+        return None
+    os.replace(tmp_output, output)
+
+    # 移除同一檔案舊版本的快取
+    for old in glob.glob(os.path.join(cache_dir, _path_hash(file_path) + '_*.jpg')):
+        if old != output:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+    return output
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=POOL_WORKERS, thread_name_prefix='preview')
+        return _pool
+
+
+def request(file_path):
+    """在背景產生 sprite，返回 Future（結果為路徑或 None）；同一檔案不會重複排隊"""
+    key = os.path.abspath(file_path)
+    pool = _get_pool()
+    with _pool_lock:
+        future = _pending.get(key)
+        if future is not None and not future.done():
+            return future
+        future = pool.submit(generate, file_path)
+        _pending[key] = future
+
+    def forget(f):
+        with _pool_lock:
+            if _pending.get(key) is f:
+                del _pending[key]
+
+    future.add_done_callback(forget)
+    return future
@@ -0,0 +1,164 @@
+import re
+import random
+import socket
+import logging
+import threading
+from collections import Counter
+from urllib.error import URLError
+
+import metrics
+import throughput
+
+logger = logging.getLogger(__name__)
+
+NETWORK = 'network'
+THROTTLE = 'throttle'
+FORBIDDEN = 'forbidden'
+FORMAT = 'format'
+FFMPEG = 'ffmpeg'
+STALLED = 'stalled'
+FATAL = 'fatal'
+
+# 各類失敗最多重試次數（不含第一次嘗試）
+DEFAULT_MAX_RETRIES = {
+    NETWORK: 5,
+    THROTTLE: 4,
+    FORBIDDEN: 3,
+    FORMAT: 2,
+    FFMPEG: 1,
+    STALLED: 10,
+    FATAL: 0,
+}
+
+# 稍後或換一台機器重試也不會成功的失敗（私人或已移除的影片、沒有可用的格式）；
+# 下載本身已依 DEFAULT_MAX_RETRIES 重試過
+PERMANENT = frozenset({FORMAT, FATAL})
+
+# 被限流時等待較久；串流過慢時立即從中斷處重新連線
+DELAY_MULTIPLIER = {THROTTLE: 5.0, STALLED: 0.0}
+
+# 遇到 403 或格式不可用時依序更換的 player_client
+PLAYER_CLIENTS = [
+    ['android', 'web'],
+    ['ios', 'web'],
+    ['tv'],
+    ['mweb'],
+]
+
+# 依序比對錯誤訊息；yt-dlp 會把底層例外包成 DownloadError，所以以訊息為主
+_PATTERNS = [
+    (FORBIDDEN, re.compile(r'HTTP Error 403|403 Forbidden|Sign in to confirm', re.IGNORECASE)),
+    (THROTTLE, re.compile(r'HTTP Error 429|Too Many Requests|rate.?limit', re.IGNORECASE)),
+    (FORMAT, re.compile(r'Requested format is not available|format is not available|找不到符合條件的格式',
+                        re.IGNORECASE)),
+    (FFMPEG, re.compile(r'ffmpeg|ffprobe|Postprocessing|Conversion failed', re.IGNORECASE)),
+    (NETWORK, re.compile(r'timed? ?out|Connection (?:reset|refused|aborted)|Remote end closed|'
+                         r'IncompleteRead|Temporary failure in name resolution|'
+                         r'Unable to download|HTTP Error 5\d\d|did not get any data|'
+                         r'Network is unreachable|ContentTooShort', re.IGNORECASE)),
+]
+
+_NETWORK_TYPES = (ConnectionError, TimeoutError, socket.timeout, socket.gaierror, URLError)
+
+_lock = threading.Lock()
+_failure_counts = Counter()
+
+
+def _causes(exc):
+    """展開 yt-dlp 的 exc_info 與 __cause__/__context__ 鏈"""
+    seen = set()
+    while exc is not None and id(exc) not in seen:
+        seen.add(id(exc))
+        yield exc
+        wrapped = getattr(exc, 'exc_info', None)
+        if wrapped and isinstance(wrapped, tuple) and len(wrapped) > 1 and wrapped[1] is not exc:
+            exc = wrapped[1]
+        else:
+            exc = exc.__cause__ or exc.__context__
+
+
+def classify(exc):
+    """將例外分類為 network/throttle/forbidden/format/ffmpeg/stalled/fatal"""
+    chain = list(_causes(exc))
+    if any(isinstance(e, throughput.StreamThrottledError) for e in chain):
+        return STALLED
+    for cls, pattern in _PATTERNS:
+        if any(pattern.search(str(e)) for e in chain):
+            return cls
+    if any(isinstance(e, _NETWORK_TYPES) for e in chain):
+        return NETWORK
+    return FATAL
+
+
+def failure_counts():
+    """行程啟動以來各類失敗的次數"""
+    with _lock:
+        return dict(_failure_counts)
+
+
+class RetryPolicy:
+    """單一下載工作的重試狀態：各類失敗分別計數，以指數退避加上隨機抖動等待
+
+    403 與格式不可用時更換 player_client；格式不可用時另外要求重新規劃格式
+    """
+
+    def __init__(self, max_retries=None, base_delay=1.0, max_delay=60.0,
+                 clients=PLAYER_CLIENTS, rng=None):
+        self.max_retries = dict(DEFAULT_MAX_RETRIES, **(max_retries or {}))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.clients = clients
+        self.rng = rng or random.Random()
+        self.retries = Counter()
+        self.client_index = 0
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(max_retries=settings.get('retry_max_retries'),
+                   base_delay=settings.get('retry_base_delay', 1.0),
+                   max_delay=settings.get('retry_max_delay', 60.0))
+
+    @property
+    def player_client(self):
+        return self.clients[self.client_index % len(self.clients)]
+
+    def backoff(self, cls, attempt):
+        """第 attempt 次重試的等待秒數：上限的一半到上限之間隨機"""
+        cap = min(self.max_delay, self.base_delay * DELAY_MULTIPLIER.get(cls, 1.0) * 2 ** (attempt - 1))
+        return self.rng.uniform(cap / 2, cap)
+
+    def on_failure(self, exc, job_id=None):
+        """記錄一次失敗並決定是否重試
+
+        Returns:
+            不重試時返回 None，否則返回 dict：
+                class: 失敗類別
+                attempt: 此類別的第幾次重試
+                delay: 重試前等待秒數
+                rotate_client: 是否已更換 player_client
+                replan: 是否需要重新取得格式清單並規劃
+        """
+        cls = classify(exc)
+        with _lock:
+            _failure_counts[cls] += 1
+        self.retries[cls] += 1
+        attempt = self.retries[cls]
+        metrics.record_span(job_id, f'failure.{cls}', 0.0, attempt=attempt, error=type(exc).__name__)
+
+        if attempt > self.max_retries.get(cls, 0):
+            logger.warning("Giving up after %s failure #%d: %s", cls, attempt, exc)
+            return None
+
+        rotate = cls in (FORBIDDEN, FORMAT) and len(self.clients) > 1
+        if rotate:
+            self.client_index += 1
+        decision = {
+            'class': cls,
+            'attempt': attempt,
+            'delay': self.backoff(cls, attempt),
+            'rotate_client': rotate,
+            'replan': cls == FORMAT,
+        }
+        logger.info("Retrying after %s failure #%d in %.1fs (player_client=%s): %s",
+                    cls, attempt, decision['delay'], self.player_client, exc)
+        return decision
@@ -0,0 +1,156 @@
+import os
+import shutil
+import logging
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import metrics
+import media_probe
+
+logger = logging.getLogger(__name__)
+
+# 每段長度的上下限（秒）；實際切點落在之後的第一個關鍵幀
+MIN_SEGMENT_SECONDS = 5
+MAX_SEGMENT_SECONDS = 120
+
+
+def default_workers():
+    return os.cpu_count() or 1
+
+
+def plan_segment_seconds(duration, workers):
+    """每個行程分到約 4 段，讓較慢的片段不會拖住整體"""
+    if not duration:
+        return MAX_SEGMENT_SECONDS
+    seconds = duration / (workers * 4)
+    return max(MIN_SEGMENT_SECONDS, min(MAX_SEGMENT_SECONDS, seconds))
+
+
+def split_at_keyframes(ffmpeg_path, input_file, workdir, segment_seconds):
+    """以串流複製切割視訊軌（不重新編碼，只能在關鍵幀切開）"""
+    pattern = os.path.join(workdir, 'src_%05d.mkv')
+    subprocess.run([ffmpeg_path, '-hide_banner', '-loglevel', 'error', '-y',
+                    '-i', input_file,
+                    '-map', '0:v:0', '-c', 'copy',
+                    '-f', 'segment', '-segment_time', f'{segment_seconds:.3f}',
+                    '-reset_timestamps', '1',
+                    pattern],
+                   capture_output=True, check=True)
+    return sorted(os.path.join(workdir, name) for name in os.listdir(workdir)
+                  if name.startswith('src_'))
+
+
+def _encode_segment(run_ffmpeg, job_id, ffmpeg_path, segment, logo_path, filter_graph, video_args, output):
+    """在執行緒池中為單一片段加上浮水印；行程登記在 job_id 下，取消工作時會被終止"""
+    # metrics.activate 只作用於目前執行緒，需在池中的執行緒重新設定
+    with metrics.activate(job_id):
+        return run_ffmpeg([ffmpeg_path, '-hide_banner', '-loglevel', 'error', '-y',
+                           '-i', segment, '-i', logo_path,
+                           '-filter_complex', filter_graph,
+                           '-map', '[v]', *video_args, '-an', output])
+
+
+def concat_segments(ffmpeg_path, segments, input_file, audio_args, output_file, workdir):
+    """以 concat demuxer 串接片段（視訊不重新編碼），並從原始檔加入音訊"""
+    list_file = os.path.join(workdir, 'concat.txt')
+    with open(list_file, 'w', encoding='utf-8') as f:
+        for segment in segments:
+            # concat 清單中的單引號需跳脫
+            f.write("file '{}'\n".format(segment.replace("'", "'\\''")))
+
+    result = subprocess.run([ffmpeg_path, '-hide_banner', '-loglevel', 'error', '-y',
+                             '-f', 'concat', '-safe', '0', '-i', list_file,
+                             '-i', input_file,
+                             '-map', '0:v', '-c:v', 'copy',
+                             *audio_args, output_file],
+                            capture_output=True, text=True)
+    return result.returncode
+
+
+def verify_output(source_info, output_file):
+    """確認輸出的幀數與時長和來源一致"""
+    output_info = media_probe.probe(output_file)
+    if not source_info or not output_info:
+        return False, '無法探測來源或輸出'
+
+    # mkv/webm 的幀數是以時長估算的，誤差常超過一幀，只在兩邊都有確切幀數時比對，否則只比對時長
+    src_frames, out_frames = source_info['frame_count'], output_info['frame_count']
+    exact = source_info.get('frame_count_exact') and output_info.get('frame_count_exact')
+    if exact and src_frames and out_frames and abs(src_frames - out_frames) > 1:
+        return False, f'幀數不符：來源 {src_frames}，輸出 {out_frames}'
+
+    src_duration, out_duration = source_info['duration'], output_info['duration']
+    fps = source_info['fps'] or 30
+    if src_duration and out_duration and abs(src_duration - out_duration) > max(0.1, 2 / fps):
+        return False, f'時長不符：來源 {src_duration:.3f}s，輸出 {out_duration:.3f}s'
+    return True, ''
+
+
+def encode_parallel(ffmpeg_path, input_file, output_file, logo_path, filter_graph,
+                    video_args, audio_args, run_ffmpeg, workers=None, progress_hook=None):
+    """分段平行加浮水印
+
+    Args:
+        filter_graph: 以 [0:v] 為影片、[1:v] 為 Logo、輸出標籤為 [v] 的濾鏡
+        video_args: 視訊編碼參數（-c:v 起）
+        audio_args: 以第二個輸入（原始檔）為來源的音訊參數
+        run_ffmpeg: 執行片段編碼命令並返回結束碼（core.run_ffmpeg，行程會登記在目前工作下）
+
+    Returns:
+        成功並通過幀數/時長檢查時返回 True；失敗時刪除輸出並返回 False
+    """
+    workers = workers or default_workers()
+    ok = False
+    source_info = media_probe.probe(input_file)
+    duration = source_info['duration'] if source_info else None
+    total_frames = source_info['frame_count'] if source_info else None
+
+    # 暫存目錄放在輸出旁邊，避免跨磁碟複製大檔
+    workdir = tempfile.mkdtemp(prefix='.segments_',
+                               dir=os.path.dirname(os.path.abspath(output_file)))
+    try:
+        segments = split_at_keyframes(ffmpeg_path, input_file, workdir,
+                                      plan_segment_seconds(duration, workers))
+        if not segments:
+            return False
+
+        outputs = [os.path.join(workdir, f'wm_{i:05d}.mkv') for i in range(len(segments))]
+        # 每個片段一個 ffmpeg 行程，編碼器本身只用單執行緒，避免超額排程；
+        # 執行緒只負責等待行程，行程登記在目前工作下，取消時可一併終止
+        segment_args = list(video_args) + ['-threads', '1']
+        job_id = metrics.current_job()
+        done = 0
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='segment') as pool:
+            futures = [pool.submit(_encode_segment, run_ffmpeg, job_id, ffmpeg_path, segment, logo_path,
+                                   filter_graph, segment_args, output)
+                       for segment, output in zip(segments, outputs)]
+            for future in as_completed(futures):
+                returncode = future.result()
+                if returncode != 0:
+                    logger.error("❌ 片段編碼失敗：ffmpeg返回錯誤碼 %s", returncode)
+                    for pending in futures:
+                        pending.cancel()
+                    return False
+                done += 1
+                if progress_hook and total_frames:
+                    progress_hook({'status': 'processing',
+                                   'frame': total_frames * done // len(segments),
+                                   'total_frames': total_frames})
+
+        if concat_segments(ffmpeg_path, outputs, input_file, audio_args,
+                           output_file, workdir) != 0:
+            return False
+
+        ok, reason = verify_output(source_info, output_file)
+        if not ok:
+            logger.error("❌ 分段編碼結果檢查失敗：%s", reason)
+        return ok
+    except Exception as e:
+        logger.error("❌ 分段編碼失敗：%s", e)
+        return False
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+        # 失敗時不留下不完整的輸出
+        if not ok and os.path.exists(output_file):
+            os.remove(output_file)
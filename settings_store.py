@@ -0,0 +1,243 @@
+import os
+import json
+import types
+import shutil
+import logging
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+# 設定檔固定放在程式目錄，不受目前工作目錄影響
+SETTINGS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'settings.json')
+# 舊版從目前工作目錄讀寫設定檔
+LEGACY_SETTINGS_FILE = 'settings.json'
+
+# 檢查檔案是否變動的間隔（秒）
+POLL_INTERVAL = 1.0
+
+
+def _number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _positive_int(value):
+    return isinstance(value, int) and not isinstance(value, bool) and value > 0
+
+
+def _log_level(value):
+    # logging.getLevelNamesMapping 需要 Python 3.11；未知名稱時 getLevelName 返回字串
+    return isinstance(value, str) and isinstance(logging.getLevelName(value), int)
+
+
+def _optional(check):
+    return lambda value: value is None or check(value)
+
+
+# 每個鍵：(預設值, 檢查函數)；檢查失敗時該鍵使用預設值，其他鍵不受影響
+SCHEMA = {
+    'watermark_width': (300, _positive_int),
+    'watermark_height': (10, _positive_int),
+    'watermark_width_ratio': (None, _optional(lambda v: _number(v) and 0 < v <= 1)),
+    # 高 / 寬；"logo" 表示使用 Logo 圖片的原始比例
+    'watermark_aspect': (None, _optional(lambda v: v == 'logo' or (_number(v) and v > 0))),
+    'watermark_margin_ratio': (1 / 1920, lambda v: _number(v) and 0 <= v < 0.5),
+    'encoder_min_psnr': (40.0, _number),
+    'parallel_watermark': (False, lambda v: isinstance(v, bool)),
+    'watermark_verify_frames': (3, lambda v: isinstance(v, int) and not isinstance(v, bool) and 0 <= v <= 20),
+    'batch_concurrency': (2, _positive_int),
+    'async_extract_workers': (8, _positive_int),
+    'retry_max_retries': ({}, lambda v: isinstance(v, dict)
+                          and all(isinstance(x, int) and x >= 0 for x in v.values())),
+    'retry_base_delay': (1.0, lambda v: _number(v) and v >= 0),
+    'retry_max_delay': (60.0, lambda v: _number(v) and v >= 0),
+    'watchdog_enabled': (True, lambda v: isinstance(v, bool)),
+    'watchdog_window': (5.0, lambda v: _number(v) and v > 0),
+    'watchdog_fraction': (0.25, lambda v: _number(v) and 0 < v < 1),
+    'watchdog_grace': (10.0, lambda v: _number(v) and v >= 0),
+    'disk_margin_mb': (512, lambda v: _number(v) and v >= 0),
+    # 純音訊響度正規化的目標整合響度（LUFS），None 表示不正規化
+    'audio_loudnorm': (None, _optional(lambda v: _number(v) and -70 <= v <= -5)),
+    'watermark_size_factor': (3.0, lambda v: _number(v) and v > 0),
+    'metrics_jsonl': (None, _optional(lambda v: isinstance(v, str))),
+    'metrics_port': (None, _optional(lambda v: _positive_int(v) and v < 65536)),
+    'log_level': (None, _optional(_log_level)),
+    'log_levels': ({}, lambda v: isinstance(v, dict) and all(_log_level(x) for x in v.values())),
+    'log_console': (None, _optional(lambda v: isinstance(v, bool))),
+    'ui_debug': (None, _optional(lambda v: isinstance(v, bool))),
+}
+
+
+class Settings:
+    """settings.json 的快取
+
+    讀取只存取記憶體中的快照；背景執行緒定期檢查檔案修改時間並重新載入，
+    寫入時先寫暫存檔再以 os.replace 原子替換
+    """
+
+    def __init__(self, path=SETTINGS_FILE, schema=SCHEMA):
+        self.path = path
+        self.schema = schema
+        self._lock = threading.Lock()
+        self._raw = {}
+        self._explicit = frozenset()
+        self._snapshot = types.MappingProxyType(self._validate({}))
+        self._stamp = None
+        self._listeners = []
+        self._watcher = None
+        self._stop = threading.Event()
+        self.reload()
+
+    @property
+    def snapshot(self):
+        """目前設定的唯讀 dict（已合併預設值）"""
+        return self._snapshot
+
+    def get(self, key, default=None):
+        return self._snapshot.get(key, default)
+
+    def __getitem__(self, key):
+        return self._snapshot[key]
+
+    def is_set(self, key):
+        """該鍵是否由設定檔明確指定（且通過檢查）"""
+        return key in self._explicit
+
+    def as_dict(self):
+        return dict(self._snapshot)
+
+    def _validate(self, raw):
+        merged = dict(raw)  # 保留 schema 以外的鍵（例如其他頁面自行儲存的設定）
+        explicit = set()
+        for key, (default, check) in self.schema.items():
+            if key not in raw:
+                merged[key] = default
+            elif check(raw[key]):
+                explicit.add(key)
+            else:
+                logger.warning("Invalid value for setting %s: %r, using default %r",
+                               key, raw[key], default)
+                merged[key] = default
+        self._explicit = frozenset(explicit)
+        return merged
+
+    def _file_stamp(self):
+        try:
+            st = os.stat(self.path)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def reload(self):
+        """重新讀取設定檔；檔案損毀時保留上一次的有效設定"""
+        stamp = self._file_stamp()
+        raw = {}
+        if stamp is not None:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    raw = json.load(f)
+                if not isinstance(raw, dict):
+                    raise ValueError('settings root must be an object')
+            except (OSError, ValueError) as e:
+                logger.warning("Failed to read %s: %s", self.path, e)
+                self._stamp = stamp
+                return False
+
+        with self._lock:
+            self._raw = raw
+            self._snapshot = types.MappingProxyType(self._validate(raw))
+            self._stamp = stamp
+            listeners = list(self._listeners)
+        for callback in listeners:
+            try:
+                callback(self._snapshot)
+            except Exception:
+                logger.exception("Settings listener failed")
+        return True
+
+    def update(self, **changes):
+        """驗證並原子寫入設定，成功後立即更新快照"""
+        for key, value in changes.items():
+            if key in self.schema and not self.schema[key][1](value):
+                raise ValueError(f"Invalid value for setting {key}: {value!r}")
+
+        with self._lock:
+            raw = dict(self._raw)
+        raw.update(changes)
+
+        folder = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix='.settings_', suffix='.json', dir=folder)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(raw, f, indent=4, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.reload()
+
+    def on_change(self, callback):
+        """註冊設定重新載入後的回呼，參數為新的快照"""
+        with self._lock:
+            self._listeners.append(callback)
+
+    def start_watching(self, interval=POLL_INTERVAL):
+        """啟動背景執行緒，設定檔變動時自動重新載入"""
+        if self._watcher is not None:
+            return
+        self._watcher = threading.Thread(target=self._watch, args=(interval,),
+                                         name='settings-watcher', daemon=True)
+        self._watcher.start()
+
+    def stop_watching(self):
+        self._stop.set()
+
+    def _watch(self, interval):
+        while not self._stop.wait(interval):
+            if self._file_stamp() != self._stamp:
+                self.reload()
+
+
+def migrate_legacy_file(path=SETTINGS_FILE, legacy_path=LEGACY_SETTINGS_FILE):
+    """程式目錄還沒有設定檔、目前工作目錄有舊版設定檔時，將舊檔複製到程式目錄
+
+    返回應使用的設定檔路徑；無法複製時（例如程式目錄唯讀）返回舊檔路徑，直接沿用舊檔
+    """
+    legacy_path = os.path.abspath(legacy_path)
+    if (os.path.exists(path) or legacy_path == os.path.abspath(path)
+            or not os.path.isfile(legacy_path)):
+        return path
+    folder = os.path.dirname(os.path.abspath(path))
+    tmp_path = None
+    try:
+        fd, tmp_path = tempfile.mkstemp(prefix='.settings_', suffix='.json', dir=folder)
+        with os.fdopen(fd, 'wb') as dst, open(legacy_path, 'rb') as src:
+            shutil.copyfileobj(src, dst)
+            dst.flush()
+            os.fsync(dst.fileno())
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning("Failed to migrate %s to %s: %s, using the old file", legacy_path, path, e)
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return legacy_path
+    logger.info("Migrated settings from %s to %s", legacy_path, path)
+    return path
+
+
+_settings = None
+_settings_lock = threading.Lock()
+
+
+def get_settings():
+    """取得共用的設定物件（第一次呼叫時載入並開始監看檔案）"""
+    global _settings
+    if _settings is None:
+        with _settings_lock:
+            if _settings is None:
+                _settings = Settings(migrate_legacy_file())
+                _settings.start_watching()
+    return _settings
@@ -0,0 +1,98 @@
+import time
+import logging
+import threading
+from collections import deque, Counter
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_restart_counts = Counter()
+
+
+class StreamThrottledError(Exception):
+    """串流速度持續低於近期峰值，中斷下載以便從目前位置重新連線"""
+
+    def __init__(self, filename, speed, peak, offset):
+        super().__init__(f"stream throttled: {speed / 1024:.0f} KiB/s "
+                         f"(peak {peak / 1024:.0f} KiB/s) at byte {offset}")
+        self.filename = filename
+        self.speed = speed
+        self.peak = peak
+        self.offset = offset
+
+
+def restart_counts():
+    """行程啟動以來各檔案因限速而重新連線的次數"""
+    with _lock:
+        return dict(_restart_counts)
+
+
+class Watchdog:
+    """以移動視窗計算每個串流的速度，持續過慢時在 progress hook 中拋出 StreamThrottledError
+
+    yt-dlp 保留 .part 檔，重試時以 Range 從中斷的位置繼續
+    """
+
+    def __init__(self, window=5.0, fraction=0.25, grace=10.0, warmup=None, clock=time.monotonic):
+        self.window = window
+        self.fraction = fraction
+        self.grace = grace
+        # 剛開始的速度不穩定，至少累積一個視窗後才開始判斷
+        self.warmup = window if warmup is None else warmup
+        self.clock = clock
+        self._streams = {}
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(window=settings.get('watchdog_window', 5.0),
+                   fraction=settings.get('watchdog_fraction', 0.25),
+                   grace=settings.get('watchdog_grace', 10.0))
+
+    def _stream(self, filename, now):
+        stream = self._streams.get(filename)
+        if stream is None:
+            stream = self._streams[filename] = {
+                'samples': deque(), 'start': now, 'peak': 0.0, 'slow_since': None}
+        return stream
+
+    def speed(self, filename):
+        """目前視窗內的平均速度（bytes/s），資料不足時返回 None"""
+        stream = self._streams.get(filename)
+        if not stream or len(stream['samples']) < 2:
+            return None
+        (t0, b0), (t1, b1) = stream['samples'][0], stream['samples'][-1]
+        return (b1 - b0) / (t1 - t0) if t1 > t0 else None
+
+    def progress_hook(self, d):
+        filename = d.get('filename')
+        if d.get('status') != 'downloading':
+            self._streams.pop(filename, None)
+            return
+        downloaded = d.get('downloaded_bytes')
+        if downloaded is None:
+            return
+
+        now = self.clock()
+        stream = self._stream(filename, now)
+        samples = stream['samples']
+        samples.append((now, downloaded))
+        while len(samples) > 2 and now - samples[1][0] >= self.window:
+            samples.popleft()
+
+        speed = self.speed(filename)
+        if speed is None or now - stream['start'] < self.warmup:
+            return
+        stream['peak'] = max(stream['peak'], speed)
+
+        if speed >= stream['peak'] * self.fraction:
+            stream['slow_since'] = None
+            return
+        if stream['slow_since'] is None:
+            stream['slow_since'] = now
+        elif now - stream['slow_since'] >= self.grace:
+            self._streams.pop(filename, None)
+            with _lock:
+                _restart_counts[filename] += 1
+            logger.info("Restarting throttled stream %s at byte %d (%.0f B/s, peak %.0f B/s)",
+                        filename, downloaded, speed, stream['peak'])
+            raise StreamThrottledError(filename, speed, stream['peak'], downloaded)
@@ -0,0 +1,120 @@
+import re
+import functools
+from collections import namedtuple
+from urllib.parse import unquote
+
+# 解析結果；video_id 為 None 時 error 說明原因
+CanonicalURL = namedtuple('CanonicalURL', 'input video_id url start playlist_id error')
+
+VIDEO_ID = r'[0-9A-Za-z_-]{11}'
+
+_VIDEO_ID_RE = re.compile(rf'^{VIDEO_ID}$')
+_URL_RE = re.compile(
+    r'^(?:(?P<scheme>[a-z][a-z0-9+.-]*):)?(?://)?'
+    r'(?P<host>[^/?#]*)(?P<path>[^?#]*)(?:\?(?P<query>[^#]*))?(?:#(?P<fragment>.*))?$',
+    re.IGNORECASE)
+_YOUTUBE_HOST_RE = re.compile(
+    r'^(?:(?:www|m|music|gaming)\.)?(?:youtube\.com|youtube-nocookie\.com)(?::\d+)?$',
+    re.IGNORECASE)
+_SHORT_HOST_RE = re.compile(r'^(?:www\.)?youtu\.be(?::\d+)?$', re.IGNORECASE)
+# /shorts/ID、/live/ID、/embed/ID、/v/ID、/e/ID
+_PATH_ID_RE = re.compile(rf'^/(?:shorts|live|embed|v|e)/({VIDEO_ID})(?:[/?#]|$)')
+_SHORT_PATH_RE = re.compile(rf'^/({VIDEO_ID})(?:/|$)')
+_QUERY_PARAM_RE = re.compile(r'(?:^|&)([^=&]+)=([^&]*)')
+_TIMESTAMP_RE = re.compile(r'^(?:(\d+)h)?(?:(\d+)m)?(?:(\d+)s?)?$')
+
+
+def _params(query):
+    params = {}
+    if query:
+        for key, value in _QUERY_PARAM_RE.findall(query):
+            params.setdefault(key, unquote(value))
+    return params
+
+
+def _parse_timestamp(value):
+    """'90'、'1m30s'、'1h2m3s' 轉成秒數，無法解析時返回 None"""
+    match = _TIMESTAMP_RE.match(value or '')
+    if not match or not any(match.groups()):
+        return None
+    hours, minutes, seconds = (int(g) if g else 0 for g in match.groups())
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def _failure(raw, error):
+    return CanonicalURL(raw, None, None, None, None, error)
+
+
+@functools.lru_cache(maxsize=4096)
+def canonicalize(raw_url):
+    """從各種 YouTube 連結取出 11 字元的影片 ID
+
+    支援 watch?v=、youtu.be/、/shorts/、/live/、/embed/、/v/、attribution_link，
+    以及 www./m./music. 主機與時間戳（t=、start=、#t=）。不輸出任何訊息
+
+    Returns:
+        CanonicalURL；url 為 https://www.youtube.com/watch?v=ID 形式
+    """
+    text = (raw_url or '').strip()
+    if not text:
+        return _failure(raw_url, 'empty')
+    if _VIDEO_ID_RE.match(text):
+        return CanonicalURL(raw_url, text, f"https://www.youtube.com/watch?v={text}",
+                            None, None, None)
+
+    match = _URL_RE.match(text)
+    if not match:
+        return _failure(raw_url, 'not a url')
+    host, path = match.group('host'), match.group('path') or '/'
+    params = _params(match.group('query'))
+    fragment = _params(match.group('fragment'))
+
+    video_id = None
+    if _SHORT_HOST_RE.match(host):
+        found = _SHORT_PATH_RE.match(path)
+        video_id = found.group(1) if found else None
+    elif _YOUTUBE_HOST_RE.match(host):
+        if path.rstrip('/') in ('/watch', ''):
+            video_id = params.get('v')
+        elif path.rstrip('/') == '/attribution_link' and 'u' in params:
+            return canonicalize('https://www.youtube.com' + params['u'])._replace(input=raw_url)
+        else:
+            found = _PATH_ID_RE.match(path)
+            video_id = found.group(1) if found else None
+    else:
+        return _failure(raw_url, 'not a youtube host')
+
+    if not video_id or not _VIDEO_ID_RE.match(video_id):
+        return _failure(raw_url, 'no video id')
+
+    start = _parse_timestamp(params.get('t') or params.get('start') or fragment.get('t'))
+    return CanonicalURL(raw_url, video_id, f"https://www.youtube.com/watch?v={video_id}",
+                        start, params.get('list'), None)
+
+
+def video_id(raw_url):
+    """返回影片 ID，無法解析時返回 None"""
+    return canonicalize(raw_url).video_id
+
+
+def canonicalize_many(raw_urls):
+    """批次解析並依影片 ID 去除重複（保留第一次出現的順序）
+
+    Returns:
+        dict：
+            unique: 不重複的 CanonicalURL 列表
+            duplicates: 重複出現的數量
+            invalid: 無法解析的 CanonicalURL 列表
+    """
+    unique, invalid, seen = [], [], set()
+    duplicates = 0
+    for raw in raw_urls:
+        result = canonicalize(raw)
+        if result.video_id is None:
+            invalid.append(result)
+        elif result.video_id in seen:
+            duplicates += 1
+        else:
+            seen.add(result.video_id)
+            unique.append(result)
+    return {'unique': unique, 'duplicates': duplicates, 'invalid': invalid}
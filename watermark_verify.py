@@ -0,0 +1,186 @@
+"""加浮水印後的輸出檢查：通過後才刪除原始檔
+
+1. 時長需與來源一致；兩邊都有確切幀數（nb_frames）時幀數也需一致（segment_encode.verify_output）
+2. 在數個取樣時間點解碼來源與輸出的 Logo 區域，將 Logo 以 alpha 合成到來源畫面上
+   得到預期結果，與輸出逐像素比較（NumPy 向量運算）
+
+所有取樣幀由同一個 ffmpeg 行程裁切成 Logo 大小後以 rawvideo 輸出，只傳回幾個小區塊，
+耗時遠小於編碼本身。沒有安裝 NumPy 時只做第 1 項檢查。
+"""
+import os
+import json
+import logging
+import functools
+import subprocess
+
+try:
+    import numpy as np
+except ImportError:  # 選用相依套件
+    np = None
+
+import metrics
+import media_probe
+import segment_encode
+
+logger = logging.getLogger(__name__)
+
+# Logo 不透明部分（alpha 超過此值）才納入比較
+ALPHA_THRESHOLD = 0.5
+# 輸出與預期合成結果的平均絕對誤差上限（0-255）；有損編碼與色度抽樣會造成少量誤差
+MAX_ERROR = 20.0
+# 預期結果與來源差異小於此值時（Logo 與背景顏色相近）該幀無法判斷，不計入
+MIN_CONTRAST = 10.0
+
+
+def sample_times(duration, count):
+    """均勻分布且避開片頭片尾的取樣時間點"""
+    return [duration * (i + 0.5) / count for i in range(count)]
+
+
+def keyframe_times(file_path, times):
+    """各時間點之前最近的關鍵幀時間（相對於檔案開頭）；只讀取每個位置的第一個封包，失敗時返回 None
+
+    輸出的 GOP 通常比來源長（x264 預設 250 幀），在輸出的關鍵幀取樣可以避免解碼整個 GOP。
+    """
+    intervals = ','.join(f'{t:.3f}%+#1' for t in times)
+    try:
+        result = subprocess.run(
+            [media_probe.get_ffprobe_path(), '-v', 'error', '-select_streams', 'v:0',
+             '-read_intervals', intervals, '-show_entries', 'packet=pts_time,flags:format=start_time',
+             '-print_format', 'json', file_path],
+            capture_output=True, text=True, timeout=30)
+        if result.returncode != 0:
+            return None
+        data = json.loads(result.stdout)
+        start = float(data.get('format', {}).get('start_time') or 0)
+        keyframes = {round(float(packet['pts_time']) - start, 6) for packet in data.get('packets', [])
+                     if 'K' in packet.get('flags', '') and packet.get('pts_time') not in (None, 'N/A')}
+    except (OSError, subprocess.SubprocessError, ValueError, KeyError):
+        return None
+    return sorted(keyframes) or None
+
+
+@functools.lru_cache(maxsize=8)
+def _load_logo(ffmpeg_path, logo_path, mtime_ns, width, height):
+    """以 ffmpeg 將 Logo 縮放到浮水印大小並解碼為 RGBA（與浮水印濾鏡相同的縮放）"""
+    result = subprocess.run(
+        [ffmpeg_path, '-hide_banner', '-loglevel', 'error', '-i', logo_path,
+         '-vf', f'scale={width}:{height},format=rgba', '-frames:v', '1',
+         '-f', 'rawvideo', '-'],
+        capture_output=True, timeout=30)
+    if result.returncode != 0 or len(result.stdout) != width * height * 4:
+        return None
+    logo = np.frombuffer(result.stdout, dtype=np.uint8).reshape(height, width, 4).astype(np.float32)
+    return logo[..., :3], logo[..., 3:] / 255.0
+
+
+def build_crop_command(ffmpeg_path, source_file, output_file, times, position):
+    """在每個時間點裁切來源與輸出的 Logo 區域，垂直拼成一張 rawvideo RGB 圖
+
+    輸出順序為 來源1、輸出1、來源2、輸出2 ……
+    """
+    command = [ffmpeg_path, '-hide_banner', '-loglevel', 'error']
+    for timestamp in times:
+        for path in (source_file, output_file):
+            command += ['-ss', f'{timestamp:.6f}', '-i', path]
+    # 先轉成 RGB 再裁切，避免 yuv420 的偶數座標對齊
+    crop = 'format=rgb24,crop={scale_width}:{scale_height}:{x}:{y}:exact=1,setsar=1'.format(**position)
+    inputs = len(times) * 2
+    graph = ';'.join(f'[{i}:v:0]{crop}[c{i}]' for i in range(inputs))
+    graph += ';' + ''.join(f'[c{i}]' for i in range(inputs)) + f'vstack=inputs={inputs}[out]'
+    command += ['-filter_complex', graph, '-map', '[out]', '-frames:v', '1',
+                '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-']
+    return command
+
+
+def compare_logo(source, output, logo_rgb, logo_alpha):
+    """比較單一取樣幀的 Logo 區域
+
+    Returns:
+        dict：error（輸出與預期的平均誤差）、source_error（輸出與來源）、contrast（預期與來源）
+    """
+    mask = logo_alpha[..., 0] >= ALPHA_THRESHOLD
+    if not mask.any():
+        return None
+    expected = source * (1.0 - logo_alpha) + logo_rgb * logo_alpha
+    return {
+        'error': float(np.abs(output - expected)[mask].mean()),
+        'source_error': float(np.abs(output - source)[mask].mean()),
+        'contrast': float(np.abs(expected - source)[mask].mean()),
+    }
+
+
+def check_logo(ffmpeg_path, source_file, output_file, logo_path, position, source_info, samples):
+    """取樣比對 Logo 區域，返回 (是否通過, 原因)；無法判斷時視為通過"""
+    width, height = position['scale_width'], position['scale_height']
+    duration, fps = source_info['duration'], source_info['fps'] or 30
+    try:
+        logo = _load_logo(ffmpeg_path, logo_path, os.stat(logo_path).st_mtime_ns, width, height)
+    except (OSError, subprocess.SubprocessError):
+        logo = None
+    if logo is None:
+        return True, '無法解碼 Logo，略過畫面比對'
+
+    times = sample_times(duration, samples)
+    keyframes = keyframe_times(output_file, times)
+    if keyframes:
+        # 取關鍵幀之後半幀的位置：輸出只需解碼關鍵幀與下一幀，兩邊仍是同一時間的畫面
+        times = [t + 0.5 / fps for t in keyframes]
+    try:
+        result = subprocess.run(build_crop_command(ffmpeg_path, source_file, output_file, times, position),
+                                capture_output=True, timeout=120)
+    except (OSError, subprocess.SubprocessError) as e:
+        return False, f'無法解碼取樣幀：{e}'
+    frame_bytes = width * height * 3
+    if result.returncode != 0 or len(result.stdout) != frame_bytes * len(times) * 2:
+        return False, '無法解碼取樣幀'
+
+    crops = np.frombuffer(result.stdout, dtype=np.uint8).reshape(len(times) * 2, height, width, 3)
+    crops = crops.astype(np.float32)
+    checked = 0
+    for i, timestamp in enumerate(times):
+        stats = compare_logo(crops[2 * i], crops[2 * i + 1], *logo)
+        if stats is None:
+            return True, 'Logo 沒有不透明區域，略過畫面比對'
+        if stats['contrast'] < MIN_CONTRAST:
+            continue
+        checked += 1
+        if stats['error'] > MAX_ERROR or stats['error'] >= stats['source_error']:
+            return False, (f"{timestamp:.1f}s 的 Logo 區域與預期不符"
+                           f"（誤差 {stats['error']:.1f}，與來源差 {stats['source_error']:.1f}）")
+    if not checked:
+        return True, 'Logo 與背景過於相近，無法比對'
+    return True, ''
+
+
+def verify(ffmpeg_path, source_file, output_file, logo_path, position, samples=3):
+    """檢查加浮水印的輸出，返回 (是否通過, 原因)
+
+    Args:
+        position: 浮水印位置與大小（core.get_watermark_position 的結果）
+        samples: 比對的取樣幀數；0 或未安裝 NumPy 時只檢查時長與幀數
+    """
+    if not media_probe.check_ffprobe_available():
+        # 沒有 ffprobe 無法檢查；不能因此丟棄已完成的編碼
+        logger.warning("⚠️ ffprobe 不可用，略過浮水印輸出檢查")
+        return True, 'ffprobe 不可用，略過檢查'
+    with metrics.span(metrics.current_job(), 'watermark_verify', frames=samples) as span:
+        source_info = media_probe.probe(source_file)
+        if source_info is None or media_probe.probe(output_file) is None:
+            # 無法探測視為無法判斷，而不是檢查失敗
+            ok, reason = True, '無法探測來源或輸出，略過檢查'
+            logger.warning("⚠️ 無法探測 %s 或 %s，略過浮水印輸出檢查", source_file, output_file)
+        else:
+            ok, reason = segment_encode.verify_output(source_info, output_file)
+        if ok and source_info and samples and media_probe.has_video(source_info) and source_info['duration']:
+            if np is None:
+                logger.debug("NumPy not installed, skipping logo comparison")
+            else:
+                ok, reason = check_logo(ffmpeg_path, source_file, output_file, logo_path, position,
+                                        source_info, samples)
+        span['ok'] = ok
+    if not ok:
+        logger.warning("⚠️ 浮水印檢查未通過：%s（%s）", output_file, reason)
+    elif reason:
+        logger.debug("Watermark check %s: %s", output_file, reason)
+    return ok, reason